@@ -4,8 +4,8 @@ from fastapi import APIRouter
 from loguru import logger
 
 from .crud import db
-from .router import all_routers, nostr_client
-from .tasks import check_relays, init_relays, subscribe_events
+from .router import all_routers, ipc_leader, nostr_client, vanity_miners
+from .tasks import check_relays, expire_events, init_relays, subscribe_events
 from .views import nostrclient_generic_router
 from .views_api import nostrclient_api_router
 
@@ -36,7 +36,11 @@ async def nostrclient_stop():
         except Exception as e:
             logger.error(e)
 
+    for miner in vanity_miners.values():
+        miner.cancel()
+
     nostr_client.close()
+    ipc_leader.stop()
 
 
 def nostrclient_start():
@@ -47,7 +51,8 @@ def nostrclient_start():
         "ext_nostrclient_subscrive_events", subscribe_events
     )
     task3 = create_permanent_unique_task("ext_nostrclient_check_relays", check_relays)
-    scheduled_tasks.extend([task1, task2, task3])
+    task4 = create_permanent_unique_task("ext_nostrclient_expire_events", expire_events)
+    scheduled_tasks.extend([task1, task2, task3, task4])
 
 
 __all__ = [
@@ -0,0 +1,176 @@
+import json
+import os
+import resource
+import statistics
+import time
+import timeit
+from collections.abc import Callable
+
+import pytest
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("nostrclient benchmarks")
+    group.addoption("--bench-clients", type=int, default=10)
+    group.addoption("--bench-relays", type=int, default=3)
+    group.addoption("--bench-rate", type=float, default=50, help="events/s per relay")
+    group.addoption("--bench-history", type=int, default=100)
+    group.addoption("--bench-duration", type=float, default=10, help="seconds")
+    group.addoption(
+        "--bench-capture", default=None, help="relay capture file to replay"
+    )
+    group.addoption(
+        "--bench-replay-speed",
+        type=float,
+        default=0,
+        help="replay speed multiplier, 0 replays without pauses",
+    )
+    group.addoption("--bench-output", default=None, help="write the report as JSON")
+    group.addoption(
+        "--bench-baseline", default=None, help="compare micro benchmarks to this file"
+    )
+    group.addoption(
+        "--bench-save-baseline", default=None, help="save micro benchmark results"
+    )
+    group.addoption(
+        "--bench-max-regression",
+        type=float,
+        default=0.25,
+        help="allowed slowdown against the baseline (0.25 = 25%%)",
+    )
+    group.addoption("--bench-min-throughput", type=float, default=None)
+    group.addoption("--bench-max-p99-ms", type=float, default=None)
+
+
+class BenchReport:
+    """Collects throughput, latency, CPU and memory figures for one run."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.events = 0
+        self.latencies: list[float] = []
+        self.extra: dict = {}
+        self._wall = 0.0
+        self._cpu = 0.0
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *_):
+        self._wall = time.perf_counter() - self._wall
+        self._cpu = time.process_time() - self._cpu
+
+    def percentile(self, p: int) -> float | None:
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else None
+        return statistics.quantiles(self.latencies, n=100)[p - 1]
+
+    def as_dict(self) -> dict:
+        def ms(value: float | None) -> float | None:
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            "name": self.name,
+            "events": self.events,
+            "duration_s": round(self._wall, 3),
+            "throughput_eps": round(self.events / self._wall, 1) if self._wall else 0,
+            "latency_p50_ms": ms(self.percentile(50)),
+            "latency_p99_ms": ms(self.percentile(99)),
+            "cpu_s": round(self._cpu, 3),
+            "cpu_percent": round(100 * self._cpu / self._wall, 1) if self._wall else 0,
+            # ru_maxrss is in kilobytes on Linux
+            "max_rss_mb": round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+            ),
+            **self.extra,
+        }
+
+
+@pytest.fixture
+def bench_report(request):
+    """Yields a report factory; reports are printed, saved and checked on teardown."""
+    reports: list[BenchReport] = []
+
+    def factory(name: str) -> BenchReport:
+        report = BenchReport(name)
+        reports.append(report)
+        return report
+
+    yield factory
+
+    config = request.config
+    results = [r.as_dict() for r in reports]
+    for result in results:
+        print("\n" + json.dumps(result, indent=2))
+
+    output = config.getoption("--bench-output")
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    min_throughput = config.getoption("--bench-min-throughput")
+    max_p99 = config.getoption("--bench-max-p99-ms")
+    for result in results:
+        if min_throughput is not None:
+            assert (
+                result["throughput_eps"] >= min_throughput
+            ), f"{result['name']}: throughput below {min_throughput} events/s"
+        if max_p99 is not None and result["latency_p99_ms"] is not None:
+            assert (
+                result["latency_p99_ms"] <= max_p99
+            ), f"{result['name']}: p99 latency above {max_p99} ms"
+
+
+@pytest.fixture
+def micro_benchmark(request):
+    """
+    Times a callable with `timeit` (best of 5 repeats) and compares the result
+    with a stored baseline, e.g.:
+
+        uv run pytest benchmarks/test_micro.py --bench-save-baseline baseline.json
+        uv run pytest benchmarks/test_micro.py --bench-baseline baseline.json
+    """
+    results: dict[str, float] = {}
+
+    def run(name: str, func: Callable, *args) -> float:
+        timer = timeit.Timer(lambda: func(*args))
+        number, _ = timer.autorange()
+        results[name] = min(timer.repeat(repeat=5, number=number)) / number
+        return results[name]
+
+    yield run
+
+    config = request.config
+    for name, seconds in results.items():
+        print(f"\n{name}: {seconds * 1_000_000:.2f} us/op ({1 / seconds:.0f} ops/s)")
+
+    save_path = config.getoption("--bench-save-baseline")
+    if save_path:
+        saved = {}
+        if os.path.exists(save_path):
+            with open(save_path) as f:
+                saved = json.load(f)
+        saved.update(results)
+        with open(save_path, "w") as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+
+    baseline_path = config.getoption("--bench-baseline")
+    if baseline_path:
+        if not os.path.exists(baseline_path):
+            pytest.fail(
+                f"no baseline at {baseline_path}, "
+                "save one first with --bench-save-baseline (make bench-baseline)"
+            )
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        max_regression = config.getoption("--bench-max-regression")
+        for name, seconds in results.items():
+            if name not in baseline:
+                continue
+            limit = baseline[name] * (1 + max_regression)
+            assert seconds <= limit, (
+                f"{name}: {seconds * 1e6:.2f} us/op is slower than the baseline "
+                f"{baseline[name] * 1e6:.2f} us/op"
+            )
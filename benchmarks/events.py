@@ -0,0 +1,61 @@
+"""Realistic events for the micro benchmarks, signed with a fixed key."""
+
+import json
+import secrets
+
+from ..nostr.event import Event
+from ..nostr.key import PrivateKey
+
+private_key = PrivateKey(bytes.fromhex("11" * 32))
+
+
+def small_note() -> Event:
+    return Event(content="gm nostr, zaps welcome ⚡", kind=1, created_at=1700000000)
+
+
+def product_listing() -> Event:
+    """A NIP-15 product with a long description, images and shipping zones."""
+    product = {
+        "id": "product-1",
+        "stall_id": "stall-1",
+        "name": "Hand made ceramic mug",
+        "description": "Wheel thrown stoneware mug, glazed by hand. " * 80,
+        "images": [f"https://example.com/images/mug-{i}.jpg" for i in range(10)],
+        "currency": "sat",
+        "price": 21000,
+        "quantity": 12,
+        "specs": [[f"spec {i}", f"value {i}"] for i in range(20)],
+        "shipping": [{"id": f"zone-{i}", "cost": i * 1000} for i in range(10)],
+    }
+    return Event(
+        content=json.dumps(product),
+        kind=30018,
+        tags=[["d", "product-1"], ["t", "ceramics"], ["t", "kitchen"]],
+        created_at=1700000000,
+    )
+
+
+def tag_heavy() -> Event:
+    """A contact list following 1000 public keys."""
+    tags = [
+        ["p", secrets.token_hex(32), "wss://relay.example.com"] for _ in range(1000)
+    ]
+    return Event(content="{}", kind=3, tags=tags, created_at=1700000000)
+
+
+EVENTS = {
+    "small_note": small_note,
+    "product_listing": product_listing,
+    "tag_heavy": tag_heavy,
+}
+
+
+def signed_event(name: str) -> Event:
+    event = EVENTS[name]()
+    private_key.sign_event(event)
+    return event
+
+
+def relay_frame(event: Event, subscription_id: str = "sub") -> str:
+    message = json.loads(event.to_message())
+    return json.dumps(["EVENT", subscription_id, message[1]])
@@ -0,0 +1,98 @@
+"""
+Load benchmark: N client websockets connected to `ws_relay` multiplexing M fake
+relays. Runs offline, e.g.:
+
+    uv run pytest benchmarks/test_load.py -s --bench-clients 50 --bench-relays 5
+"""
+
+import asyncio
+import json
+import time
+
+import pytest
+import uvicorn
+from fastapi import FastAPI
+from websockets.asyncio.client import connect
+
+from .. import views_api
+from ..models import Config
+from ..router import nostr_client
+from ..tasks import subscribe_events
+from ..tests.fake_relay import FakeRelay, make_event
+
+
+async def run_client(index: int, url: str, duration: float, report):
+    sub_id = f"bench-{index}"
+    async with connect(url, max_size=None) as ws:
+        await ws.send(json.dumps(["REQ", sub_id, {"kinds": [1]}]))
+        deadline = time.monotonic() + duration
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                frame = await asyncio.wait_for(ws.recv(), remaining)
+            except asyncio.TimeoutError:
+                break
+            message = json.loads(frame)
+            if message[0] != "EVENT":
+                continue
+            report.events += 1
+            stamp = next((t[1] for t in message[2]["tags"] if t[0] == "bench"), None)
+            if stamp:
+                report.latencies.append(time.time() - float(stamp))
+        await ws.send(json.dumps(["CLOSE", sub_id]))
+
+
+@pytest.mark.asyncio
+async def test_ws_relay_load(request, monkeypatch, bench_report):
+    option = request.config.getoption
+    num_clients = option("--bench-clients")
+    num_relays = option("--bench-relays")
+    duration = option("--bench-duration")
+
+    async def get_config(owner_id: str):
+        return Config(public_ws=True, private_ws=False)
+
+    monkeypatch.setattr(views_api, "get_config", get_config)
+
+    # the same history on every relay exercises the dedupe path
+    history = [make_event(f"history {i}") for i in range(option("--bench-history"))]
+    fake_relays = [
+        FakeRelay(event_rate=option("--bench-rate"), history=history)
+        for _ in range(num_relays)
+    ]
+    relay_urls = [await r.start() for r in fake_relays]
+
+    app = FastAPI()
+    app.include_router(views_api.nostrclient_api_router)
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning")
+    )
+    server_task = asyncio.create_task(server.serve())
+    try:
+        while not server.started:
+            await asyncio.sleep(0.05)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        ws_url = f"ws://127.0.0.1:{port}/api/v1/relay"
+
+        nostr_client.reconnect(relay_urls)
+        relays = nostr_client.relay_manager.relays.values()
+        while not all(r.connected for r in relays):
+            await asyncio.sleep(0.05)
+        await subscribe_events()
+
+        with bench_report("ws_relay_load") as report:
+            report.extra = {
+                "clients": num_clients,
+                "relays": num_relays,
+                "relay_event_rate": option("--bench-rate"),
+            }
+            await asyncio.gather(
+                *[run_client(i, ws_url, duration, report) for i in range(num_clients)]
+            )
+        assert report.events, "No events delivered to the clients"
+    finally:
+        # the fake relays share this event loop, do not block it while closing
+        await asyncio.to_thread(nostr_client.close)
+        server.should_exit = True
+        await server_task
+        for r in fake_relays:
+            await r.stop()
@@ -0,0 +1,96 @@
+"""
+Micro benchmarks for the per-message hot code:
+
+    uv run pytest benchmarks/test_micro.py -s --bench-baseline baseline.json
+"""
+
+import pytest
+
+from ..helpers import normalize_public_key
+from ..nostr import nip19
+from ..nostr.event import Event
+from ..nostr.key import PrivateKey, PublicKey
+from ..nostr.message_pool import MessagePool
+from .events import EVENTS, private_key, relay_frame, signed_event
+
+URL = "wss://relay.example.com"
+
+
+@pytest.mark.parametrize("name", EVENTS.keys())
+def test_process_message(name, micro_benchmark):
+    frame = relay_frame(signed_event(name))
+
+    def accept():
+        MessagePool()._process_message(frame, URL)
+
+    pool = MessagePool()
+    pool._process_message(frame, URL)
+
+    micro_benchmark(f"process_message[{name}]", accept)
+    micro_benchmark(
+        f"process_message_duplicate[{name}]", pool._process_message, frame, URL
+    )
+
+
+@pytest.mark.parametrize("name", EVENTS.keys())
+def test_event_id(name, micro_benchmark):
+    e = signed_event(name)
+    assert e.public_key and e.created_at and e.content
+    args = (e.public_key, e.created_at, e.kind, e.tags, e.content)
+
+    micro_benchmark(f"serialize[{name}]", Event.serialize, *args)
+    micro_benchmark(f"compute_id[{name}]", Event.compute_id, *args)
+    micro_benchmark(f"to_message[{name}]", e.to_message)
+
+
+@pytest.mark.parametrize("name", EVENTS.keys())
+def test_event_signature(name, micro_benchmark):
+    event = signed_event(name)
+    assert event.verify()
+
+    micro_benchmark(f"verify[{name}]", event.verify)
+    micro_benchmark(f"sign_event[{name}]", private_key.sign_event, EVENTS[name]())
+
+
+@pytest.mark.parametrize("size", [32, 1024, 16 * 1024])
+def test_nip04(size, micro_benchmark):
+    peer = PrivateKey(bytes.fromhex("22" * 32))
+    message = "x" * size
+    encrypted = private_key.encrypt_message(message, peer.public_key.hex())
+    assert peer.decrypt_message(encrypted, private_key.public_key.hex()) == message
+
+    micro_benchmark(
+        f"encrypt_message[{size}]",
+        private_key.encrypt_message,
+        message,
+        peer.public_key.hex(),
+    )
+    micro_benchmark(
+        f"decrypt_message[{size}]",
+        peer.decrypt_message,
+        encrypted,
+        private_key.public_key.hex(),
+    )
+
+
+def test_bech32(micro_benchmark):
+    npub = private_key.public_key.bech32()
+    nsec = private_key.bech32()
+
+    micro_benchmark("npub_encode", private_key.public_key.bech32)
+    micro_benchmark("npub_decode", PublicKey.from_npub, npub)
+    micro_benchmark("nsec_decode", PrivateKey.from_nsec, nsec)
+    micro_benchmark("normalize_public_key[npub]", normalize_public_key, npub)
+    micro_benchmark(
+        "normalize_public_key[hex]", normalize_public_key, private_key.public_key.hex()
+    )
+
+
+def test_nip19_batch(micro_benchmark):
+    keys = [PrivateKey().public_key.hex() for _ in range(1000)]
+    npubs = nip19.encode_keys("npub", keys)
+    nevent = nip19.encode_nevent(keys[0], [URL], keys[1], 1)
+
+    micro_benchmark("nip19_encode_keys[1000]", nip19.encode_keys, "npub", keys)
+    micro_benchmark("nip19_decode_keys[1000]", nip19.decode_keys, npubs, "npub")
+    micro_benchmark("nip19_decode_nevent", nip19.decode_entity, nevent)
@@ -0,0 +1,46 @@
+"""
+Replays captured relay traffic (see `PUT /api/v1/capture`) into a `MessagePool`:
+
+    uv run pytest benchmarks/test_replay.py -s --bench-capture relays.jsonl.gz
+
+Without a capture file a synthetic duplicate storm is generated and replayed.
+"""
+
+import json
+
+from ..nostr.message_pool import MessagePool, dedupe_total
+from ..nostr.recorder import INBOUND, FrameRecorder, read_frames, replay_frames
+from ..tests.fake_relay import make_event
+
+
+def write_duplicate_storm(path: str, num_relays: int = 5, num_events: int = 2000):
+    """Every relay sends the same events for the same subscription."""
+    recorder = FrameRecorder(path)
+    events = [make_event(f"storm {i}") for i in range(num_events)]
+    for event in events:
+        for relay in range(num_relays):
+            frame = json.dumps(["EVENT", "storm", event])
+            recorder.record(INBOUND, f"wss://relay-{relay}.example", frame)
+    recorder.close()
+
+
+def test_replay_capture(request, tmp_path, bench_report):
+    path = request.config.getoption("--bench-capture")
+    if not path:
+        path = str(tmp_path / "duplicate-storm.jsonl.gz")
+        write_duplicate_storm(path)
+    speed = request.config.getoption("--bench-replay-speed") or None
+
+    message_pool = MessagePool()
+    hits_before = dedupe_total.get(result="hit")
+    with bench_report("replay_capture") as report:
+        report.events = replay_frames(path, message_pool, speed)
+
+    relays = {url for _, direction, url, _ in read_frames(path) if direction == INBOUND}
+    report.extra = {
+        "capture": path,
+        "relays": len(relays),
+        "accepted_events": message_pool.events.qsize(),
+        "duplicates": dedupe_total.get(result="hit") - hits_before,
+    }
+    assert report.events
@@ -1,6 +1,7 @@
-from lnbits.db import Database
+from lnbits.db import Connection, Database
 
 from .models import Config, Relay, UserConfig
+from .nostr.relay_url import normalize_relay_url
 
 db = Database("ext_nostrclient")
 
@@ -12,19 +13,41 @@ async def get_relays() -> list[Relay]:
     )
 
 
-async def add_relay(relay: Relay) -> Relay:
-    await db.insert("nostrclient.relays", relay)
+async def add_relay(relay: Relay, conn: Connection | None = None) -> Relay:
+    if relay.url:
+        relay.url = normalize_relay_url(relay.url)
+    await (conn or db).insert("nostrclient.relays", relay)
     return relay
 
 
-async def delete_relay(relay: Relay) -> None:
+async def delete_relay(relay: Relay, conn: Connection | None = None) -> None:
+    """By `id` if set, otherwise by the URL as stored or in its normalized form"""
+    if relay.id:
+        await (conn or db).execute(
+            "DELETE FROM nostrclient.relays WHERE id = :id", {"id": relay.id}
+        )
+        return
     if not relay.url:
         return
-    await db.execute(
-        "DELETE FROM nostrclient.relays WHERE url = :url", {"url": relay.url}
+    try:
+        normalized = normalize_relay_url(relay.url)
+    except ValueError:
+        normalized = relay.url
+    await (conn or db).execute(
+        "DELETE FROM nostrclient.relays WHERE url = :url OR url = :normalized",
+        {"url": relay.url, "normalized": normalized},
     )
 
 
+async def update_relays(added: list[Relay], removed: list[Relay]) -> None:
+    """Applies both lists on one connection, other writers wait until it is done"""
+    async with db.connect() as conn:
+        for relay in removed:
+            await delete_relay(relay, conn)
+        for relay in added:
+            await add_relay(relay, conn)
+
+
 ######################CONFIG#######################
 async def create_config(owner_id: str) -> Config:
     admin_config = UserConfig(owner_id=owner_id)
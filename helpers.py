@@ -1,19 +1,38 @@
-from bech32 import bech32_decode, convertbits
+import time
+
+from .nostr import nip19
 
 
 def normalize_public_key(pubkey: str) -> str:
     if pubkey.startswith("npub1"):
-        _, decoded_data = bech32_decode(pubkey)
-        if not decoded_data:
-            raise ValueError("Public Key is not valid npub")
-
-        decoded_data_bits = convertbits(decoded_data, 5, 8, False)
-        if not decoded_data_bits:
-            raise ValueError("Public Key is not valid npub")
-        return bytes(decoded_data_bits).hex()
+        try:
+            return nip19.decode_key(pubkey, "npub")
+        except ValueError as ex:
+            raise ValueError("Public Key is not valid npub") from ex
 
     # check if valid hex
     if len(pubkey) != 64:
         raise ValueError("Public Key is not valid hex")
     int(pubkey, 16)
     return pubkey
+
+
+class TokenBucket:
+    """Allows `rate` operations per second on average, in bursts of `capacity`."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def consume(self, tokens: float = 1) -> bool:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
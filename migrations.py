@@ -1,3 +1,6 @@
+from .nostr.relay_url import normalize_relay_url
+
+
 async def m001_initial(db):
     """
     Initial nostrclient table.
@@ -30,3 +33,28 @@ async def m003_update_config_table(db):
     await db.execute(
         "ALTER TABLE nostrclient.config ADD COLUMN owner_id TEXT DEFAULT 'admin'"
     )
+
+
+async def m004_normalize_relay_urls(db):
+    """
+    Store relay URLs in their normalized form and merge the duplicate rows.
+    Rows that are not websocket URLs are deleted, they could never connect.
+    """
+    rows = await db.fetchall("SELECT id, url FROM nostrclient.relays")
+    kept: dict[str, str] = {}
+    for row in rows:
+        try:
+            url = normalize_relay_url(row["url"] or "")
+        except ValueError:
+            url = None
+        if url is None or url in kept:
+            await db.execute(
+                "DELETE FROM nostrclient.relays WHERE id = :id", {"id": row["id"]}
+            )
+            continue
+        kept[url] = row["id"]
+        if url != row["url"]:
+            await db.execute(
+                "UPDATE nostrclient.relays SET url = :url WHERE id = :id",
+                {"url": url, "id": row["id"]},
+            )
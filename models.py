@@ -6,6 +6,11 @@ class RelayStatus(BaseModel):
     num_sent_events: int | None = 0
     num_received_events: int | None = 0
     error_counter: int | None = 0
+    num_rejected_events: int | None = 0
+    num_rejected_frames: int | None = 0
+    # round trip times of the last pings, in milliseconds
+    rtt_mean_ms: int | None = 0
+    rtt_max_ms: int | None = 0
     error_list: list | None = []
     notice_list: list | None = []
 
@@ -26,6 +31,15 @@ class Relay(BaseModel):
             self.id = urlsafe_short_hash()
 
 
+class RelaySet(BaseModel):
+    urls: list[str]
+
+
+class RelaysUpdate(BaseModel):
+    added: list[str] = []
+    removed: list[str] = []
+
+
 class RelayDb(BaseModel):
     id: str
     url: str
@@ -36,6 +50,7 @@ class TestMessage(BaseModel):
     sender_private_key: str | None
     reciever_public_key: str
     message: str
+    encryption: str = "nip04"  # or "nip44"
 
 
 class TestMessageResponse(BaseModel):
@@ -47,6 +62,96 @@ class TestMessageResponse(BaseModel):
 class Config(BaseModel):
     private_ws: bool = True
     public_ws: bool = False
+    # share of relay events that record per-stage latency (0 disables tracing)
+    trace_sample_rate: float = Field(default=0.0, ge=0, le=1)
+    # check the id and signature of relay events before forwarding them
+    verify_events: bool = False
+    # deliver only the newest version of replaceable events (kind 0, 3, 1xxxx, 3xxxx)
+    collapse_replaceable: bool = False
+    # drop events deleted by their author (NIP-09) or expired (NIP-40)
+    drop_deleted_and_expired: bool = False
+    # relay frames above this size (in characters) are dropped unparsed
+    max_frame_size: int = Field(default=512 * 1024, ge=1024)
+    # disconnect relays when a larger share of their frames is invalid
+    max_junk_ratio: float = Field(default=0.5, ge=0, le=1)
+    # one worker process owns the relay connections, the others attach to it
+    # (takes effect on restart)
+    share_relay_connections: bool = False
+    # resubscribe with NIP-77 (negentropy), only the missing events are downloaded
+    negentropy_sync: bool = False
+    # threads parsing relay frames (0 parses them on the relay connection threads)
+    ingestion_workers: int = Field(default=0, ge=0, le=16)
+    # relay frames waiting for each ingestion thread, a full queue slows down the
+    # relay connections, events that still do not fit are dropped
+    ingestion_queue_size: int = Field(default=10_000, ge=100)
+    # permessage-deflate on relay connections (applies when a relay reconnects),
+    # client websockets are compressed by uvicorn, see the README
+    relay_compression: bool = False
+    # off: each message is compressed on its own, saves memory, costs ratio
+    relay_compression_context_takeover: bool = True
+    relay_compression_max_window_bits: int = Field(default=15, ge=9, le=15)
+    # seconds without traffic from a relay before pinging it
+    relay_idle_ping_interval: float = Field(default=10, ge=1)
+    # upper bound of the pong timeout, below it the timeout follows the relay RTT
+    relay_max_pong_timeout: float = Field(default=20, ge=1)
+    # seconds a subscription may wait for its first event or EOSE (0 disables)
+    relay_stall_timeout: float = Field(default=60, ge=0)
+    # messages per second sent to each relay (0 is unlimited)
+    relay_max_send_rate: float = Field(default=0, ge=0)
+    # limits for the public websocket clients, 0 disables a limit
+    public_req_per_minute: int = Field(default=60, ge=0)
+    public_event_per_minute: int = Field(default=30, ge=0)
+    public_close_per_minute: int = Field(default=120, ge=0)
+    # the clients of one IP address share this many times the per client rate
+    # (0 disables it), behind a reverse proxy it needs the forwarded client
+    # address, see the README
+    public_ip_rate_factor: float = Field(default=0, ge=0)
+    public_max_subscriptions: int = Field(default=20, ge=0)
+    public_max_filters: int = Field(default=10, ge=0)
+    public_max_limit: int = Field(default=500, ge=0)
+
+
+class StageLatency(BaseModel):
+    stage: str
+    count: int
+    mean_ms: float | None = None
+    p50_ms: float | None = None
+    p90_ms: float | None = None
+    p99_ms: float | None = None
+
+
+class TracingSummary(BaseModel):
+    sample_rate: float
+    stages: list[StageLatency]
+
+
+class CaptureStatus(BaseModel):
+    recording: bool
+    path: str | None = None
+    num_frames: int = 0
+    started_at: int | None = None
+
+
+class VanityRequest(BaseModel):
+    prefix: str | None = None
+    suffix: str | None = None
+    # give up after this many seconds
+    timeout: float | None = Field(default=None, gt=0)
+    workers: int | None = Field(default=None, ge=1)
+
+
+class VanityStatus(BaseModel):
+    id: str
+    prefix: str
+    suffix: str
+    state: str
+    attempts: int
+    attempts_per_second: float
+    expected_attempts: int
+    elapsed_seconds: float
+    eta_seconds: float | None = None
+    private_key: str | None = None
+    public_key: str | None = None
 
 
 class UserConfig(BaseModel):
@@ -1,17 +1,31 @@
 import asyncio
+from typing import Optional
 
 from loguru import logger
 
+from ..message_pool import EventMessage
 from ..relay_manager import RelayManager
+from ..tracing import tracer
+from ..verifier import EventVerifier
 
 
 class NostrClient:
     relay_manager: RelayManager
     running: bool
+    verifier: Optional[EventVerifier]
 
     def __init__(self):
         self.running = True
         self.relay_manager = RelayManager()
+        self.verifier = None
+
+    def verify_events(self, enabled: bool):
+        """Drop relay events with an invalid id or signature before delivering them"""
+        if enabled and not self.verifier:
+            self.verifier = EventVerifier()
+        elif not enabled and self.verifier:
+            self.verifier.close()
+            self.verifier = None
 
     def connect(self, relays):
         for relay in relays:
@@ -22,13 +36,16 @@ class NostrClient:
         self.running = True
 
     def reconnect(self, relays):
-        self.relay_manager.remove_relays()
-        self.connect(relays)
+        """Only the connections to relays that were added or removed change"""
+        self.relay_manager.set_relays(relays)
+        self.running = True
 
     def close(self):
         try:
             self.relay_manager.close_all_subscriptions()
             self.relay_manager.close_connections()
+            self.relay_manager.stop_recording()
+            self.verify_events(False)
 
             self.running = False
         except Exception as e:
@@ -39,18 +56,34 @@ class NostrClient:
         callback_events_func=None,
         callback_notices_func=None,
         callback_eosenotices_func=None,
+        callback_closed_func=None,
     ):
         while self.running:
-            self._check_events(callback_events_func)
+            await self._check_events(callback_events_func)
             self._check_notices(callback_notices_func)
             self._check_eos_notices(callback_eosenotices_func)
+            self._check_closed_messages(callback_closed_func)
 
             await asyncio.sleep(0.2)
 
-    def _check_events(self, callback_events_func=None):
+    async def _check_events(self, callback_events_func=None):
         try:
+            event_messages: list[EventMessage] = []
             while self.relay_manager.message_pool.has_events():
                 event_msg = self.relay_manager.message_pool.get_event()
+                tracer.mark(event_msg.trace, "dequeued")
+                event_messages.append(event_msg)
+
+            verifier = self.verifier
+            if verifier:
+                verified = await verifier.verify(event_messages)
+                valid = {id(m) for m in verified}
+                for event_msg in event_messages:
+                    if id(event_msg) not in valid:
+                        self.relay_manager.message_pool.forget_event(event_msg)
+                event_messages = verified
+
+            for event_msg in event_messages:
                 if callback_events_func:
                     callback_events_func(event_msg)
         except Exception as e:
@@ -69,7 +102,21 @@ class NostrClient:
         try:
             while self.relay_manager.message_pool.has_eose_notices():
                 event_msg = self.relay_manager.message_pool.get_eose_notice()
+                self.relay_manager.handle_eose(event_msg)
                 if callback_eosenotices_func:
                     callback_eosenotices_func(event_msg)
         except Exception as e:
             logger.debug(e)
+
+    def _check_closed_messages(self, callback_closed_func=None):
+        try:
+            while self.relay_manager.message_pool.has_closed_messages():
+                closed_msg = self.relay_manager.message_pool.get_closed_message()
+                # only reported once no relay serves the subscription anymore
+                if (
+                    self.relay_manager.handle_closed(closed_msg)
+                    and callback_closed_func
+                ):
+                    callback_closed_func(closed_msg)
+        except Exception as e:
+            logger.debug(e)
@@ -0,0 +1,165 @@
+"""
+Relay connections with permessage-deflate (RFC 7692). `websocket-client` cannot
+negotiate compression, so these connections use the `websockets` sync client
+behind the small part of the `WebSocketApp` interface that `Relay` uses.
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from websockets.exceptions import ConnectionClosed
+from websockets.extensions.base import Extension
+from websockets.extensions.permessage_deflate import ClientPerMessageDeflateFactory
+from websockets.sync.client import ClientConnection, connect
+
+from .metrics import metrics
+
+compression_seconds = metrics.counter(
+    "nostrclient_relay_compression_seconds_total",
+    "Time spent compressing and decompressing relay frames",
+    ("operation",),
+)
+compression_bytes = metrics.counter(
+    "nostrclient_relay_compression_bytes_total",
+    "Size of the relay frames before and after permessage-deflate",
+    ("operation", "size"),
+)
+
+
+@dataclass
+class DeflateOptions:
+    enabled: bool = False
+    # a fresh compression context per message saves memory, costs ratio
+    context_takeover: bool = True
+    # 9 to 15, smaller windows save memory on both sides, cost ratio
+    max_window_bits: int = 15
+
+
+class _MeteredExtension(Extension):
+    def __init__(self, extension: Extension) -> None:
+        self.extension = extension
+        self.name = extension.name
+
+    def decode(self, frame, *, max_size=None):
+        # CPU time of this thread, the other relay connections run on their own
+        start = time.thread_time()
+        decoded = self.extension.decode(frame, max_size=max_size)
+        compression_seconds.inc(time.thread_time() - start, operation="decompress")
+        if decoded is not frame:
+            compression_bytes.inc(len(frame.data), operation="decompress", size="in")
+            compression_bytes.inc(len(decoded.data), operation="decompress", size="out")
+        return decoded
+
+    def encode(self, frame):
+        start = time.thread_time()
+        encoded = self.extension.encode(frame)
+        compression_seconds.inc(time.thread_time() - start, operation="compress")
+        if encoded is not frame:
+            compression_bytes.inc(len(frame.data), operation="compress", size="in")
+            compression_bytes.inc(len(encoded.data), operation="compress", size="out")
+        return encoded
+
+
+class _MeteredDeflateFactory(ClientPerMessageDeflateFactory):
+    def process_response_params(self, params, accepted_extensions):
+        extension = super().process_response_params(params, accepted_extensions)
+        return _MeteredExtension(extension)  # type: ignore[return-value]
+
+
+class _PongConnection(ClientConnection):
+    """Reports pongs like `WebSocketApp(on_pong=...)`"""
+
+    on_pong: Optional[Callable[[bytes], None]] = None
+
+    def acknowledge_pings(self, data: bytes) -> None:
+        super().acknowledge_pings(data)
+        if self.on_pong:
+            self.on_pong(data)
+
+
+class DeflateWebSocket:
+    """
+    Drop-in for `WebSocketApp(url, on_open=..., ...).run_forever()`.
+    The relay may decline compression, the connection then works uncompressed.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        options: DeflateOptions,
+        on_open: Callable,
+        on_message: Callable,
+        on_error: Callable,
+        on_close: Callable,
+        on_pong: Callable,
+        max_size: Optional[int] = None,
+    ) -> None:
+        self.url = url
+        self.options = options
+        self.on_open = on_open
+        self.on_message = on_message
+        self.on_error = on_error
+        self.on_close = on_close
+        self.on_pong = on_pong
+        self.max_size = max_size
+        self._connection: Optional[ClientConnection] = None
+
+    @property
+    def compressed(self) -> bool:
+        connection = self._connection
+        extensions = connection.protocol.extensions if connection else []
+        return any(isinstance(e, _MeteredExtension) for e in extensions)
+
+    def _extension_factory(self) -> ClientPerMessageDeflateFactory:
+        bits = self.options.max_window_bits
+        return _MeteredDeflateFactory(
+            server_no_context_takeover=not self.options.context_takeover,
+            client_no_context_takeover=not self.options.context_takeover,
+            server_max_window_bits=bits if bits < 15 else None,
+            client_max_window_bits=bits,
+            compress_settings={"memLevel": 5},
+        )
+
+    def run_forever(self):
+        try:
+            connection = connect(
+                self.url,
+                extensions=[self._extension_factory()],
+                compression=None,
+                ping_interval=None,  # pings are sent by `Relay.check_heartbeat`
+                max_size=self.max_size,
+                create_connection=_PongConnection,
+            )
+        except Exception as e:
+            self.on_error(self, e)
+            return
+
+        connection.on_pong = lambda data: self.on_pong(self, data)
+        self._connection = connection
+        self.on_open(self)
+        try:
+            for message in connection:
+                if isinstance(message, bytes):
+                    message = message.decode()
+                self.on_message(self, message)
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            self.on_error(self, e)
+        finally:
+            self.on_close(self, connection.close_code, connection.close_reason)
+
+    def send(self, message: str):
+        if not self._connection:
+            raise ConnectionError("Not connected")
+        self._connection.send(message)
+
+    def ping(self, payload: bytes):
+        if not self._connection:
+            raise ConnectionError("Not connected")
+        self._connection.ping(payload)
+
+    def close(self):
+        if self._connection:
+            self._connection.close()
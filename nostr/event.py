@@ -19,7 +19,11 @@ class EventKind(IntEnum):
     DELETE = 5
 
 
-@dataclass
+# fields that are part of the serialized event (and of its id)
+_SERIALIZED_FIELDS = frozenset(("public_key", "created_at", "kind", "tags", "content"))
+
+
+@dataclass(slots=True)
 class Event:
     content: Optional[str] = None
     public_key: Optional[str] = None
@@ -30,6 +34,19 @@ class Event:
     )  # Dataclasses require special handling when the default value is a mutable type
     signature: Optional[str] = None
 
+    # memoized serialization and id, reset when a serialized field is assigned,
+    # callers that edit `tags` in place must call `invalidate`
+    _serialized: Optional[bytes] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _id: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+    def __setattr__(self, name, value):
+        if name in _SERIALIZED_FIELDS:
+            object.__setattr__(self, "_serialized", None)
+            object.__setattr__(self, "_id", None)
+        object.__setattr__(self, name, value)
+
     def __post_init__(self):
         if self.content is not None and not isinstance(self.content, str):
             # DMs initialize content to None but all other kinds should pass in a str
@@ -54,23 +71,39 @@ class Event:
             Event.serialize(public_key, created_at, kind, tags, content)
         ).hexdigest()
 
+    @property
+    def serialized(self) -> bytes:
+        if self._serialized is None:
+            assert self.public_key
+            assert self.created_at
+            assert self.content
+            self._serialized = Event.serialize(
+                self.public_key, self.created_at, self.kind, self.tags, self.content
+            )
+            self._id = None
+        return self._serialized
+
     @property
     def id(self) -> str:
-        # Always recompute the id to reflect the up-to-date state of the Event
-        assert self.public_key
-        assert self.created_at
-        assert self.content
-        return Event.compute_id(
-            self.public_key, self.created_at, self.kind, self.tags, self.content
-        )
+        serialized = self.serialized
+        if self._id is None:
+            self._id = sha256(serialized).hexdigest()
+        return self._id
+
+    def invalidate(self):
+        """Forget the memoized serialization and id, e.g. after editing `tags`"""
+        self._serialized = None
+        self._id = None
 
     def add_pubkey_ref(self, pubkey: str):
         """Adds a reference to a pubkey as a 'p' tag"""
         self.tags.append(["p", pubkey])
+        self.invalidate()
 
     def add_event_ref(self, event_id: str):
         """Adds a reference to an event_id as an 'e' tag"""
         self.tags.append(["e", event_id])
+        self.invalidate()
 
     def verify(self) -> bool:
         assert self.public_key
@@ -99,11 +132,21 @@ class Event:
         )
 
 
+class Encryption:
+    NIP04 = "nip04"
+    NIP44 = "nip44"
+
+    @staticmethod
+    def is_valid(encryption: str) -> bool:
+        return encryption in (Encryption.NIP04, Encryption.NIP44)
+
+
 @dataclass
 class EncryptedDirectMessage(Event):
     recipient_pubkey: Optional[str] = None
     cleartext_content: Optional[str] = None
     reference_event_id: Optional[str] = None
+    encryption: str = Encryption.NIP04
 
     def __post_init__(self):
         if self.content is not None:
@@ -113,6 +156,9 @@ class EncryptedDirectMessage(Event):
         if self.recipient_pubkey is None:
             raise Exception("Must specify a recipient_pubkey.")
 
+        if not Encryption.is_valid(self.encryption):
+            raise ValueError(f"Unknown encryption: '{self.encryption}'.")
+
         self.kind = EventKind.ENCRYPTED_DIRECT_MESSAGE
         super().__post_init__()
 
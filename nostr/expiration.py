@@ -0,0 +1,169 @@
+import time
+import weakref
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Generic, Iterable, List, Optional, Tuple, TypeVar
+
+from .event import EventKind
+from .message_pool import EventMessage
+from .replaceable import is_parameterized_replaceable, is_replaceable
+
+T = TypeVar("T")
+
+
+class TimerWheel(Generic[T]):
+    """
+    Hashed timer wheel: scheduling is O(1) and `advance` only visits the slots
+    that elapsed since the last call. Items due more than one rotation ahead
+    stay in their slot until the wheel comes around to their round.
+    """
+
+    def __init__(self, num_slots: int = 3600, resolution: float = 1.0) -> None:
+        self.num_slots = num_slots
+        self.resolution = resolution
+        self._slots: List[List[Tuple[float, T]]] = [[] for _ in range(num_slots)]
+        self._tick = int(time.time() / resolution)
+        self._lock = Lock()
+        self.size = 0
+
+    def schedule(self, at: float, item: T):
+        tick = max(int(at / self.resolution), self._tick)
+        with self._lock:
+            self._slots[tick % self.num_slots].append((at, item))
+            self.size += 1
+
+    def advance(self, now: Optional[float] = None) -> List[T]:
+        """Returns the items that are due, in no particular order"""
+        now = time.time() if now is None else now
+        target = int(now / self.resolution)
+        due: List[T] = []
+        with self._lock:
+            # a full rotation visits every slot once
+            first = max(self._tick, target - self.num_slots + 1)
+            for tick in range(first, target + 1):
+                slot = self._slots[tick % self.num_slots]
+                if not slot:
+                    continue
+                due.extend(item for at, item in slot if at <= now)
+                slot[:] = [(at, item) for at, item in slot if at > now]
+            self._tick = target
+            self.size -= len(due)
+        return due
+
+
+def get_expiration(event: dict) -> Optional[int]:
+    """The NIP-40 `expiration` timestamp of an event, if any"""
+    for tag in event.get("tags", []):
+        if len(tag) > 1 and tag[0] == "expiration":
+            try:
+                return int(tag[1])
+            except ValueError:
+                return None
+    return None
+
+
+def get_address(event: dict) -> str:
+    """The NIP-01 `kind:pubkey:d` address used by `a` tags"""
+    d_tag = next(
+        (t[1] for t in event.get("tags", []) if len(t) > 1 and t[0] == "d"), ""
+    )
+    return f"{event.get('kind')}:{event.get('pubkey')}:{d_tag}"
+
+
+class DeadEvents:
+    """
+    Tracks NIP-09 deletions and NIP-40 expirations of relay events.
+    Deleted ids are kept in a bounded LRU, expiring events are scheduled on a
+    `TimerWheel` through weak references, so delivered events are not retained.
+    """
+
+    def __init__(self, max_deletions: int = 100_000, num_slots: int = 3600) -> None:
+        self.enabled = False
+        self.max_deletions = max_deletions
+        # (event id or address, pubkey of the deletion) -> created_at of the deletion,
+        # deletions by other authors must not hide the deletion by the author
+        self._deleted: OrderedDict[Tuple[str, str], int] = OrderedDict()
+        self._wheel: TimerWheel[Callable[[], Optional[EventMessage]]] = TimerWheel(
+            num_slots
+        )
+        self._lock = Lock()
+
+    @property
+    def num_deletions(self) -> int:
+        return len(self._deleted)
+
+    @property
+    def num_scheduled(self) -> int:
+        return self._wheel.size
+
+    def check(
+        self, event_message: EventMessage, now: Optional[float] = None
+    ) -> Optional[str]:
+        """Returns the reason the event must not be delivered, `None` otherwise"""
+        event = event_message.data
+        expiration = get_expiration(event)
+        if expiration is not None and expiration <= (now or time.time()):
+            return "expired"
+        if self.is_deleted(event):
+            return "deleted"
+        return None
+
+    def add(self, event_message: EventMessage) -> List[str]:
+        """
+        Records deletions and schedules the expiration of an accepted event.
+        Returns the ids and addresses the event deletes.
+        """
+        event = event_message.data
+        expiration = get_expiration(event)
+        if expiration is not None:
+            self._wheel.schedule(expiration, weakref.ref(event_message))
+        if event.get("kind") != EventKind.DELETE:
+            return []
+
+        pubkey, created_at = event.get("pubkey", ""), event.get("created_at", 0)
+        targets = [
+            t[1] for t in event.get("tags", []) if len(t) > 1 and t[0] in ("e", "a")
+        ]
+        with self._lock:
+            for target in targets:
+                key = (target, pubkey)
+                self._deleted[key] = max(self._deleted.get(key, 0), created_at)
+                self._deleted.move_to_end(key)
+            while len(self._deleted) > self.max_deletions:
+                self._deleted.popitem(last=False)
+        return targets
+
+    def is_deleted(self, event: dict) -> bool:
+        """Only the author can delete an event (NIP-09)"""
+        pubkey = event.get("pubkey", "")
+        if (event.get("id", ""), pubkey) in self._deleted:
+            return True
+        kind = event.get("kind", 0)
+        if not (is_replaceable(kind) or is_parameterized_replaceable(kind)):
+            return False
+        deleted_at = self._deleted.get((get_address(event), pubkey))
+        # an address deletion only covers the versions created before it
+        return deleted_at is not None and event.get("created_at", 0) <= deleted_at
+
+    def suppress_deleted(self, event_messages: Iterable[EventMessage]) -> int:
+        count = 0
+        for event_message in event_messages:
+            if not event_message.suppressed and self.is_deleted(event_message.data):
+                event_message.suppressed = "deleted"
+                count += 1
+        return count
+
+    def advance(self, now: Optional[float] = None) -> List[EventMessage]:
+        """Marks the events that expired since the last call as suppressed"""
+        expired = []
+        for ref in self._wheel.advance(now):
+            event_message = ref()
+            if event_message and not event_message.suppressed:
+                event_message.suppressed = "expired"
+                expired.append(event_message)
+        return expired
+
+    def clear(self):
+        with self._lock:
+            self._deleted.clear()
+        self._wheel = TimerWheel(self._wheel.num_slots)
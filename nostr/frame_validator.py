@@ -0,0 +1,104 @@
+import re
+from typing import Optional
+
+DEFAULT_MAX_FRAME_SIZE = 512 * 1024
+DEFAULT_MAX_JUNK_RATIO = 0.5
+
+# the messages a relay can send (NIP-01, NIP-42, NIP-45, NIP-77)
+RELAY_MESSAGE_TYPES = frozenset(
+    ("EVENT", "NOTICE", "EOSE", "OK", "CLOSED", "AUTH", "COUNT", "NEG-MSG", "NEG-ERR")
+)
+
+_HEX_64 = re.compile(r"[0-9a-f]{64}")
+_HEX_128 = re.compile(r"[0-9a-f]{128}")
+
+
+class InvalidFrame(ValueError):
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+def frame_type(frame: str) -> Optional[str]:
+    """The message type of a frame like `["EVENT", ...]`, without parsing it"""
+    start = frame.find('"', 0, 16)
+    if start < 0 or frame[:start].strip() != "[":
+        return None
+    end = frame.find('"', start + 1, start + 16)
+    if end < 0:
+        return None
+    return frame[start + 1 : end]
+
+
+def frame_subscription_id(frame: str) -> Optional[str]:
+    """The second element of a frame like `["EVENT", "<id>", ...]`, if a string"""
+    start = frame.find('"', 0, 16)
+    if start < 0:
+        return None
+    end = frame.find('"', start + 1, start + 16)
+    if end < 0:
+        return None
+    sub_start = frame.find('"', end + 1, end + 16)
+    if sub_start < 0 or frame[end + 1 : sub_start].strip() != ",":
+        return None
+    sub_end = frame.find('"', sub_start + 1, sub_start + 66)
+    if sub_end < 0:
+        return None
+    return frame[sub_start + 1 : sub_end]
+
+
+def check_event(event) -> Optional[str]:
+    """Structural check of a relay event, returns the reason it is invalid"""
+    if not isinstance(event, dict):
+        return "invalid_event"
+    if not (
+        isinstance(event.get("id"), str)
+        and _HEX_64.fullmatch(event["id"])
+        and isinstance(event.get("pubkey"), str)
+        and _HEX_64.fullmatch(event["pubkey"])
+        and isinstance(event.get("sig"), str)
+        and _HEX_128.fullmatch(event["sig"])
+    ):
+        return "invalid_event"
+    kind, created_at = event.get("kind"), event.get("created_at")
+    if type(kind) is not int or type(created_at) is not int or not 0 <= kind <= 65535:
+        return "invalid_event"
+    if not isinstance(event.get("content"), str):
+        return "invalid_event"
+    tags = event.get("tags")
+    if not isinstance(tags, list) or not all(
+        isinstance(tag, list) and all(isinstance(v, str) for v in tag) for tag in tags
+    ):
+        return "invalid_event"
+    return None
+
+
+class FrameValidator:
+    """
+    Cheap checks that run before a relay frame is parsed. Relays are disconnected
+    when more than `max_junk_ratio` of the last `window` frames were rejected.
+    """
+
+    def __init__(
+        self,
+        max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+        max_junk_ratio: float = DEFAULT_MAX_JUNK_RATIO,
+        window: int = 200,
+    ) -> None:
+        self.max_frame_size = max_frame_size
+        self.max_junk_ratio = max_junk_ratio
+        self.window = window
+
+    def check_frame(self, frame: str) -> Optional[str]:
+        """Returns the reason the frame is rejected or `None`"""
+        if len(frame) > self.max_frame_size:
+            return "too_large"
+        message_type = frame_type(frame)
+        if message_type is None:
+            return "malformed"
+        if message_type not in RELAY_MESSAGE_TYPES:
+            return "unknown_type"
+        return None
+
+    def is_junk_ratio_exceeded(self, num_frames: int, num_rejected: int) -> bool:
+        return num_frames > 0 and num_rejected / num_frames > self.max_junk_ratio
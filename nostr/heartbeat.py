@@ -0,0 +1,148 @@
+import math
+import time
+from collections import deque
+from typing import Optional
+
+from .metrics import metrics
+
+rtt_seconds = metrics.histogram(
+    "nostrclient_relay_rtt_seconds",
+    "Round trip time of the websocket pings sent to a relay",
+    ("relay",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+heartbeat_failures = metrics.counter(
+    "nostrclient_relay_heartbeat_failures_total",
+    "Relay connections dropped by the heartbeat, by reason",
+    ("relay", "reason"),
+)
+
+
+class RttStats:
+    """Rolling statistics of the last `window` round trip times (in seconds)"""
+
+    def __init__(self, window: int = 20) -> None:
+        self._samples: deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, rtt: float):
+        self._samples.append(rtt)
+
+    @property
+    def last(self) -> Optional[float]:
+        return self._samples[-1] if self._samples else None
+
+    @property
+    def mean(self) -> Optional[float]:
+        return sum(self._samples) / len(self._samples) if self._samples else None
+
+    @property
+    def stdev(self) -> float:
+        mean = self.mean
+        if mean is None or len(self._samples) < 2:
+            return 0.0
+        variance = sum((s - mean) ** 2 for s in self._samples) / len(self._samples)
+        return math.sqrt(variance)
+
+    @property
+    def max(self) -> Optional[float]:
+        return max(self._samples) if self._samples else None
+
+
+class Heartbeat:
+    """
+    Liveness of one relay connection, polled by `check`:
+     - pings only after `idle_interval` seconds without traffic, any frame from
+       the relay proves that the connection is alive
+     - a ping is answered within `pong_timeout`, derived from the measured round
+       trip times (mean + 4 standard deviations, within the min and max)
+     - a subscription that got neither events nor an EOSE for `stall_timeout`
+       seconds (since it was requested or since its last event) means the
+       relay stalled, traffic of other subscriptions does not count
+    """
+
+    def __init__(
+        self,
+        idle_interval: float = 10,
+        min_pong_timeout: float = 2,
+        max_pong_timeout: float = 20,
+        stall_timeout: float = 60,
+    ) -> None:
+        self.idle_interval = idle_interval
+        self.min_pong_timeout = min_pong_timeout
+        self.max_pong_timeout = max_pong_timeout
+        self.stall_timeout = stall_timeout
+        self.rtt = RttStats()
+        # the last frame from the relay, pongs are not counted
+        self.last_received = time.monotonic()
+        self._last_pong = 0.0
+        self._ping_sent_at: Optional[float] = None
+        self._ping_payload: Optional[bytes] = None
+        self._num_pings = 0
+
+    @property
+    def pong_timeout(self) -> float:
+        if len(self.rtt) < 3:
+            return self.max_pong_timeout
+        assert self.rtt.mean is not None
+        timeout = self.rtt.mean + 4 * self.rtt.stdev
+        return min(max(timeout, self.min_pong_timeout), self.max_pong_timeout)
+
+    @property
+    def last_seen(self) -> float:
+        """The last frame or pong from the relay"""
+        return max(self.last_received, self._last_pong)
+
+    def reset(self, now: Optional[float] = None):
+        """A new connection"""
+        self.last_received = now or time.monotonic()
+        self._ping_sent_at = self._ping_payload = None
+
+    def on_traffic(self, now: Optional[float] = None):
+        self.last_received = now or time.monotonic()
+
+    def ping(self, now: Optional[float] = None) -> bytes:
+        """The payload of the next ping, the pong must echo it"""
+        self._num_pings += 1
+        self._ping_sent_at = now or time.monotonic()
+        self._ping_payload = str(self._num_pings).encode()
+        return self._ping_payload
+
+    def on_pong(self, payload: bytes, now: Optional[float] = None) -> Optional[float]:
+        """Returns the round trip time of the pending ping, if this answers it"""
+        if payload != self._ping_payload or self._ping_sent_at is None:
+            return None
+        now = now or time.monotonic()
+        rtt = now - self._ping_sent_at
+        self.rtt.add(rtt)
+        self._last_pong = now
+        self._ping_sent_at = self._ping_payload = None
+        return rtt
+
+    def ping_due(self, now: Optional[float] = None) -> bool:
+        now = now or time.monotonic()
+        return self._ping_sent_at is None and now - self.last_seen >= self.idle_interval
+
+    def check(
+        self, now: Optional[float] = None, quiet_since: Optional[float] = None
+    ) -> Optional[str]:
+        """
+        Returns why the connection is considered dead, `None` if it is alive.
+        `quiet_since` is the earliest time since which a subscription without
+        EOSE got no traffic (its request or its last event).
+        """
+        now = now or time.monotonic()
+        if (
+            self._ping_sent_at is not None
+            and now - self._ping_sent_at > self.pong_timeout
+        ):
+            return "pong_timeout"
+        if (
+            self.stall_timeout
+            and quiet_since is not None
+            and now - quiet_since > self.stall_timeout
+        ):
+            return "stalled"
+        return None
@@ -0,0 +1,155 @@
+import threading
+import zlib
+from queue import Empty, Full, Queue
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from .frame_validator import frame_type
+from .metrics import metrics
+
+if TYPE_CHECKING:
+    from .relay import Relay
+
+ingestion_dropped_frames = metrics.counter(
+    "nostrclient_ingestion_dropped_frames_total",
+    "Relay events dropped because the ingestion queue of their worker stayed full",
+    ("relay",),
+)
+ingestion_batch_size = metrics.histogram(
+    "nostrclient_ingestion_batch_size",
+    "Relay frames parsed by an ingestion worker per wake up",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250),
+)
+
+Frame = Tuple["Relay", str, Optional[dict]]
+
+
+class _Worker:
+    def __init__(
+        self, name: str, max_queued: int, batch_size: int, after: List["_Worker"]
+    ) -> None:
+        self.queue: Queue[Frame] = Queue(maxsize=max_queued)
+        self.batch_size = batch_size
+        self.stopped = False
+        # held while queueing, no frame is queued once the worker is stopped
+        self._lock = threading.Lock()
+        # the replaced workers, their frames are parsed first
+        self._after = after
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def put(self, frame: Frame, timeout: Optional[float] = None) -> bool:
+        """Returns `False` if the worker was stopped, raises `Full` on timeout"""
+        with self._lock:
+            if self.stopped:
+                return False
+            self.queue.put(frame, timeout=timeout)
+            return True
+
+    def stop(self):
+        """The worker exits once its queue is empty"""
+        with self._lock:
+            self.stopped = True
+
+    def _run(self):
+        for worker in self._after:
+            worker.thread.join()
+        self._after = []
+        while True:
+            try:
+                batch = [self.queue.get(timeout=0.5)]
+            except Empty:
+                if self.stopped:
+                    return
+                continue
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                pass
+            ingestion_batch_size.observe(len(batch))
+            for relay, frame, trace in batch:
+                relay.ingest(frame, trace)
+
+
+class IngestionPipeline:
+    """
+    Moves the parsing and dedupe of relay frames off the websocket threads.
+    Frames are sharded by relay over `num_workers` threads, so the frames of one
+    relay keep their order (e.g. an EOSE after the stored events). Each worker
+    has a bounded queue, a full queue blocks the websocket thread, which slows
+    down reading from the relay. Events are dropped after `submit_timeout`
+    seconds, other frames (EOSE, CLOSED, OK, ...) are never dropped, clients
+    would wait for them forever. With no workers the frames are parsed on the
+    websocket thread. Changing the number of workers keeps the order too.
+    """
+
+    def __init__(
+        self,
+        max_queued: int = 10_000,
+        batch_size: int = 100,
+        submit_timeout: float = 1,
+    ) -> None:
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.submit_timeout = submit_timeout
+        self.num_dropped = 0
+        self._workers: List[_Worker] = []
+        # replaced by parsing on the websocket threads, which wait for them
+        self._retired: List[_Worker] = []
+        self._lock = threading.Lock()
+
+    @property
+    def num_workers(self) -> int:
+        return len(self._workers)
+
+    def qsize(self) -> int:
+        return sum(w.queue.qsize() for w in self._workers)
+
+    def set_workers(self, num_workers: int, max_queued: Optional[int] = None):
+        """
+        Frames queued on the replaced workers are parsed before any later frame,
+        by the new workers or by the websocket threads, without blocking here.
+        """
+        max_queued = max_queued or self.max_queued
+        with self._lock:
+            if num_workers == self.num_workers and max_queued == self.max_queued:
+                return
+            self.max_queued = max_queued
+            retired = self._workers
+            self._workers = [
+                _Worker(
+                    f"nostr-ingestion-{i}", self.max_queued, self.batch_size, retired
+                )
+                for i in range(num_workers)
+            ]
+            self._retired = [] if num_workers else retired
+            for worker in retired:
+                worker.stop()
+
+    def stop(self):
+        self.set_workers(0)
+
+    def submit(self, relay: "Relay", frame: str, trace: Optional[dict]) -> bool:
+        """Returns `False` if there are no workers and the caller parses the frame"""
+        timeout = self.submit_timeout if frame_type(frame) == "EVENT" else None
+        while True:
+            workers = self._workers
+            if not workers:
+                self._wait_for_retired()
+                return False
+            worker = workers[zlib.crc32(relay.url.encode()) % len(workers)]
+            try:
+                if worker.put((relay, frame, trace), timeout):
+                    return True
+            except Full:
+                self.num_dropped += 1
+                ingestion_dropped_frames.inc(relay=relay.url)
+                return True
+            # the worker was replaced meanwhile
+
+    def _wait_for_retired(self):
+        retired = self._retired
+        if retired:
+            for worker in retired:
+                worker.thread.join()
+            self._retired = []
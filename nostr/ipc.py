@@ -0,0 +1,452 @@
+"""
+Share the relay connections between the worker processes of one host.
+One process (elected with a file lock) owns the `RelayManager`, the other
+processes use a `RelayManagerProxy` that forwards subscriptions and publishes
+over a unix socket. Both directions use the relay protocol, one JSON frame per line.
+Requests that need the relay connections (status, metrics, captures) are run in
+the leader with `RelayManagerProxy.query`.
+Requires a POSIX system (`fcntl`, unix sockets).
+"""
+
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+from itertools import count
+from queue import Full, Queue
+from typing import IO, Any, Callable, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from .message_pool import ClosedMessage, EndOfStoredEventsMessage, MessagePool
+from .message_type import ClientMessageType
+from .metrics import metrics
+from .relay_manager import RelayManager
+
+IPC_URL = "ipc://leader"
+# control frames, next to the relay protocol messages
+IPC_ADD_RELAY = "IPC_ADD_RELAY"
+IPC_REMOVE_RELAY = "IPC_REMOVE_RELAY"
+IPC_SET_RELAYS = "IPC_SET_RELAYS"
+IPC_QUERY = "IPC_QUERY"
+IPC_RESULT = "IPC_RESULT"
+
+ipc_dropped_frames = metrics.counter(
+    "nostrclient_ipc_dropped_frames_total",
+    "Frames not forwarded to a worker process because its queue was full",
+)
+
+
+def acquire_lock(path: str) -> Optional[IO]:
+    """Non blocking exclusive lock, held as long as the returned file is open"""
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+class _Connection:
+    """A follower connected to the leader, frames are written by its own thread"""
+
+    def __init__(self, sock: socket.socket, max_queued: int) -> None:
+        self.sock = sock
+        self.subscriptions: set = set()
+        self.queue: Queue[Optional[bytes]] = Queue(maxsize=max_queued)
+        self._writer = threading.Thread(
+            target=self._write, name="nostr-ipc-writer", daemon=True
+        )
+        self._writer.start()
+
+    def send(self, frame: str):
+        try:
+            self.queue.put_nowait(frame.encode() + b"\n")
+        except Full:
+            ipc_dropped_frames.inc()
+
+    def close(self):
+        try:
+            self.queue.put_nowait(None)
+        except Full:
+            pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _write(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                return
+
+
+class IpcLeader:
+    """Serves the relay connections of this process to the follower processes."""
+
+    def __init__(self, max_queued: int = 10_000) -> None:
+        self.max_queued = max_queued
+        self.relay_manager: Optional[RelayManager] = None
+        self.path: Optional[str] = None
+        self._lock_file: Optional[IO] = None
+        self._server: Optional[socket.socket] = None
+        self._connections: Set[_Connection] = set()
+        # subscription id -> the follower that requested it
+        self._owners: Dict[str, _Connection] = {}
+        # name -> handler, called with the relay manager and the query arguments
+        self._queries: Dict[str, Callable[..., Any]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None
+
+    @property
+    def num_followers(self) -> int:
+        return len(self._connections)
+
+    def elect(self, lock_path: str) -> bool:
+        """Only one process of the host wins, until it exits"""
+        if not self._lock_file:
+            self._lock_file = acquire_lock(lock_path)
+        return self._lock_file is not None
+
+    def start(self, path: str, relay_manager: RelayManager):
+        """A no-op while running, the followers stay connected"""
+        self.relay_manager = relay_manager
+        if self.running:
+            return
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)  # left over by a leader that exited
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        os.chmod(path, 0o600)
+        self._server.listen()
+        threading.Thread(
+            target=self._accept, name="nostr-ipc-leader", daemon=True
+        ).start()
+
+    def register_query(self, name: str, handler: Callable[..., Any]):
+        """
+        Followers run `handler(relay_manager, *args)` in this process with
+        `RelayManagerProxy.query`, the result must be JSON serializable.
+        A `ValueError` raised by the handler is raised again in the follower.
+        """
+        self._queries[name] = handler
+
+    def stop(self):
+        server, self._server = self._server, None
+        if server:
+            server.close()
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+            self._owners.clear()
+        for connection in connections:
+            connection.close()
+
+    def forward(self, subscription_id: str, frame: str) -> bool:
+        """Sends a relay frame to the follower owning the subscription, if any"""
+        connection = self._owners.get(subscription_id)
+        if not connection:
+            return False
+        connection.send(frame)
+        return True
+
+    def forward_event(self, subscription_id: str, event_json: str) -> bool:
+        return self.forward(
+            subscription_id, f'["EVENT",{json.dumps(subscription_id)},{event_json}]'
+        )
+
+    def forward_eose(self, eose: EndOfStoredEventsMessage) -> bool:
+        return self.forward(
+            eose.subscription_id, json.dumps(["EOSE", eose.subscription_id])
+        )
+
+    def forward_closed(self, closed: ClosedMessage) -> bool:
+        return self.forward(
+            closed.subscription_id,
+            json.dumps(["CLOSED", closed.subscription_id, closed.message]),
+        )
+
+    def _accept(self):
+        while self._server:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            connection = _Connection(sock, self.max_queued)
+            with self._lock:
+                self._connections.add(connection)
+            threading.Thread(
+                target=self._serve,
+                args=(connection,),
+                name="nostr-ipc-reader",
+                daemon=True,
+            ).start()
+
+    def _serve(self, connection: _Connection):
+        try:
+            with connection.sock.makefile("r", encoding="utf-8") as reader:
+                for line in reader:
+                    try:
+                        self._handle_frame(connection, line.strip())
+                    except Exception as e:
+                        logger.debug(f"Invalid frame from worker process: {e}")
+        except OSError:
+            pass
+        finally:
+            self._disconnect(connection)
+
+    def _handle_frame(self, connection: _Connection, frame: str):
+        assert self.relay_manager
+        message = json.loads(frame)
+        if message[0] == ClientMessageType.REQUEST:
+            with self._lock:
+                self._owners[message[1]] = connection
+                connection.subscriptions.add(message[1])
+            self.relay_manager.add_subscription(message[1], message[2:])
+        elif message[0] == ClientMessageType.CLOSE:
+            with self._lock:
+                self._owners.pop(message[1], None)
+                connection.subscriptions.discard(message[1])
+            self.relay_manager.close_subscription(message[1])
+        elif message[0] == ClientMessageType.EVENT:
+            self.relay_manager.publish_message(frame)
+        elif message[0] == IPC_ADD_RELAY:
+            self.relay_manager.add_relay(message[1])
+        elif message[0] == IPC_REMOVE_RELAY:
+            self.relay_manager.remove_relay(message[1])
+        elif message[0] == IPC_SET_RELAYS:
+            self.relay_manager.set_relays(message[1])
+        elif message[0] == IPC_QUERY:
+            self._answer(connection, message[1], message[2], message[3:])
+
+    def _answer(self, connection: _Connection, query_id, name: str, args: list):
+        result, error = None, None
+        try:
+            handler = self._queries.get(name)
+            if not handler:
+                raise ValueError(f"Unknown query: '{name}'.")
+            result = handler(self.relay_manager, *args)
+        except ValueError as e:
+            error = str(e)
+        connection.send(json.dumps([IPC_RESULT, query_id, result, error]))
+
+    def _disconnect(self, connection: _Connection):
+        with self._lock:
+            self._connections.discard(connection)
+            subscriptions = list(connection.subscriptions)
+            for subscription_id in subscriptions:
+                self._owners.pop(subscription_id, None)
+        if self.relay_manager:
+            self.relay_manager.close_subscriptions(subscriptions)
+        connection.close()
+
+
+class RelayManagerProxy(RelayManager):
+    """
+    Stands in for the `RelayManager` of a process that does not own the relay
+    connections. Frames from the leader are added to a local `MessagePool`, so the
+    `NostrClient` reads them like frames from a relay.
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__()  # `relays` stays empty, they belong to the leader
+        self.path = path
+        self.connected = False
+        self._subscriptions: Dict[str, List] = {}
+        # relay commands not sent yet, the leader was not reachable
+        self._relay_commands: List[str] = []
+        self._relay_commands_lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._send_lock = threading.Lock()
+        self._closed = False
+        self._query_ids = count()
+        # query id -> the event set once answered and the answer
+        self._pending_queries: Dict[int, Tuple[threading.Event, list]] = {}
+
+    @property
+    def num_subscriptions(self) -> int:
+        return len(self._subscriptions)
+
+    @property
+    def has_relays(self) -> bool:
+        return self.connected
+
+    def start(self):
+        threading.Thread(
+            target=self._run, name="nostr-ipc-follower", daemon=True
+        ).start()
+
+    def close(self):
+        self._closed = True
+        sock, self._sock = self._sock, None
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    @property
+    def subscriptions(self) -> Dict[str, List]:
+        return dict(self._subscriptions)
+
+    def add_subscription(self, id: str, filters: List):
+        self._subscriptions[id] = filters
+        self._send(json.dumps(["REQ", id, *filters]))
+
+    def close_subscription(self, id: str):
+        self._subscriptions.pop(id, None)
+        self._send(json.dumps(["CLOSE", id]))
+
+    def close_subscriptions(self, subscriptions: List[str]):
+        for id in subscriptions:
+            self.close_subscription(id)
+
+    def close_all_subscriptions(self):
+        self.close_subscriptions(list(self._subscriptions))
+
+    def publish_message(self, message: str):
+        self._send(message)
+
+    def handle_closed(self, _: ClosedMessage) -> bool:
+        # the leader only forwards CLOSED once no relay serves the subscription
+        return True
+
+    def handle_eose(self, _: EndOfStoredEventsMessage):
+        pass
+
+    def handle_notice(self, _):
+        pass
+
+    def add_relay(self, url: str):  # type: ignore[override]
+        self._send_relay_command(json.dumps([IPC_ADD_RELAY, url]))
+
+    def remove_relay(self, url: str):
+        self._send_relay_command(json.dumps([IPC_REMOVE_RELAY, url]))
+
+    def set_relays(self, urls: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        The leader applies the difference, it owns the connections. It is not
+        known here, `api_set_relays` reports it from the database.
+        """
+        self._send_relay_command(json.dumps([IPC_SET_RELAYS, urls]))
+        return [], []
+
+    def remove_relays(self):
+        pass
+
+    def check_and_restart_relays(self):
+        pass
+
+    def close_connections(self):
+        self.close()
+
+    def set_max_send_rate(self, max_send_rate: float):
+        self.max_send_rate = max_send_rate
+
+    def set_ingestion_workers(self, num_workers: int, max_queued: int):
+        pass  # frames from the leader are parsed on the reader thread
+
+    def start_recording(self, _: str):  # type: ignore[override]
+        raise ValueError("Relay traffic is captured by the leader process.")
+
+    def stop_recording(self) -> None:
+        return None
+
+    def query(self, name: str, *args, timeout: float = 5) -> Any:
+        """
+        Runs a query registered with `IpcLeader.register_query` in the leader.
+        Raises `ConnectionError` if the leader cannot be reached, blocks until
+        it answers (call it from a thread).
+        """
+        if not self.connected:
+            raise ConnectionError("Not connected to the relay leader process.")
+        query_id = next(self._query_ids)
+        answered = threading.Event()
+        answer: List[Any] = []
+        self._pending_queries[query_id] = (answered, answer)
+        try:
+            self._send(json.dumps([IPC_QUERY, query_id, name, *args]))
+            if not answered.wait(timeout):
+                raise ConnectionError("The relay leader process did not answer.")
+        finally:
+            self._pending_queries.pop(query_id, None)
+        result, error = answer
+        if error is not None:
+            raise ValueError(error)
+        return result
+
+    def _handle_result(self, line: str):
+        _, query_id, result, error = json.loads(line)
+        pending = self._pending_queries.get(query_id)
+        if pending:
+            pending[1].extend([result, error])
+            pending[0].set()
+
+    def _send_relay_command(self, frame: str):
+        """Sent in order once the leader is reachable again, see `_run`"""
+        with self._relay_commands_lock:
+            if self._relay_commands or not self._send(frame):
+                self._relay_commands.append(frame)
+
+    def _send(self, frame: str) -> bool:
+        sock = self._sock
+        if not sock:
+            return False  # subscriptions are sent again on reconnect, see `_run`
+        try:
+            with self._send_lock:
+                sock.sendall(frame.encode() + b"\n")
+            return True
+        except OSError as e:
+            logger.debug(f"Cannot send to the leader process: {e}")
+            return False
+
+    def _run(self):
+        while not self._closed:
+            try:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(self.path)
+            except OSError:
+                time.sleep(1)
+                continue
+            with self._relay_commands_lock:
+                self._sock = sock
+                self.connected = True
+                commands, self._relay_commands = self._relay_commands, []
+                for i, frame in enumerate(commands):
+                    if not self._send(frame):
+                        self._relay_commands = commands[i:]
+                        break
+            logger.info("Connected to the relay leader process.")
+            for id, filters in list(self._subscriptions.items()):
+                self._send(json.dumps(["REQ", id, *filters]))
+            try:
+                with sock.makefile("r", encoding="utf-8") as reader:
+                    for line in reader:
+                        try:
+                            if line.startswith(f'["{IPC_RESULT}"'):
+                                self._handle_result(line)
+                            else:
+                                self.message_pool.add_message(line, IPC_URL)
+                        except Exception as e:
+                            logger.debug(f"Invalid frame from the leader: {e}")
+            except OSError:
+                pass
+            self.connected = False
+            self._sock = None
+            if not self._closed:
+                logger.warning("Lost the connection to the relay leader process.")
+                time.sleep(1)
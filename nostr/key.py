@@ -1,14 +1,25 @@
 import base64
+import os
 import secrets
-from typing import Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Optional, TypeVar
 
 import secp256k1
 from cffi import FFI
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
-from .bech32 import Encoding, bech32_decode, bech32_encode, convertbits
-from .event import EncryptedDirectMessage, Event, EventKind
+from . import nip19, nip44
+from .event import EncryptedDirectMessage, Encryption, Event, EventKind
+from .vanity import VanityMiner
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# peers whose shared secret and conversation key each `PrivateKey` keeps
+MAX_CACHED_PEERS = 4096
 
 
 class PublicKey:
@@ -16,8 +27,7 @@ class PublicKey:
         self.raw_bytes = raw_bytes
 
     def bech32(self) -> str:
-        converted_bits = convertbits(self.raw_bytes, 8, 5)
-        return bech32_encode("npub", converted_bits, Encoding.BECH32)
+        return nip19.encode("npub", self.raw_bytes)
 
     def hex(self) -> str:
         return self.raw_bytes.hex()
@@ -31,11 +41,7 @@ class PublicKey:
     @classmethod
     def from_npub(cls, npub: str):
         """Load a PublicKey from its bech32/npub form"""
-        hrp, data, spec = bech32_decode(npub)
-        raw_data = convertbits(data, 5, 8)
-        assert raw_data
-        raw_public_key = raw_data[:-1]
-        return cls(bytes(raw_public_key))
+        return cls(bytes.fromhex(nip19.decode_key(npub, "npub")))
 
 
 class PrivateKey:
@@ -48,19 +54,19 @@ class PrivateKey:
         sk = secp256k1.PrivateKey(self.raw_secret)
         assert sk.pubkey
         self.public_key = PublicKey(sk.pubkey.serialize()[1:])
+        # peer public key -> NIP-04 shared secret / NIP-44 conversation key,
+        # kept per instance so the secrets are released with the key
+        self._shared_secrets: OrderedDict[str, bytes] = OrderedDict()
+        self._conversation_keys: OrderedDict[str, bytes] = OrderedDict()
+        self._cache_lock = Lock()
 
     @classmethod
     def from_nsec(cls, nsec: str):
         """Load a PrivateKey from its bech32/nsec form"""
-        hrp, data, spec = bech32_decode(nsec)
-        raw_data = convertbits(data, 5, 8)
-        assert raw_data
-        raw_secret = raw_data[:-1]
-        return cls(bytes(raw_secret))
+        return cls(bytes.fromhex(nip19.decode_key(nsec, "nsec")))
 
     def bech32(self) -> str:
-        converted_bits = convertbits(self.raw_secret, 8, 5)
-        return bech32_encode("nsec", converted_bits, Encoding.BECH32)
+        return nip19.encode("nsec", self.raw_secret)
 
     def hex(self) -> str:
         return self.raw_secret.hex()
@@ -70,8 +76,12 @@ class PrivateKey:
         return sk.tweak_add(scalar)
 
     def compute_shared_secret(self, public_key_hex: str) -> bytes:
-        pk = secp256k1.PublicKey(bytes.fromhex("02" + public_key_hex), True)
-        return pk.ecdh(self.raw_secret, hashfn=copy_x)
+        """ECDH is the expensive part of NIP-04, peers are usually the same few keys"""
+        return self._cached(
+            self._shared_secrets,
+            public_key_hex.lower(),
+            lambda pk: _shared_secret(self.raw_secret, pk),
+        )
 
     def encrypt_message(self, message: str, public_key_hex: str) -> str:
         padder = padding.PKCS7(128).padder()
@@ -93,9 +103,44 @@ class PrivateKey:
     def encrypt_dm(self, dm: EncryptedDirectMessage) -> None:
         assert dm.cleartext_content
         assert dm.recipient_pubkey
-        dm.content = self.encrypt_message(
-            message=dm.cleartext_content, public_key_hex=dm.recipient_pubkey
+        encrypt = (
+            self.nip44_encrypt
+            if dm.encryption == Encryption.NIP44
+            else self.encrypt_message
         )
+        dm.content = encrypt(dm.cleartext_content, dm.recipient_pubkey)
+
+    def get_conversation_key(self, public_key_hex: str) -> bytes:
+        """NIP-44 conversation key, cached per peer like the NIP-04 shared secret"""
+        return self._cached(
+            self._conversation_keys,
+            public_key_hex.lower(),
+            lambda pk: nip44.get_conversation_key(self.compute_shared_secret(pk)),
+        )
+
+    def _cached(
+        self,
+        cache: OrderedDict[str, bytes],
+        public_key_hex: str,
+        compute: Callable[[str], bytes],
+    ) -> bytes:
+        with self._cache_lock:
+            value = cache.get(public_key_hex)
+            if value is not None:
+                cache.move_to_end(public_key_hex)
+                return value
+        value = compute(public_key_hex)
+        with self._cache_lock:
+            cache[public_key_hex] = value
+            if len(cache) > MAX_CACHED_PEERS:
+                cache.popitem(last=False)
+        return value
+
+    def nip44_encrypt(self, message: str, public_key_hex: str) -> str:
+        return nip44.encrypt(message, self.get_conversation_key(public_key_hex))
+
+    def nip44_decrypt(self, payload: str, public_key_hex: str) -> str:
+        return nip44.decrypt(payload, self.get_conversation_key(public_key_hex))
 
     def decrypt_message(self, encoded_message: str, public_key_hex: str) -> str:
         encoded_data = encoded_message.split("?iv=")
@@ -115,6 +160,44 @@ class PrivateKey:
 
         return unpadded_data.decode()
 
+    def encrypt_messages(
+        self,
+        messages: list[tuple[str, str]],
+        max_workers: Optional[int] = None,
+        encryption: str = Encryption.NIP04,
+    ) -> list[str]:
+        """Encrypt a list of `(message, public_key_hex)` pairs"""
+        encrypt = (
+            self.nip44_encrypt
+            if encryption == Encryption.NIP44
+            else self.encrypt_message
+        )
+        return _map_in_pool(lambda m: encrypt(m[0], m[1]), messages, max_workers)
+
+    def decrypt_messages(
+        self,
+        messages: list[tuple[str, str]],
+        max_workers: Optional[int] = None,
+        encryption: str = Encryption.NIP04,
+    ) -> list[Optional[str]]:
+        """
+        Decrypt a list of `(encoded_message, public_key_hex)` pairs.
+        Messages that cannot be decrypted are returned as `None`.
+        """
+        decrypt_message = (
+            self.nip44_decrypt
+            if encryption == Encryption.NIP44
+            else self.decrypt_message
+        )
+
+        def decrypt(m: tuple[str, str]) -> Optional[str]:
+            try:
+                return decrypt_message(m[0], m[1])
+            except Exception:
+                return None
+
+        return _map_in_pool(decrypt, messages, max_workers)
+
     def sign_message_hash(self, message_hash: bytes) -> str:
         sk = secp256k1.PrivateKey(self.raw_secret)
         sig = sk.schnorr_sign(message_hash, None, raw=True)
@@ -125,6 +208,8 @@ class PrivateKey:
             self.encrypt_dm(event)  # type: ignore
         if event.public_key is None:
             event.public_key = self.public_key.hex()
+        # the tags may have been edited in place since the id was memoized
+        event.invalidate()
         event.signature = self.sign_message_hash(bytes.fromhex(event.id))
 
     def __eq__(self, other):
@@ -132,23 +217,37 @@ class PrivateKey:
 
 
 def mine_vanity_key(
-    prefix: Optional[str] = None, suffix: Optional[str] = None
+    prefix: Optional[str] = None,
+    suffix: Optional[str] = None,
+    workers: Optional[int] = None,
+    timeout: Optional[float] = None,
 ) -> PrivateKey:
-    if prefix is None and suffix is None:
-        raise ValueError("Expected at least one of 'prefix' or 'suffix' arguments")
-
-    while True:
-        sk = PrivateKey()
-        if (
-            prefix is not None
-            and not sk.public_key.bech32()[5 : 5 + len(prefix)] == prefix
-        ):
-            continue
-        if suffix is not None and not sk.public_key.bech32()[-len(suffix) :] == suffix:
-            continue
-        break
-
-    return sk
+    miner = VanityMiner(prefix, suffix, workers=workers, timeout=timeout)
+    miner.start()
+    secret = miner.wait()
+    if not secret:
+        raise TimeoutError(f"No vanity key found after {miner.attempts} attempts")
+    return PrivateKey(secret)
+
+
+def _shared_secret(raw_secret: bytes, public_key_hex: str) -> bytes:
+    pk = secp256k1.PublicKey(bytes.fromhex("02" + public_key_hex), True)
+    return pk.ecdh(raw_secret, hashfn=copy_x)
+
+
+def _map_in_pool(
+    func: Callable[[T], R], items: list[T], max_workers: Optional[int] = None
+) -> list[R]:
+    """Map in a thread pool, one chunk of items per worker to keep the overhead low"""
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(items) < 2 * max_workers:
+        return [func(i) for i in items]
+
+    chunk_size = -(-len(items) // max_workers)
+    chunks = [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda chunk: [func(i) for i in chunk], chunks)
+        return [r for chunk_results in results for r in chunk_results]
 
 
 ffi = FFI()
@@ -1,18 +1,53 @@
 import json
+import time
+from collections import deque
 from queue import Queue
 from threading import Lock
+from typing import Optional
 
+from .frame_validator import InvalidFrame, check_event
 from .message_type import RelayMessageType
+from .metrics import metrics
+from .tracing import tracer
+
+parse_seconds = metrics.histogram(
+    "nostrclient_message_parse_seconds",
+    "Time spent parsing and routing a relay message",
+    ("type",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005, 0.01),
+)
+dedupe_total = metrics.counter(
+    "nostrclient_dedupe_total",
+    "Relay events checked against the per-subscription dedupe set",
+    ("result",),
+)
+suppressed_events = metrics.counter(
+    "nostrclient_suppressed_events_total",
+    "Relay events that were not delivered to clients, by reason",
+    ("reason",),
+)
 
 
 class EventMessage:
     def __init__(
-        self, event: str, event_id: str, subscription_id: str, url: str
+        self,
+        event: str,
+        event_id: str,
+        subscription_id: str,
+        url: str,
+        trace: Optional[dict[str, float]] = None,
+        data: Optional[dict] = None,
     ) -> None:
         self.event = event
         self.event_id = event_id
         self.subscription_id = subscription_id
         self.url = url
+        # the parsed event, avoids decoding `event` again
+        self.data = data if data is not None else json.loads(event)
+        # stage timestamps, only set for events sampled by the `EventTracer`
+        self.trace = trace
+        # the reason this event must not be delivered (e.g. "replaced")
+        self.suppressed: Optional[str] = None
 
 
 class NoticeMessage:
@@ -25,6 +60,22 @@ class EndOfStoredEventsMessage:
     def __init__(self, subscription_id: str, url: str) -> None:
         self.subscription_id = subscription_id
         self.url = url
+        self.received_at = time.monotonic()
+
+
+class ClosedMessage:
+    """A relay ended a subscription (NIP-01 `CLOSED`)"""
+
+    def __init__(self, subscription_id: str, message: str, url: str) -> None:
+        self.subscription_id = subscription_id
+        self.message = message
+        self.url = url
+
+    @property
+    def reason(self) -> str:
+        """The machine readable prefix, e.g. `rate-limited` or `auth-required`"""
+        prefix, separator, _ = self.message.partition(":")
+        return prefix.strip() if separator else ""
 
 
 class MessagePool:
@@ -32,21 +83,62 @@ class MessagePool:
         self.events: Queue[EventMessage] = Queue()
         self.notices: Queue[NoticeMessage] = Queue()
         self.eose_notices: Queue[EndOfStoredEventsMessage] = Queue()
+        self.closed_messages: Queue[ClosedMessage] = Queue()
         self._unique_events: set = set()
         self.lock: Lock = Lock()
-
-    def add_message(self, message: str, url: str):
-        self._process_message(message, url)
+        # (created_at, id) of the events accepted per subscription, see `negentropy`
+        self.record_items = False
+        # the first received items are forgotten above this, per subscription
+        self.max_items = 10_000
+        self._items: dict[str, deque[tuple[int, str]]] = {}
+        self._items_truncated: set[str] = set()
+
+    def add_message(
+        self, message: str, url: str, trace: Optional[dict[str, float]] = None
+    ):
+        self._process_message(message, url, trace)
 
     def get_event(self):
         return self.events.get()
 
+    def items(self, subscription_id: str) -> list[tuple[int, str]]:
+        return list(self._items.get(subscription_id, []))
+
+    def items_complete(self, subscription_id: str) -> bool:
+        """`False` if items of the subscription were forgotten, see `max_items`"""
+        return subscription_id not in self._items_truncated
+
+    def forget_items(self, subscription_id: Optional[str] = None):
+        if subscription_id is None:
+            self._items.clear()
+            self._items_truncated.clear()
+        else:
+            self._items.pop(subscription_id, None)
+            self._items_truncated.discard(subscription_id)
+
+    def forget_event(self, event_message: EventMessage):
+        """
+        An event that failed verification, so the genuine event with the same id
+        is accepted when another relay sends it
+        """
+        with self.lock:
+            self._unique_events.discard(
+                f"{event_message.subscription_id}_{event_message.event_id}"
+            )
+            items = self._items.get(event_message.subscription_id)
+            item = (event_message.data["created_at"], event_message.event_id)
+            if items and item in items:
+                items.remove(item)
+
     def get_notice(self):
         return self.notices.get()
 
     def get_eose_notice(self):
         return self.eose_notices.get()
 
+    def get_closed_message(self):
+        return self.closed_messages.get()
+
     def has_events(self):
         return self.events.qsize() > 0
 
@@ -56,25 +148,57 @@ class MessagePool:
     def has_eose_notices(self):
         return self.eose_notices.qsize() > 0
 
-    def _process_message(self, message: str, url: str):
+    def has_closed_messages(self):
+        return self.closed_messages.qsize() > 0
+
+    def _process_message(
+        self, message: str, url: str, trace: Optional[dict[str, float]] = None
+    ):
+        start = time.perf_counter()
         message_json = json.loads(message)
         message_type = message_json[0]
         if message_type == RelayMessageType.EVENT:
+            if len(message_json) != 3 or not isinstance(message_json[1], str):
+                raise InvalidFrame("malformed")
             subscription_id = message_json[1]
             event = message_json[2]
-            if "id" not in event:
-                return
-            event_id = event["id"]
-
-            with self.lock:
-                if f"{subscription_id}_{event_id}" not in self._unique_events:
-                    self._accept_event(
-                        EventMessage(json.dumps(event), event_id, subscription_id, url)
-                    )
+            event_id = event.get("id") if isinstance(event, dict) else None
+            unique_key = f"{subscription_id}_{event_id}"
+
+            # duplicates are dropped before the (more expensive) structural check
+            if unique_key in self._unique_events:
+                dedupe_total.inc(result="hit")
+            else:
+                reason = check_event(event)
+                if reason:
+                    raise InvalidFrame(reason)
+                with self.lock:
+                    if unique_key not in self._unique_events:
+                        dedupe_total.inc(result="miss")
+                        tracer.mark(trace, "parsed")
+                        self._accept_event(
+                            EventMessage(
+                                json.dumps(event),
+                                event["id"],
+                                subscription_id,
+                                url,
+                                trace,
+                                data=event,
+                            )
+                        )
+                    else:
+                        dedupe_total.inc(result="hit")
         elif message_type == RelayMessageType.NOTICE:
             self.notices.put(NoticeMessage(message_json[1], url))
         elif message_type == RelayMessageType.END_OF_STORED_EVENTS:
             self.eose_notices.put(EndOfStoredEventsMessage(message_json[1], url))
+        elif message_type == RelayMessageType.CLOSED:
+            message = message_json[2] if len(message_json) > 2 else ""
+            self.closed_messages.put(ClosedMessage(message_json[1], message, url))
+
+        if not RelayMessageType.is_valid(message_type):
+            message_type = "other"
+        parse_seconds.observe(time.perf_counter() - start, type=message_type)
 
     def _accept_event(self, event_message: EventMessage):
         """
@@ -87,3 +211,9 @@ class MessagePool:
         self._unique_events.add(
             f"{event_message.subscription_id}_{event_message.event_id}"
         )
+        if self.record_items:
+            sub_id = event_message.subscription_id
+            items = self._items.setdefault(sub_id, deque(maxlen=self.max_items))
+            if len(items) == items.maxlen:
+                self._items_truncated.add(sub_id)
+            items.append((event_message.data["created_at"], event_message.event_id))
@@ -9,6 +9,7 @@ class RelayMessageType:
     NOTICE = "NOTICE"
     END_OF_STORED_EVENTS = "EOSE"
     COMMAND_RESULT = "OK"
+    CLOSED = "CLOSED"
 
     @staticmethod
     def is_valid(type: str) -> bool:
@@ -17,6 +18,7 @@ class RelayMessageType:
             or type == RelayMessageType.NOTICE
             or type == RelayMessageType.END_OF_STORED_EVENTS
             or type == RelayMessageType.COMMAND_RESULT
+            or type == RelayMessageType.CLOSED
         ):
             return True
         return False
@@ -0,0 +1,339 @@
+"""
+Negentropy set reconciliation (NIP-77, protocol version 1).
+
+Both sides sort their events by `(created_at, id)` and exchange fingerprints of
+ranges of that order. Ranges with equal fingerprints are skipped, the others are
+split until they are small enough to exchange their ids, so only the difference
+between the two sets is transferred.
+"""
+
+import hashlib
+import json
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from .subscription import Subscription
+
+PROTOCOL_VERSION = 0x61
+ID_SIZE = 32
+FINGERPRINT_SIZE = 16
+# timestamp of the upper bound of the last range
+INFINITY = 2**64 - 1
+
+MODE_SKIP = 0
+MODE_FINGERPRINT = 1
+MODE_ID_LIST = 2
+
+# ranges with fewer items are sent as id lists, larger ones are split in buckets
+NUM_BUCKETS = 16
+# ids per filter of the REQ that downloads the missing events
+IDS_PER_FILTER = 500
+
+Bound = Tuple[int, bytes]  # (timestamp, id prefix)
+
+
+def encode_varint(n: int) -> bytes:
+    """Base 128, most significant group first, all but the last byte have bit 8 set"""
+    out = [n & 0x7F]
+    n >>= 7
+    while n:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    return bytes(reversed(out))
+
+
+def decode_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """Returns the value and the position after it"""
+    n = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        n = n << 7 | byte & 0x7F
+        if not byte & 0x80:
+            return n, pos
+
+
+class NegentropyStorage:
+    """The sorted `(created_at, id)` items of one side, `seal` before reconciling"""
+
+    def __init__(self) -> None:
+        self._items: List[Tuple[int, bytes]] = []
+        # `_sums[i]` is the sum of the ids of the first `i` items
+        self._sums: List[int] = [0]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def insert(self, created_at: int, event_id: str):
+        self._items.append((created_at, bytes.fromhex(event_id)))
+
+    def seal(self):
+        self._items.sort()
+        self._sums = [0]
+        total = 0
+        for _, event_id in self._items:
+            total += int.from_bytes(event_id, "little")
+            self._sums.append(total)
+
+    def item(self, index: int) -> Tuple[int, bytes]:
+        return self._items[index]
+
+    def ids(self, lower: int, upper: int) -> List[bytes]:
+        return [event_id for _, event_id in self._items[lower:upper]]
+
+    def find_lower_bound(self, lower: int, upper: int, bound: Bound) -> int:
+        """The index of the first item in `[lower, upper)` that is not below `bound`"""
+        timestamp, prefix = bound
+        key = (timestamp, prefix.ljust(ID_SIZE, b"\0"))
+        return bisect_left(self._items, key, lower, upper)
+
+    def fingerprint(self, lower: int, upper: int) -> bytes:
+        """O(1) through the prefix sums of the ids"""
+        total = (self._sums[upper] - self._sums[lower]) % 2**256
+        data = total.to_bytes(ID_SIZE, "little") + encode_varint(upper - lower)
+        return hashlib.sha256(data).digest()[:FINGERPRINT_SIZE]
+
+
+class Negentropy:
+    """
+    One side of a reconciliation. The initiator calls `initiate` and passes each
+    answer to `reconcile` until it returns no message. The responder answers each
+    message with the message returned by `reconcile`.
+    """
+
+    def __init__(self, storage: NegentropyStorage) -> None:
+        self.storage = storage
+        self.is_initiator = False
+        self._last_timestamp_in = 0
+        self._last_timestamp_out = 0
+
+    def initiate(self) -> bytes:
+        self.is_initiator = True
+        self._last_timestamp_out = 0
+        output = bytearray([PROTOCOL_VERSION])
+        output += self._split_range(0, len(self.storage), (INFINITY, b""))
+        return bytes(output)
+
+    def reconcile(self, query: bytes) -> Tuple[Optional[bytes], List[str], List[str]]:
+        """
+        Returns the next message (`None` once the initiator is done) and, for the
+        initiator, the ids only it has and the ids only the other side has.
+        """
+        self._last_timestamp_in = self._last_timestamp_out = 0
+        have_ids: List[str] = []
+        need_ids: List[str] = []
+        if not query:
+            raise ValueError("Empty negentropy message")
+        if query[0] != PROTOCOL_VERSION:
+            if self.is_initiator:
+                raise ValueError(f"Unsupported negentropy version: {query[0]:#x}")
+            return bytes([PROTOCOL_VERSION]), have_ids, need_ids
+
+        output = bytearray([PROTOCOL_VERSION])
+        pos = 1
+        prev_bound: Bound = (0, b"")
+        prev_index = 0
+        skip = False
+
+        def do_skip():
+            # the skipped ranges before a range that is sent, merged into one
+            nonlocal skip
+            if skip:
+                skip = False
+                output.extend(self._encode_bound(prev_bound) + encode_varint(MODE_SKIP))
+
+        while pos < len(query):
+            bound, pos = self._decode_bound(query, pos)
+            mode, pos = decode_varint(query, pos)
+            lower = prev_index
+            upper = self.storage.find_lower_bound(lower, len(self.storage), bound)
+
+            if mode == MODE_SKIP:
+                skip = True
+            elif mode == MODE_FINGERPRINT:
+                their_fingerprint = query[pos : pos + FINGERPRINT_SIZE]
+                pos += FINGERPRINT_SIZE
+                if their_fingerprint != self.storage.fingerprint(lower, upper):
+                    do_skip()
+                    output += self._split_range(lower, upper, bound)
+                else:
+                    skip = True
+            elif mode == MODE_ID_LIST:
+                num_ids, pos = decode_varint(query, pos)
+                their_ids = set()
+                for _ in range(num_ids):
+                    their_ids.add(query[pos : pos + ID_SIZE])
+                    pos += ID_SIZE
+                for event_id in self.storage.ids(lower, upper):
+                    if event_id in their_ids:
+                        their_ids.discard(event_id)
+                    elif self.is_initiator:
+                        have_ids.append(event_id.hex())
+                if self.is_initiator:
+                    need_ids.extend(event_id.hex() for event_id in their_ids)
+                    skip = True
+                else:
+                    do_skip()
+                    output += self._id_list(lower, upper, bound)
+            else:
+                raise ValueError(f"Unknown negentropy mode: {mode}")
+
+            prev_index = upper
+            prev_bound = bound
+
+        if self.is_initiator and len(output) == 1:
+            return None, have_ids, need_ids
+        return bytes(output), have_ids, need_ids
+
+    def _split_range(self, lower: int, upper: int, upper_bound: Bound) -> bytes:
+        num_items = upper - lower
+        if num_items < NUM_BUCKETS * 2:
+            return self._id_list(lower, upper, upper_bound)
+
+        output = bytearray()
+        per_bucket, with_extra = divmod(num_items, NUM_BUCKETS)
+        current = lower
+        for i in range(NUM_BUCKETS):
+            size = per_bucket + (1 if i < with_extra else 0)
+            fingerprint = self.storage.fingerprint(current, current + size)
+            current += size
+            if current == upper:
+                bound = upper_bound
+            else:
+                bound = self._minimal_bound(
+                    self.storage.item(current - 1), self.storage.item(current)
+                )
+            output += self._encode_bound(bound)
+            output += encode_varint(MODE_FINGERPRINT) + fingerprint
+        return bytes(output)
+
+    def _id_list(self, lower: int, upper: int, bound: Bound) -> bytes:
+        ids = self.storage.ids(lower, upper)
+        return (
+            self._encode_bound(bound)
+            + encode_varint(MODE_ID_LIST)
+            + encode_varint(len(ids))
+            + b"".join(ids)
+        )
+
+    @staticmethod
+    def _minimal_bound(prev: Tuple[int, bytes], current: Tuple[int, bytes]) -> Bound:
+        """The shortest bound above `prev` and not above `current`"""
+        if current[0] != prev[0]:
+            return current[0], b""
+        shared = 0
+        while shared < ID_SIZE and current[1][shared] == prev[1][shared]:
+            shared += 1
+        return current[0], current[1][: shared + 1]
+
+    def _encode_bound(self, bound: Bound) -> bytes:
+        timestamp, prefix = bound
+        # timestamps are sent as the difference to the previous bound, plus one
+        if timestamp == INFINITY:
+            self._last_timestamp_out = INFINITY
+            encoded = encode_varint(0)
+        else:
+            encoded = encode_varint(timestamp - self._last_timestamp_out + 1)
+            self._last_timestamp_out = timestamp
+        return encoded + encode_varint(len(prefix)) + prefix
+
+    def _decode_bound(self, data: bytes, pos: int) -> Tuple[Bound, int]:
+        timestamp, pos = decode_varint(data, pos)
+        if timestamp == 0 or self._last_timestamp_in == INFINITY:
+            timestamp = INFINITY
+        else:
+            timestamp += self._last_timestamp_in - 1
+        self._last_timestamp_in = timestamp
+        length, pos = decode_varint(data, pos)
+        if length > ID_SIZE:
+            raise ValueError("Invalid negentropy bound")
+        return (timestamp, data[pos : pos + length]), pos + length
+
+
+class NegentropySync:
+    """
+    Downloads the events of a subscription that are missing from `items`, the
+    `(created_at, id)` pairs received for it before. The live events are requested
+    right away, then one reconciliation runs per filter (`NEG-OPEN`) and the REQ
+    is replaced by one for the missing ids and the live events.
+    If `items` is not `complete` (older items were forgotten) only the events
+    since the oldest item are reconciled.
+    """
+
+    def __init__(
+        self,
+        subscription: Subscription,
+        items: List[Tuple[int, str]],
+        complete: bool = True,
+    ):
+        self.subscription = subscription
+        self.started_at = int(time.time())
+        self.since = 0 if complete or not items else min(c for c, _ in items)
+        self.need_ids: List[str] = []
+        self.failed = False
+        self._sessions: Dict[str, Negentropy] = {}
+        self._items = items
+
+    @property
+    def session_ids(self) -> List[str]:
+        return list(self._sessions)
+
+    @property
+    def done(self) -> bool:
+        return not self._sessions
+
+    def open_messages(self) -> List[str]:
+        messages = []
+        for i, f in enumerate(self.subscription.filters or []):
+            storage = NegentropyStorage()
+            for created_at, event_id in self._items:
+                storage.insert(created_at, event_id)
+            storage.seal()
+            session = Negentropy(storage)
+            session_id = f"neg{i}:{self.subscription.id}"
+            self._sessions[session_id] = session
+            message = session.initiate().hex()
+            if self.since:
+                f = {**f, "since": max(f.get("since", 0), self.since)}
+            messages.append(json.dumps(["NEG-OPEN", session_id, f, message]))
+        return messages
+
+    def live_request_message(self) -> str:
+        """The REQ for the events published from now on, sent during the sync"""
+        return json.dumps(["REQ", self.subscription.id, *self._live_filters()])
+
+    def handle_message(self, session_id: str, message: str) -> List[str]:
+        """Answers a `NEG-MSG`, closes the session once it is reconciled"""
+        session = self._sessions.get(session_id)
+        if not session:
+            return []
+        output, _, need_ids = session.reconcile(bytes.fromhex(message))
+        self.need_ids.extend(need_ids)
+        if output is not None:
+            return [json.dumps(["NEG-MSG", session_id, output.hex()])]
+        self._sessions.pop(session_id)
+        return [json.dumps(["NEG-CLOSE", session_id])]
+
+    def handle_error(self, session_id: str):
+        """A `NEG-ERR` (e.g. too many events), the subscription is requested fully"""
+        if self._sessions.pop(session_id, None):
+            self.failed = True
+
+    def request_message(self) -> str:
+        """The REQ for the missing events and the events published from now on"""
+        need_ids = list(dict.fromkeys(self.need_ids))
+        filters: List[dict] = [
+            {"ids": need_ids[i : i + IDS_PER_FILTER]}
+            for i in range(0, len(need_ids), IDS_PER_FILTER)
+        ]
+        filters += self._live_filters()
+        return json.dumps(["REQ", self.subscription.id, *filters])
+
+    def _live_filters(self) -> List[dict]:
+        return [
+            {**f, "since": max(f.get("since", 0), self.started_at)}
+            for f in self.subscription.filters or []
+        ]
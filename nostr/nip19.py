@@ -0,0 +1,243 @@
+"""
+NIP-19 bech32 entities: npub, nsec, note, nprofile, nevent and naddr.
+A table driven version of the reference implementation in `bech32.py`.
+"""
+
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Optional, Tuple, Union
+
+from .bech32 import CHARSET
+
+# nostr-tools limit, TLV entities are longer than the 90 characters of BIP-173
+MAX_LENGTH = 5000
+
+_CHARSET_REV = {c: i for i, c in enumerate(CHARSET)}
+_GENERATOR = (0x3B6A57B2, 0x26508E6D, 0x1EA119FA, 0x3D4233DD, 0x2A1462B3)
+# the xor of the generators selected by the 5 bits shifted out of the checksum
+_POLYMOD_TABLE = tuple(
+    _GENERATOR[0] * (top & 1)
+    ^ _GENERATOR[1] * (top >> 1 & 1)
+    ^ _GENERATOR[2] * (top >> 2 & 1)
+    ^ _GENERATOR[3] * (top >> 3 & 1)
+    ^ _GENERATOR[4] * (top >> 4 & 1)
+    for top in range(32)
+)
+
+KEY_PREFIXES = ("npub", "nsec", "note")
+
+TLV_SPECIAL = 0
+TLV_RELAY = 1
+TLV_AUTHOR = 2
+TLV_KIND = 3
+
+
+def _polymod(values, chk: int = 1) -> int:
+    table = _POLYMOD_TABLE
+    for value in values:
+        chk = (chk & 0x1FFFFFF) << 5 ^ value ^ table[chk >> 25]
+    return chk
+
+
+@lru_cache(maxsize=32)
+def _hrp_state(hrp: str) -> int:
+    """Checksum state after the expanded HRP, the same for every key of a kind"""
+    return _polymod([ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp])
+
+
+def _to_words(data: bytes) -> List[int]:
+    num_words = -(-len(data) * 8 // 5)
+    value = int.from_bytes(data, "big") << (num_words * 5 - len(data) * 8)
+    return [value >> shift & 31 for shift in range(num_words * 5 - 5, -5, -5)]
+
+
+def _from_words(words: List[int]) -> bytes:
+    num_bytes, padding = divmod(len(words) * 5, 8)
+    value = 0
+    for word in words:
+        value = value << 5 | word
+    if value & ((1 << padding) - 1) or padding >= 5:
+        raise ValueError("Invalid bech32 padding")
+    return (value >> padding).to_bytes(num_bytes, "big")
+
+
+def encode(hrp: str, data: bytes) -> str:
+    words = _to_words(data)
+    chk = _polymod(words, _hrp_state(hrp))
+    chk = _polymod((0, 0, 0, 0, 0, 0), chk) ^ 1
+    checksum = [chk >> 5 * (5 - i) & 31 for i in range(6)]
+    return hrp + "1" + "".join([CHARSET[w] for w in words + checksum])
+
+
+def decode(bech: str) -> Tuple[str, bytes]:
+    """Returns the HRP and the data of a bech32 string, raises `ValueError`"""
+    if len(bech) > MAX_LENGTH:
+        raise ValueError("Bech32 string too long")
+    if bech.lower() != bech:
+        if bech.upper() != bech:
+            raise ValueError("Mixed case bech32 string")
+        bech = bech.lower()
+    pos = bech.rfind("1")
+    if pos < 1 or pos + 7 > len(bech):
+        raise ValueError("Invalid bech32 separator position")
+    hrp = bech[:pos]
+    if any(ord(x) < 33 or ord(x) > 126 for x in hrp):
+        raise ValueError("Invalid bech32 prefix")
+    try:
+        words = [_CHARSET_REV[x] for x in bech[pos + 1 :]]
+    except KeyError as ex:
+        raise ValueError(f"Invalid bech32 character: {ex}") from ex
+    if _polymod(words, _hrp_state(hrp)) != 1:
+        raise ValueError("Invalid bech32 checksum")
+    return hrp, _from_words(words[:-6])
+
+
+def encode_key(hrp: str, key: str) -> str:
+    """Encodes a hex public key (npub), private key (nsec) or event id (note)"""
+    data = bytes.fromhex(key)
+    if len(data) != 32:
+        raise ValueError(f"Invalid {hrp} length")
+    return encode(hrp, data)
+
+
+def decode_key(bech: str, hrp: Optional[str] = None) -> str:
+    """Decodes an npub, nsec or note to hex, optionally checking its prefix"""
+    prefix, data = decode(bech)
+    if hrp and prefix != hrp:
+        raise ValueError(f"Expected {hrp}, got {prefix}")
+    if prefix not in KEY_PREFIXES or len(data) != 32:
+        raise ValueError(f"Invalid {prefix}")
+    return data.hex()
+
+
+def encode_keys(hrp: str, keys: List[str]) -> List[str]:
+    return [encode_key(hrp, key) for key in keys]
+
+
+def decode_keys(bechs: List[str], hrp: Optional[str] = None) -> List[str]:
+    return [decode_key(bech, hrp) for bech in bechs]
+
+
+@dataclass
+class ProfilePointer:
+    pubkey: str
+    relays: List[str] = field(default_factory=list)
+
+
+@dataclass
+class EventPointer:
+    id: str
+    relays: List[str] = field(default_factory=list)
+    author: Optional[str] = None
+    kind: Optional[int] = None
+
+
+@dataclass
+class AddressPointer:
+    identifier: str
+    pubkey: str
+    kind: int
+    relays: List[str] = field(default_factory=list)
+
+
+Entity = Union[str, ProfilePointer, EventPointer, AddressPointer]
+
+
+def _encode_tlv(entries: List[Tuple[int, bytes]]) -> bytes:
+    tlv = bytearray()
+    for tlv_type, value in entries:
+        if len(value) > 255:
+            raise ValueError("TLV value too long")
+        tlv += bytes((tlv_type, len(value))) + value
+    return bytes(tlv)
+
+
+def _decode_tlv(data: bytes) -> dict:
+    entries: dict = {}
+    i = 0
+    while i < len(data):
+        if i + 2 > len(data):
+            raise ValueError("Truncated TLV entry")
+        tlv_type, length = data[i], data[i + 1]
+        value = data[i + 2 : i + 2 + length]
+        if len(value) != length:
+            raise ValueError("Truncated TLV entry")
+        entries.setdefault(tlv_type, []).append(value)
+        i += 2 + length
+    return entries
+
+
+def _relays(relays: List[str]) -> List[Tuple[int, bytes]]:
+    return [(TLV_RELAY, relay.encode()) for relay in relays]
+
+
+def _hex32(value: bytes, name: str) -> str:
+    if len(value) != 32:
+        raise ValueError(f"Invalid {name} length")
+    return value.hex()
+
+
+def encode_nprofile(pubkey: str, relays: Optional[List[str]] = None) -> str:
+    tlv = [(TLV_SPECIAL, bytes.fromhex(pubkey)), *_relays(relays or [])]
+    return encode("nprofile", _encode_tlv(tlv))
+
+
+def encode_nevent(
+    event_id: str,
+    relays: Optional[List[str]] = None,
+    author: Optional[str] = None,
+    kind: Optional[int] = None,
+) -> str:
+    tlv = [(TLV_SPECIAL, bytes.fromhex(event_id)), *_relays(relays or [])]
+    if author:
+        tlv.append((TLV_AUTHOR, bytes.fromhex(author)))
+    if kind is not None:
+        tlv.append((TLV_KIND, kind.to_bytes(4, "big")))
+    return encode("nevent", _encode_tlv(tlv))
+
+
+def encode_naddr(
+    identifier: str, pubkey: str, kind: int, relays: Optional[List[str]] = None
+) -> str:
+    tlv = [
+        (TLV_SPECIAL, identifier.encode()),
+        *_relays(relays or []),
+        (TLV_AUTHOR, bytes.fromhex(pubkey)),
+        (TLV_KIND, kind.to_bytes(4, "big")),
+    ]
+    return encode("naddr", _encode_tlv(tlv))
+
+
+def decode_entity(bech: str) -> Tuple[str, Entity]:
+    """
+    Decodes any NIP-19 entity. Keys and note ids are returned as hex strings,
+    TLV entities as pointers. Unknown TLV types are ignored.
+    """
+    hrp, data = decode(bech)
+    if hrp in KEY_PREFIXES:
+        return hrp, _hex32(data, hrp)
+
+    tlv = _decode_tlv(data)
+    special = tlv.get(TLV_SPECIAL)
+    if not special:
+        raise ValueError(f"Missing TLV 0 for {hrp}")
+    relays = [r.decode() for r in tlv.get(TLV_RELAY, [])]
+    authors = tlv.get(TLV_AUTHOR)
+    kinds = tlv.get(TLV_KIND)
+    kind = int.from_bytes(kinds[0], "big") if kinds else None
+
+    if hrp == "nprofile":
+        return hrp, ProfilePointer(_hex32(special[0], "pubkey"), relays)
+    if hrp == "nevent":
+        author = _hex32(authors[0], "author") if authors else None
+        return hrp, EventPointer(_hex32(special[0], "id"), relays, author, kind)
+    if hrp == "naddr":
+        if not authors or kind is None:
+            raise ValueError("Missing TLV author or kind for naddr")
+        pubkey = _hex32(authors[0], "author")
+        return hrp, AddressPointer(special[0].decode(), pubkey, kind, relays)
+    raise ValueError(f"Unknown NIP-19 prefix: {hrp}")
+
+
+def decode_entities(bechs: List[str]) -> List[Tuple[str, Entity]]:
+    return [decode_entity(bech) for bech in bechs]
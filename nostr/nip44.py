@@ -0,0 +1,93 @@
+"""NIP-44 (version 2) payload encryption: ChaCha20 + HMAC-SHA256 with padding."""
+
+import base64
+import hmac
+import secrets
+from hashlib import sha256
+from typing import Optional
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms
+from cryptography.hazmat.primitives.kdf.hkdf import HKDFExpand
+
+VERSION = 2
+SALT = b"nip44-v2"
+MIN_PLAINTEXT_SIZE = 1
+MAX_PLAINTEXT_SIZE = 65535
+
+
+def get_conversation_key(shared_x: bytes) -> bytes:
+    """HKDF-extract of the ECDH x coordinate, the same for both parties"""
+    return hmac.new(SALT, shared_x, sha256).digest()
+
+
+def get_message_keys(
+    conversation_key: bytes, nonce: bytes
+) -> tuple[bytes, bytes, bytes]:
+    keys = HKDFExpand(algorithm=hashes.SHA256(), length=76, info=nonce).derive(
+        conversation_key
+    )
+    return keys[0:32], keys[32:44], keys[44:76]
+
+
+def calc_padded_len(unpadded_len: int) -> int:
+    if unpadded_len <= 32:
+        return 32
+    next_power = 1 << (unpadded_len - 1).bit_length()
+    chunk = 32 if next_power <= 256 else next_power // 8
+    return chunk * ((unpadded_len - 1) // chunk + 1)
+
+
+def pad(plaintext: str) -> bytes:
+    data = plaintext.encode()
+    if not MIN_PLAINTEXT_SIZE <= len(data) <= MAX_PLAINTEXT_SIZE:
+        raise ValueError("Invalid plaintext length")
+    padding = bytes(calc_padded_len(len(data)) - len(data))
+    return len(data).to_bytes(2, "big") + data + padding
+
+
+def unpad(padded: bytes) -> str:
+    unpadded_len = int.from_bytes(padded[:2], "big")
+    data = padded[2 : 2 + unpadded_len]
+    if (
+        unpadded_len < MIN_PLAINTEXT_SIZE
+        or len(data) != unpadded_len
+        or len(padded) != 2 + calc_padded_len(unpadded_len)
+    ):
+        raise ValueError("Invalid padding")
+    return data.decode()
+
+
+def _chacha20(key: bytes, nonce: bytes, data: bytes) -> bytes:
+    # the cryptography nonce is the 32 bit block counter (0) followed by the nonce
+    cipher = Cipher(algorithms.ChaCha20(key, bytes(4) + nonce), mode=None)
+    return cipher.encryptor().update(data)
+
+
+def encrypt(
+    plaintext: str, conversation_key: bytes, nonce: Optional[bytes] = None
+) -> str:
+    nonce = nonce or secrets.token_bytes(32)
+    chacha_key, chacha_nonce, hmac_key = get_message_keys(conversation_key, nonce)
+    ciphertext = _chacha20(chacha_key, chacha_nonce, pad(plaintext))
+    mac = hmac.new(hmac_key, nonce + ciphertext, sha256).digest()
+    return base64.b64encode(bytes([VERSION]) + nonce + ciphertext + mac).decode()
+
+
+def decrypt(payload: str, conversation_key: bytes) -> str:
+    if not payload or payload[0] == "#":
+        raise ValueError("Unknown encryption version")
+    if not 132 <= len(payload) <= 87472:
+        raise ValueError("Invalid payload size")
+    data = base64.b64decode(payload)
+    if not 99 <= len(data) <= 65603:
+        raise ValueError("Invalid data size")
+    if data[0] != VERSION:
+        raise ValueError(f"Unknown encryption version: {data[0]}")
+
+    nonce, ciphertext, mac = data[1:33], data[33:-32], data[-32:]
+    chacha_key, chacha_nonce, hmac_key = get_message_keys(conversation_key, nonce)
+    expected_mac = hmac.new(hmac_key, nonce + ciphertext, sha256).digest()
+    if not hmac.compare_digest(mac, expected_mac):
+        raise ValueError("Invalid MAC")
+    return unpad(_chacha20(chacha_key, chacha_nonce, ciphertext))
@@ -0,0 +1,74 @@
+import gzip
+import json
+import time
+from threading import Lock
+from typing import Iterator, Optional
+
+from .message_pool import MessagePool
+
+INBOUND = "<"
+OUTBOUND = ">"
+
+
+class FrameRecorder:
+    """
+    Captures relay traffic to a gzip compressed file with one JSON array per line:
+    `[timestamp, direction, relay_url, frame]`.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.num_frames = 0
+        self.started_at = time.time()
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._lock = Lock()
+
+    def record(self, direction: str, url: str, frame: str):
+        line = json.dumps([round(time.time(), 6), direction, url, frame])
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line + "\n")
+            self.num_frames += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_frames(path: str) -> Iterator[tuple[float, str, str, str]]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            timestamp, direction, url, frame = json.loads(line)
+            yield timestamp, direction, url, frame
+
+
+def replay_frames(
+    path: str,
+    message_pool: MessagePool,
+    speed: Optional[float] = 1.0,
+) -> int:
+    """
+    Feed the inbound frames of a capture into a `MessagePool`.
+    A `speed` of 2 replays twice as fast as recorded, `None` replays without pauses.
+    Returns the number of frames replayed.
+    """
+    num_frames = 0
+    first_timestamp: Optional[float] = None
+    start = time.monotonic()
+    for timestamp, direction, url, frame in read_frames(path):
+        if direction != INBOUND:
+            continue
+        if first_timestamp is None:
+            first_timestamp = timestamp
+        if speed:
+            delay = (timestamp - first_timestamp) / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        try:
+            message_pool.add_message(frame, url)
+        except Exception:
+            # a capture can contain frames the pool rejects, keep replaying
+            pass
+        num_frames += 1
+    return num_frames
@@ -1,13 +1,75 @@
 import asyncio
 import json
+import threading
 import time
-from queue import Queue
+from collections import deque
+from typing import Optional
 
 from loguru import logger
 from websocket import WebSocketApp
 
-from .message_pool import MessagePool
+from .compression import DeflateOptions, DeflateWebSocket
+from .frame_validator import (
+    FrameValidator,
+    InvalidFrame,
+    frame_subscription_id,
+    frame_type,
+)
+from .heartbeat import Heartbeat, rtt_seconds
+from .ingestion import IngestionPipeline
+from .negentropy import NegentropySync
+from .message_pool import EndOfStoredEventsMessage, MessagePool
+from .message_type import ClientMessageType
+from .metrics import metrics
+from .recorder import INBOUND, OUTBOUND, FrameRecorder
+from .send_queue import SendQueue
 from .subscription import Subscription
+from .tracing import tracer
+
+messages_received = metrics.counter(
+    "nostrclient_relay_messages_received_total",
+    "Messages received from a relay",
+    ("relay",),
+)
+bytes_received = metrics.counter(
+    "nostrclient_relay_received_bytes_total",
+    "Size of the messages received from a relay (in characters)",
+    ("relay",),
+)
+messages_sent = metrics.counter(
+    "nostrclient_relay_messages_sent_total",
+    "Messages sent to a relay",
+    ("relay",),
+)
+bytes_sent = metrics.counter(
+    "nostrclient_relay_sent_bytes_total",
+    "Size of the messages sent to a relay (in characters)",
+    ("relay",),
+)
+rejected_frames = metrics.counter(
+    "nostrclient_relay_rejected_frames_total",
+    "Frames from a relay that were dropped as invalid, by reason",
+    ("relay", "reason"),
+)
+negentropy_syncs = metrics.counter(
+    "nostrclient_relay_negentropy_syncs_total",
+    "Subscriptions synced with NIP-77 instead of requesting all their events",
+    ("relay", "result"),
+)
+negentropy_missing_events = metrics.counter(
+    "nostrclient_relay_negentropy_missing_events_total",
+    "Events requested after a NIP-77 sync, the ones missing locally",
+    ("relay",),
+)
+eose_seconds = metrics.histogram(
+    "nostrclient_relay_eose_seconds",
+    "Time between requesting a subscription and receiving its EOSE",
+    ("relay",),
+)
+
+MAX_MESSAGES = 100
+# seconds to wait for the first NEG-MSG, relays without NIP-77 may not answer
+NEGENTROPY_TIMEOUT = 30
 
 
 class Relay:
@@ -20,27 +82,62 @@ class Relay:
 
         self.error_counter: int = 0
         self.error_threshold: int = 100
-        self.error_list: list[str] = []
-        self.notice_list: list[str] = []
+        # newest first, only the last `MAX_MESSAGES` are kept
+        self.error_list: deque[str] = deque(maxlen=MAX_MESSAGES)
+        self.notice_list: deque[str] = deque(maxlen=MAX_MESSAGES)
         self.last_error_date: int = 0
         self.num_received_events: int = 0
         self.num_sent_events: int = 0
         self.num_subscriptions: int = 0
 
-        self.queue: Queue = Queue()
+        self.queue: SendQueue = SendQueue()
+        self._subscriptions_requested_at: dict[str, float] = {}
+        # the last event of the subscriptions still waiting for their EOSE
+        self._subscriptions_last_event: dict[str, float] = {}
+        self.recorder: Optional[FrameRecorder] = None
+        self.validator: FrameValidator = FrameValidator()
+        self.pipeline: Optional[IngestionPipeline] = None
+        self.compression: DeflateOptions = DeflateOptions()
+        # NIP-77 support, `None` until the relay answered a NEG-OPEN
+        self.negentropy_supported: Optional[bool] = None
+        # negentropy session id -> the sync it belongs to
+        self._syncs: dict[str, NegentropySync] = {}
+        self.heartbeat: Heartbeat = Heartbeat()
+        # consecutive connections dropped by the heartbeat
+        self.num_heartbeat_failures = 0
+        self._connected_at = 0.0
+        self.num_rejected_frames: dict[str, int] = {}
+        # frames received and rejected since the last junk ratio check
+        self._window_frames = 0
+        self._window_rejected = 0
+        self._window_lock = threading.Lock()
 
     def connect(self):
-        self.ws = WebSocketApp(
-            self.url,
-            on_open=self._on_open,
-            on_message=self._on_message,
-            on_error=self._on_error,
-            on_close=self._on_close,
-            on_ping=self._on_ping,
-            on_pong=self._on_pong,
-        )
+        if self.compression.enabled:
+            self.ws = DeflateWebSocket(
+                self.url,
+                self.compression,
+                on_open=self._on_open,
+                on_message=self._on_message,
+                on_error=self._on_error,
+                on_close=self._on_close,
+                on_pong=self._on_pong,
+                # bounds decompression, frames are utf-8 (up to 4 bytes a character)
+                max_size=4 * self.validator.max_frame_size,
+            )
+        else:
+            self.ws = WebSocketApp(
+                self.url,
+                on_open=self._on_open,
+                on_message=self._on_message,
+                on_error=self._on_error,
+                on_close=self._on_close,
+                on_ping=self._on_ping,
+                on_pong=self._on_pong,
+            )
         if not self.connected:
-            self.ws.run_forever(ping_interval=10)
+            # pings are sent by `check_heartbeat`
+            self.ws.run_forever()
 
     def close(self):
         try:
@@ -56,8 +153,42 @@ class Relay:
 
     @property
     def ping(self):
-        ping_ms = int((self.ws.last_pong_tm - self.ws.last_ping_tm) * 1000)
-        return ping_ms if self.connected and ping_ms > 0 else 0
+        rtt = self.heartbeat.rtt.last
+        return int(rtt * 1000) if self.connected and rtt else 0
+
+    def check_heartbeat(self, now: Optional[float] = None) -> Optional[str]:
+        """
+        Sends a ping if the connection is idle, returns why the connection is
+        considered dead (see `Heartbeat.check`) or `None`.
+        """
+        if not self.connected:
+            return None
+        now = now or time.monotonic()
+        heartbeat = self.heartbeat
+        if self.num_heartbeat_failures and heartbeat.last_seen > self._connected_at:
+            self.num_heartbeat_failures = 0
+        # requests count from when they were sent, not while queued or paced
+        requests = list(self._subscriptions_requested_at.items())
+        last_event = self._subscriptions_last_event
+        quiet_since = min(
+            (
+                max(requested_at, last_event.get(sub_id, 0))
+                for sub_id, requested_at in requests
+            ),
+            default=None,
+        )
+        reason = heartbeat.check(now, quiet_since)
+        if reason or not heartbeat.ping_due(now):
+            return reason
+        payload = heartbeat.ping(now)
+        try:
+            if isinstance(self.ws, DeflateWebSocket):
+                self.ws.ping(payload)
+            else:
+                self.ws.sock.ping(payload)
+        except Exception as e:
+            logger.debug(f"[Relay: {self.url}] Failed to send ping: {e}")
+        return None
 
     def publish(self, message: str):
         self.queue.put(message)
@@ -68,13 +199,25 @@ class Relay:
             json_str = json.dumps(["REQ", s.id, *s.filters])
             self.publish(json_str)
 
+    def sync_subscriptions(self, syncs: list[NegentropySync]):
+        """Requests only the events missing locally, falls back to a plain REQ"""
+        for sync in syncs:
+            # live events do not wait for the sync (or its timeout)
+            self.publish(sync.live_request_message())
+            messages = sync.open_messages()
+            for session_id in sync.session_ids:
+                self._syncs[session_id] = sync
+            for message in messages:
+                self.publish(message)
+            timer = threading.Timer(NEGENTROPY_TIMEOUT, self._sync_timeout, [sync])
+            timer.daemon = True
+            timer.start()
+
     async def queue_worker(self):
         while True:
             if self.connected:
                 try:
-                    message = self.queue.get(timeout=1)
-                    self.num_sent_events += 1
-                    self.ws.send(message)
+                    self._send(self.queue.get(timeout=1))
                 except Exception as _:
                     pass
             else:
@@ -84,17 +227,61 @@ class Relay:
                 logger.warning(f"[Relay: {self.url}] Closing queue worker.")
                 return
 
+    def _send(self, message: str):
+        self.num_sent_events += 1
+        self.ws.send(message)
+        message_type = frame_type(message)
+        if message_type in (ClientMessageType.REQUEST, ClientMessageType.CLOSE):
+            self._on_subscription_sent(message_type, message)
+        if self.recorder:
+            self.recorder.record(OUTBOUND, self.url, message)
+        messages_sent.inc(relay=self.url)
+        bytes_sent.inc(len(message), relay=self.url)
+
+    def _on_subscription_sent(self, message_type: str, message: str):
+        """The stall check and the EOSE time of a REQ start once it is sent"""
+        sub_id = frame_subscription_id(message)
+        if sub_id is None:
+            return
+        if message_type == ClientMessageType.REQUEST:
+            self._subscriptions_last_event.pop(sub_id, None)
+            self._subscriptions_requested_at[sub_id] = time.monotonic()
+        else:
+            # a REQ taken from the queue before the CLOSE was queued
+            self._subscription_answered(sub_id)
+
     def close_subscription(self, sub_id: str) -> None:
+        self._subscription_answered(sub_id)
+        for session_id, sync in list(self._syncs.items()):
+            if sync.subscription.id == sub_id:
+                self._syncs.pop(session_id, None)
+                self.publish(json.dumps(["NEG-CLOSE", session_id]))
         try:
             self.publish(json.dumps(["CLOSE", sub_id]))
         except Exception as e:
             logger.debug(f"[Relay: {self.url}] Failed to close subscription: {e}")
 
+    def observe_eose(self, eose: EndOfStoredEventsMessage):
+        requested_at = self._subscription_answered(eose.subscription_id)
+        if requested_at is not None:
+            eose_seconds.observe(eose.received_at - requested_at, relay=self.url)
+
+    def observe_closed(self, sub_id: str):
+        """The relay closed the subscription, it is not waiting for an EOSE"""
+        self._subscription_answered(sub_id)
+
+    def _subscription_answered(self, sub_id: str) -> Optional[float]:
+        """Stops the stall check of a subscription, returns when it was requested"""
+        self._subscriptions_last_event.pop(sub_id, None)
+        return self._subscriptions_requested_at.pop(sub_id, None)
+
     def add_notice(self, notice: str):
-        self.notice_list = [notice, *self.notice_list]
+        self.notice_list.appendleft(notice)
 
     def _on_open(self, _):
         logger.info(f"[Relay: {self.url}] Connected.")
+        self._connected_at = time.monotonic()
+        self.heartbeat.reset(self._connected_at)
         self.connected = True
         self.shutdown = False
 
@@ -106,8 +293,117 @@ class Relay:
         self.close()
 
     def _on_message(self, _, message: str):
+        trace = tracer.start()
+        self.heartbeat.on_traffic()
+        if self._subscriptions_requested_at and frame_type(message) == "EVENT":
+            sub_id = frame_subscription_id(message)
+            if sub_id in self._subscriptions_requested_at:
+                self._subscriptions_last_event[sub_id] = time.monotonic()
+        if self.recorder:
+            self.recorder.record(INBOUND, self.url, message)
         self.num_received_events += 1
-        self.message_pool.add_message(message, self.url)
+        messages_received.inc(relay=self.url)
+        bytes_received.inc(len(message), relay=self.url)
+
+        if not (self.pipeline and self.pipeline.submit(self, message, trace)):
+            self.ingest(message, trace)
+
+    def ingest(self, message: str, trace: Optional[dict[str, float]] = None):
+        """Validates and parses a frame, on an ingestion worker if there are any"""
+        reason = self.validator.check_frame(message)
+        if not reason:
+            try:
+                message_type = frame_type(message)
+                if message_type in ("NEG-MSG", "NEG-ERR"):
+                    self._handle_negentropy(json.loads(message))
+                else:
+                    if message_type == "NOTICE" and self._syncs:
+                        self._negentropy_notice()
+                    self.message_pool.add_message(message, self.url, trace)
+            except InvalidFrame as e:
+                reason = e.reason
+            except Exception as e:
+                logger.debug(f"[Relay: {self.url}] Invalid frame: {e}")
+                reason = "malformed"
+        self._count_frame(reason)
+
+    def _handle_negentropy(self, message: list):
+        session_id = message[1]
+        sync = self._syncs.get(session_id)
+        if not sync:
+            return
+        self.negentropy_supported = True
+        if message[0] == "NEG-ERR":
+            logger.debug(f"[Relay: {self.url}] NIP-77 sync failed: {message[2:]}")
+            sync.handle_error(session_id)
+        else:
+            for frame in sync.handle_message(session_id, message[2]):
+                self.publish(frame)
+        if session_id not in sync.session_ids:
+            self._syncs.pop(session_id, None)
+        if sync.done:
+            self._finish_sync(sync)
+
+    def _finish_sync(self, sync: NegentropySync):
+        if sync.failed:
+            negentropy_syncs.inc(relay=self.url, result="failed")
+            self.publish_subscriptions([sync.subscription])
+            return
+        negentropy_syncs.inc(relay=self.url, result="synced")
+        negentropy_missing_events.inc(len(set(sync.need_ids)), relay=self.url)
+        self.publish(sync.request_message())
+
+    def _negentropy_notice(self):
+        """
+        Relays without NIP-77 answer a NEG-OPEN with a NOTICE (e.g. "unknown
+        message type"), a NOTICE before any NEG-MSG ends the syncs at once
+        """
+        if self.negentropy_supported is not None:
+            return
+        for sync in {id(s): s for s in list(self._syncs.values())}.values():
+            self._abort_sync(sync, "is not supported")
+
+    def _sync_timeout(self, sync: NegentropySync):
+        self._abort_sync(sync, "timed out")
+
+    def _abort_sync(self, sync: NegentropySync, reason: str):
+        session_ids = [i for i, s in list(self._syncs.items()) if s is sync]
+        if not session_ids:
+            return
+        logger.info(f"[Relay: {self.url}] NIP-77 sync {reason}, using REQ.")
+        for session_id in session_ids:
+            self._syncs.pop(session_id, None)
+        if self.negentropy_supported is None:
+            self.negentropy_supported = False
+            negentropy_syncs.inc(relay=self.url, result="unsupported")
+        else:
+            negentropy_syncs.inc(relay=self.url, result="timeout")
+            for session_id in session_ids:
+                self.publish(json.dumps(["NEG-CLOSE", session_id]))
+        self.publish_subscriptions([sync.subscription])
+
+    def _count_frame(self, reason: Optional[str]):
+        if reason:
+            rejected_frames.inc(relay=self.url, reason=reason)
+        with self._window_lock:
+            self._window_frames += 1
+            if reason:
+                self._window_rejected += 1
+                self.num_rejected_frames[reason] = (
+                    self.num_rejected_frames.get(reason, 0) + 1
+                )
+            if self._window_frames < self.validator.window:
+                return
+            junk = self.validator.is_junk_ratio_exceeded(
+                self._window_frames, self._window_rejected
+            )
+            self._window_frames = self._window_rejected = 0
+        if junk:
+            # the restart back-off grows with the error counter
+            message = "Too many invalid frames, disconnecting."
+            logger.warning(f"[Relay: {self.url}] {message}")
+            self._append_error_message(message)
+            self.close()
 
     def _on_error(self, _, error):
         logger.warning(f"[Relay: {self.url}] Error: '{error!s}'")
@@ -117,10 +413,14 @@ class Relay:
     def _on_ping(self, *_):
         return
 
-    def _on_pong(self, *_):
-        return
+    def _on_pong(self, _, payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        rtt = self.heartbeat.on_pong(payload)
+        if rtt is not None:
+            rtt_seconds.observe(rtt, relay=self.url)
 
     def _append_error_message(self, message):
         self.error_counter += 1
-        self.error_list = [message, *self.error_list]
+        self.error_list.appendleft(message)
         self.last_error_date = int(time.time())
@@ -1,15 +1,39 @@
 import asyncio
 import threading
 import time
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
 from loguru import logger
 
-from .message_pool import MessagePool, NoticeMessage
+from .compression import DeflateOptions
+from .frame_validator import FrameValidator
+from .heartbeat import Heartbeat, heartbeat_failures
+from .ingestion import IngestionPipeline
+from .negentropy import NegentropySync
+from .message_pool import (
+    ClosedMessage,
+    EndOfStoredEventsMessage,
+    MessagePool,
+    NoticeMessage,
+)
+from .recorder import FrameRecorder
 from .relay import Relay
+from .relay_url import normalize_relay_url
 from .subscription import Subscription
 
 
+# CLOSED reasons (NIP-01 prefixes) worth retrying on the same relay
+TRANSIENT_CLOSED_REASONS = ("rate-limited", "error")
+MAX_RESUBSCRIBE_ATTEMPTS = 3
+RESUBSCRIBE_DELAY = 5
+# seconds between heartbeat checks of all relays
+HEARTBEAT_CHECK_INTERVAL = 1
+# connections dropped by the heartbeat in a row that are restarted at once,
+# further ones wait for the back-off of `check_and_restart_relays`
+MAX_FAST_RESTARTS = 3
+
+
 class RelayManager:
     def __init__(self) -> None:
         self.relays: dict[str, Relay] = {}
@@ -18,21 +42,76 @@ class RelayManager:
         self.message_pool = MessagePool()
         self._cached_subscriptions: dict[str, Subscription] = {}
         self._subscriptions_lock = threading.Lock()
+        # subscription id -> urls of the relays that closed it
+        self._closed_by: dict[str, set[str]] = {}
+        # subscription id -> url -> number of resubscribe attempts
+        self._resubscribe_attempts: dict[str, dict[str, int]] = {}
+        self.recorder: Optional[FrameRecorder] = None
+        # shared by all relays, so settings changes apply to all connections
+        self.frame_validator = FrameValidator()
+        # messages per second sent to each relay, 0 is unlimited
+        self.max_send_rate: float = 0
+        # permessage-deflate for new relay connections
+        self.compression = DeflateOptions()
+        # resubscribe with NIP-77 to the relays that support it
+        self.negentropy_sync = False
+        self._negentropy_unsupported: set[str] = set()
+        # parses the frames of all relays, on the websocket threads by default
+        self.ingestion = IngestionPipeline()
+        # settings of the relay heartbeats, see `Heartbeat`
+        self.idle_ping_interval: float = 10
+        self.max_pong_timeout: float = 20
+        self.stall_timeout: float = 60
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        self._heartbeat_stopped = threading.Event()
+        self._restart_lock = threading.Lock()
+
+    @property
+    def num_subscriptions(self) -> int:
+        return len(self._cached_subscriptions)
+
+    @property
+    def has_relays(self) -> bool:
+        """Relays were added, they may not be connected yet"""
+        return bool(self.relays)
 
     def add_relay(self, url: str) -> Relay:
+        """Relays are keyed by their normalized URL, see `normalize_relay_url`"""
+        url = normalize_relay_url(url)
         if url in list(self.relays.keys()):
             logger.debug(f"Relay '{url}' already present.")
             return self.relays[url]
 
         relay = Relay(url, self.message_pool)
+        relay.recorder = self.recorder
+        relay.validator = self.frame_validator
+        relay.pipeline = self.ingestion
+        relay.compression = self.compression
+        relay.queue.max_rate = self.max_send_rate
+        self._configure_heartbeat(relay.heartbeat)
         self.relays[url] = relay
 
         self._open_connection(relay)
 
-        relay.publish_subscriptions(list(self._cached_subscriptions.values()))
+        subscriptions = list(self._cached_subscriptions.values())
+        if self.negentropy_sync and url not in self._negentropy_unsupported:
+            syncs = [
+                NegentropySync(s, items, self.message_pool.items_complete(s.id))
+                for s in subscriptions
+                if (items := self.message_pool.items(s.id))
+            ]
+            relay.sync_subscriptions(syncs)
+            synced = {sync.subscription.id for sync in syncs}
+            subscriptions = [s for s in subscriptions if s.id not in synced]
+        relay.publish_subscriptions(subscriptions)
         return relay
 
     def remove_relay(self, url: str):
+        url = normalize_relay_url(url)
+        relay = self.relays.get(url)
+        if relay and relay.negentropy_supported is False:
+            # also when the relay is added again later
+            self._negentropy_unsupported.add(url)
         try:
             self.relays[url].close()
         except Exception as e:
@@ -57,12 +136,35 @@ class RelayManager:
         if url in self.queue_threads:
             self.queue_threads.pop(url)
 
+    def set_relays(self, urls: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        Connects to the new relays and disconnects from the ones not in `urls`,
+        in parallel. Relays in both keep their connection and subscriptions.
+        Returns the added and the removed URLs.
+        """
+        desired: List[str] = []
+        for url in urls:
+            try:
+                desired.append(normalize_relay_url(url))
+            except ValueError as e:
+                logger.warning(f"Relay '{url}' skipped: {e}")
+        desired = list(dict.fromkeys(desired))
+        current = list(self.relays.keys())
+        added = [url for url in desired if url not in current]
+        removed = [url for url in current if url not in desired]
+        if added or removed:
+            # `remove_relay` waits for the relay threads to exit
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                list(executor.map(self.remove_relay, removed))
+                list(executor.map(self.add_relay, added))
+        return added, removed
+
     def remove_relays(self):
         relay_urls = list(self.relays.keys())
         for url in relay_urls:
             self.remove_relay(url)
 
-    def add_subscription(self, id: str, filters: List[str]):
+    def add_subscription(self, id: str, filters: List[dict]):
         s = Subscription(id, filters)
         with self._subscriptions_lock:
             self._cached_subscriptions[id] = s
@@ -76,6 +178,9 @@ class RelayManager:
             with self._subscriptions_lock:
                 if id in self._cached_subscriptions:
                     self._cached_subscriptions.pop(id)
+                self._closed_by.pop(id, None)
+                self._resubscribe_attempts.pop(id, None)
+            self.message_pool.forget_items(id)
 
             for relay in self.relays.values():
                 relay.close_subscription(id)
@@ -96,19 +201,155 @@ class RelayManager:
             self._restart_relay(relay)
 
     def close_connections(self):
+        self._heartbeat_stopped.set()
         for relay in self.relays.values():
             relay.close()
+        self.ingestion.stop()
 
     def publish_message(self, message: str):
         for relay in self.relays.values():
             relay.publish(message)
 
     def handle_notice(self, notice: NoticeMessage):
-        relay = next((r for r in self.relays.values() if r.url == notice.url))
+        relay = self.relays.get(notice.url)
         if relay:
             relay.add_notice(notice.content)
 
+    def set_max_send_rate(self, max_send_rate: float):
+        self.max_send_rate = max_send_rate
+        for relay in self.relays.values():
+            relay.queue.max_rate = max_send_rate
+
+    def set_compression(self, compression: DeflateOptions):
+        """Applies to the connections opened from now on"""
+        self.compression = compression
+
+    def set_heartbeat(
+        self, idle_ping_interval: float, max_pong_timeout: float, stall_timeout: float
+    ):
+        """`stall_timeout` 0 disables the stall detection"""
+        self.idle_ping_interval = idle_ping_interval
+        self.max_pong_timeout = max_pong_timeout
+        self.stall_timeout = stall_timeout
+        for relay in list(self.relays.values()):
+            self._configure_heartbeat(relay.heartbeat)
+
+    def _configure_heartbeat(self, heartbeat: Heartbeat):
+        heartbeat.idle_interval = self.idle_ping_interval
+        heartbeat.max_pong_timeout = self.max_pong_timeout
+        heartbeat.min_pong_timeout = min(
+            heartbeat.min_pong_timeout, self.max_pong_timeout
+        )
+        heartbeat.stall_timeout = self.stall_timeout
+
+    def set_negentropy_sync(self, enabled: bool):
+        """Keeps the received events of each subscription to sync them later"""
+        self.negentropy_sync = enabled
+        self.message_pool.record_items = enabled
+        if not enabled:
+            self.message_pool.forget_items()
+
+    def set_ingestion_workers(self, num_workers: int, max_queued: int):
+        self.ingestion.set_workers(num_workers, max_queued)
+
+    def start_recording(self, path: str) -> FrameRecorder:
+        """Capture the frames exchanged with all relays, see `recorder.replay_frames`"""
+        self.stop_recording()
+        self.recorder = FrameRecorder(path)
+        for relay in self.relays.values():
+            relay.recorder = self.recorder
+        return self.recorder
+
+    def stop_recording(self) -> Optional[FrameRecorder]:
+        recorder = self.recorder
+        if not recorder:
+            return None
+        self.recorder = None
+        for relay in self.relays.values():
+            relay.recorder = None
+        recorder.close()
+        return recorder
+
+    def handle_eose(self, eose: EndOfStoredEventsMessage):
+        relay = self.relays.get(eose.url)
+        if relay:
+            relay.observe_eose(eose)
+
+    def handle_closed(self, closed: ClosedMessage) -> bool:
+        """
+        A subscription closed by a relay for a transient reason is requested again
+        after a back-off, meanwhile the other relays keep serving it.
+        Returns `True` when no relay serves the subscription anymore.
+        """
+        url, sub_id = closed.url, closed.subscription_id
+        relay = self.relays.get(url)
+        if not relay:
+            return False
+        relay.add_notice(f"CLOSED '{sub_id}': {closed.message}")
+        relay.observe_closed(sub_id)
+        with self._subscriptions_lock:
+            if sub_id not in self._cached_subscriptions:
+                return False
+            attempts = self._resubscribe_attempts.setdefault(sub_id, {})
+            num_attempts = attempts.get(url, 0)
+            if (
+                closed.reason in TRANSIENT_CLOSED_REASONS
+                and num_attempts < MAX_RESUBSCRIBE_ATTEMPTS
+            ):
+                attempts[url] = num_attempts + 1
+                delay = RESUBSCRIBE_DELAY * 2**num_attempts
+                timer = threading.Timer(delay, self._resubscribe, (url, sub_id))
+                timer.daemon = True
+                timer.start()
+                return False
+
+            closed_by = self._closed_by.setdefault(sub_id, set())
+            closed_by.add(url)
+            return closed_by.issuperset(self.relays.keys())
+
+    def _resubscribe(self, url: str, sub_id: str):
+        relay = self.relays.get(url)
+        subscription = self._cached_subscriptions.get(sub_id)
+        if relay and subscription:
+            logger.debug(f"[Relay: {url}] Resubscribing to '{sub_id}'.")
+            relay.publish_subscriptions([subscription])
+
+    def check_heartbeats(self):
+        """Pings the idle relays and reconnects the dead ones"""
+        for relay in list(self.relays.values()):
+            try:
+                reason = relay.check_heartbeat()
+            except Exception as e:
+                logger.debug(f"[Relay: {relay.url}] Heartbeat check failed: {e}")
+                continue
+            if not reason:
+                continue
+            logger.warning(f"[Relay: {relay.url}] Heartbeat failed: {reason}.")
+            heartbeat_failures.inc(relay=relay.url, reason=reason)
+            relay.num_heartbeat_failures += 1
+            relay._append_error_message(f"Heartbeat failed: {reason}")
+            relay.close()
+            if relay.num_heartbeat_failures <= MAX_FAST_RESTARTS:
+                # `remove_relay` waits for the relay threads, not on this thread
+                threading.Thread(
+                    target=self._restart_relay,
+                    args=(relay, True),
+                    name=f"{relay.url}-restart",
+                    daemon=True,
+                ).start()
+
+    def _heartbeat_worker(self):
+        while not self._heartbeat_stopped.wait(HEARTBEAT_CHECK_INTERVAL):
+            self.check_heartbeats()
+
     def _open_connection(self, relay: Relay):
+        if not self._heartbeat_thread or not self._heartbeat_thread.is_alive():
+            self._heartbeat_stopped.clear()
+            self._heartbeat_thread = threading.Thread(
+                target=self._heartbeat_worker, name="relay-heartbeat", daemon=True
+            )
+            self._heartbeat_thread.start()
+
         self.threads[relay.url] = threading.Thread(
             target=relay.connect,
             name=f"{relay.url}-thread",
@@ -126,18 +367,26 @@ class RelayManager:
         )
         self.queue_threads[relay.url].start()
 
-    def _restart_relay(self, relay: Relay):
+    def _restart_relay(self, relay: Relay, force: bool = False):
+        """`force` skips the back-off, for connections dropped by the heartbeat"""
         time_since_last_error = time.time() - relay.last_error_date
 
         min_wait_time = min(
             60 * relay.error_counter, 60 * 60
         )  # try at least once an hour
-        if time_since_last_error < min_wait_time:
+        if time_since_last_error < min_wait_time and not force:
             return
 
-        logger.info(f"Restarting connection to relay '{relay.url}'")
+        with self._restart_lock:
+            # restarted or removed meanwhile
+            if self.relays.get(relay.url) is not relay:
+                return
+
+            logger.info(f"Restarting connection to relay '{relay.url}'")
 
-        self.remove_relay(relay.url)
-        new_relay = self.add_relay(relay.url)
-        new_relay.error_counter = relay.error_counter
-        new_relay.error_list = relay.error_list
+            self.remove_relay(relay.url)
+            new_relay = self.add_relay(relay.url)
+            new_relay.error_counter = relay.error_counter
+            new_relay.error_list = relay.error_list
+            new_relay.num_heartbeat_failures = relay.num_heartbeat_failures
+            new_relay.heartbeat.rtt = relay.heartbeat.rtt
@@ -0,0 +1,33 @@
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"ws": 80, "wss": 443}
+
+
+def normalize_relay_url(url: str) -> str:
+    """
+    The canonical form of a relay URL, so `wss://Relay.x/` and `relay.x` are the
+    same relay: scheme and host in lower case, no default port, no trailing
+    slash, no fragment, sorted query. Raises `ValueError` for non websocket URLs.
+    """
+    url = url.strip()
+    if "://" not in url:
+        url = f"wss://{url}"
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    scheme = {"http": "ws", "https": "wss"}.get(scheme, scheme)
+    if scheme not in DEFAULT_PORTS:
+        raise ValueError(f"Invalid relay URL scheme: '{parts.scheme}'")
+    if not parts.hostname:
+        raise ValueError(f"Invalid relay URL: '{url}'")
+
+    host = parts.hostname
+    if ":" in host:
+        host = f"[{host}]"  # IPv6
+    port = parts.port
+    if port and port != DEFAULT_PORTS[scheme]:
+        host = f"{host}:{port}"
+
+    path = "/".join(p for p in parts.path.split("/") if p)
+    path = f"/{path}" if path else ""
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
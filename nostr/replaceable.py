@@ -0,0 +1,79 @@
+import weakref
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from .message_pool import EventMessage, suppressed_events
+
+
+def is_replaceable(kind: int) -> bool:
+    return kind in (0, 3) or 10000 <= kind < 20000
+
+
+def is_parameterized_replaceable(kind: int) -> bool:
+    return 30000 <= kind < 40000
+
+
+def replaceable_key(event: dict) -> Optional[Tuple]:
+    """The `(pubkey, kind[, d])` address of a replaceable event, `None` otherwise"""
+    kind = event.get("kind")
+    pubkey = event.get("pubkey")
+    if not isinstance(kind, int) or not isinstance(event.get("created_at"), int):
+        return None
+    if is_replaceable(kind):
+        return pubkey, kind
+    if is_parameterized_replaceable(kind):
+        d_tag = next(
+            (t[1] for t in event.get("tags", []) if len(t) > 1 and t[0] == "d"), ""
+        )
+        return pubkey, kind, d_tag
+    return None
+
+
+def is_newer(event: dict, other: dict) -> bool:
+    """NIP-01: the latest `created_at` wins, the lowest id breaks ties"""
+    return (event["created_at"], other["id"]) > (other["created_at"], event["id"])
+
+
+class ReplaceableEvents:
+    """
+    Keeps only the newest version of replaceable events within a subscription.
+    Older versions that arrive later are dropped, buffered versions that get
+    replaced are marked as suppressed so they are skipped on delivery.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        # subscription id -> address -> `created_at`, id and a weak reference
+        # of the newest event seen, replaced payloads are not kept alive
+        self._latest: Dict[
+            str, Dict[Tuple, Tuple[int, str, "weakref.ref[EventMessage]"]]
+        ] = {}
+        self._lock = Lock()
+
+    def add(self, event_message: EventMessage) -> bool:
+        """Returns `False` if a newer version of the event was already received"""
+        key = replaceable_key(event_message.data)
+        if not key:
+            return True
+        with self._lock:
+            latest = self._latest.setdefault(event_message.subscription_id, {})
+            data = event_message.data
+            previous = latest.get(key)
+            if previous:
+                created_at, event_id, _ = previous
+                if not is_newer(data, {"created_at": created_at, "id": event_id}):
+                    suppressed_events.inc(reason="stale")
+                    return False
+            latest[key] = (data["created_at"], data["id"], weakref.ref(event_message))
+        previous_message = previous[2]() if previous else None
+        if previous_message and not previous_message.suppressed:
+            previous_message.suppressed = "replaced"
+        return True
+
+    def forget(self, subscription_id: str):
+        with self._lock:
+            self._latest.pop(subscription_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._latest.clear()
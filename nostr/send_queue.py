@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from queue import Empty
+from typing import Optional
+
+from .frame_validator import frame_type
+from .message_type import ClientMessageType
+
+
+class SendQueue:
+    """
+    Outbound messages of one relay, a drop-in for `queue.Queue` (`put`, `get`,
+    `qsize`) that:
+     - sends published EVENTs before pending REQs and CLOSEs, other messages
+       (e.g. the NIP-77 NEG-OPENs of resubscriptions) go after those, in order
+     - keeps at most one pending REQ or CLOSE per subscription: a CLOSE cancels a
+       REQ that was not sent yet, a newer REQ replaces an older one
+     - drops duplicate CLOSEs and CLOSEs of subscriptions the relay does not have
+     - paces sends to `max_rate` messages per second (0 disables pacing)
+    """
+
+    def __init__(self, max_rate: float = 0) -> None:
+        self.max_rate = max_rate
+        self.num_cancelled = 0
+        self._priority: deque[str] = deque()
+        self._other: deque[str] = deque()
+        # subscription id -> the pending REQ or CLOSE, in request order
+        self._subscriptions: OrderedDict[str, tuple[str, str]] = OrderedDict()
+        # subscriptions with a REQ sent to the relay and no CLOSE yet
+        self._open: set[str] = set()
+        self._next_send_at = 0.0
+        self._condition = threading.Condition()
+
+    def qsize(self) -> int:
+        return len(self._priority) + len(self._subscriptions) + len(self._other)
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def put(self, message: str):
+        message_type = frame_type(message)
+        with self._condition:
+            if message_type == ClientMessageType.EVENT:
+                self._priority.append(message)
+            elif message_type == ClientMessageType.REQUEST:
+                self._put_request(json.loads(message)[1], message)
+            elif message_type == ClientMessageType.CLOSE:
+                self._put_close(json.loads(message)[1], message)
+            else:
+                self._other.append(message)
+            self._condition.notify()
+
+    def get(self, timeout: Optional[float] = None) -> str:
+        """Raises `queue.Empty` if no message can be sent within `timeout` seconds"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if self.qsize() and now >= self._next_send_at:
+                    break
+                wait = deadline - now if deadline is not None else None
+                if wait is not None and wait <= 0:
+                    raise Empty
+                if self.qsize():
+                    # paced, wake up when the next message may be sent
+                    pause = self._next_send_at - now
+                    wait = min(wait, pause) if wait is not None else pause
+                self._condition.wait(wait)
+
+            if self._priority:
+                message = self._priority.popleft()
+            elif not self._subscriptions:
+                message = self._other.popleft()
+            else:
+                subscription_id, (message_type, message) = self._subscriptions.popitem(
+                    last=False
+                )
+                if message_type == ClientMessageType.REQUEST:
+                    self._open.add(subscription_id)
+                else:
+                    self._open.discard(subscription_id)
+            if self.max_rate:
+                self._next_send_at = max(now, self._next_send_at) + 1 / self.max_rate
+            return message
+
+    def get_nowait(self) -> str:
+        return self.get(timeout=0)
+
+    def _put_request(self, subscription_id: str, message: str):
+        if subscription_id in self._subscriptions:
+            # a REQ replaces both a pending REQ and a pending CLOSE (NIP-01)
+            self._subscriptions.pop(subscription_id)
+            self.num_cancelled += 1
+        self._subscriptions[subscription_id] = (ClientMessageType.REQUEST, message)
+
+    def _put_close(self, subscription_id: str, message: str):
+        pending = self._subscriptions.get(subscription_id)
+        if pending and pending[0] == ClientMessageType.CLOSE:
+            self.num_cancelled += 1
+            return
+        if pending:
+            self._subscriptions.pop(subscription_id)
+            self.num_cancelled += 1
+        if subscription_id not in self._open:
+            # the relay never saw a REQ for it (or it is closed already)
+            self.num_cancelled += 1
+            return
+        self._subscriptions[subscription_id] = (ClientMessageType.CLOSE, message)
@@ -2,6 +2,6 @@ from typing import Optional
 
 
 class Subscription:
-    def __init__(self, id: str, filters: Optional[list[str]] = None) -> None:
+    def __init__(self, id: str, filters: Optional[list[dict]] = None) -> None:
         self.id = id
         self.filters = filters
@@ -0,0 +1,105 @@
+import random
+import time
+from typing import Optional
+
+from .metrics import metrics
+
+STAGE_BUCKETS = (
+    0.00001,
+    0.00005,
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+class EventTracer:
+    """
+    Samples events as they are received from a relay and records the time they
+    reach each stage of the pipeline. Only sampled events carry a trace, so the
+    cost for the other events is a single random number per message.
+    """
+
+    STAGES = (
+        "received",  # Relay._on_message
+        "parsed",  # MessagePool, after the ingestion queue, parsing and dedupe
+        "dequeued",  # NostrClient, taken from the MessagePool queue
+        "buffered",  # added to the NostrRouter subscription buffer
+        "sent",  # sent to the client websocket
+    )
+
+    def __init__(self, sample_rate: float = 0.0) -> None:
+        self.sample_rate = sample_rate
+        self.stage_seconds = metrics.histogram(
+            "nostrclient_event_stage_seconds",
+            "Time an event spent reaching a pipeline stage from the previous one",
+            ("stage",),
+            buckets=STAGE_BUCKETS,
+        )
+        self.total_seconds = metrics.histogram(
+            "nostrclient_event_delivery_seconds",
+            "Time from receiving an event from a relay to sending it to a client",
+            buckets=STAGE_BUCKETS,
+        )
+
+    def start(self) -> Optional[dict[str, float]]:
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return {"received": time.monotonic()}
+
+    @staticmethod
+    def mark(trace: Optional[dict[str, float]], stage: str):
+        if trace is not None:
+            trace[stage] = time.monotonic()
+
+    def finish(self, trace: Optional[dict[str, float]], stage: str = "sent"):
+        if trace is None:
+            return
+        self.mark(trace, stage)
+        previous = None
+        for s in self.STAGES:
+            if s not in trace:
+                continue
+            if previous is not None:
+                self.stage_seconds.observe(trace[s] - trace[previous], stage=s)
+            previous = s
+        self.total_seconds.observe(trace[stage] - trace["received"])
+
+    def reset(self):
+        self.stage_seconds.clear()
+        self.total_seconds.clear()
+
+    def summary(self) -> list[dict]:
+        stages = []
+        for stage in self.STAGES[1:]:
+            stages.append(self._summarize(self.stage_seconds, stage, stage=stage))
+        stages.append(self._summarize(self.total_seconds, "total"))
+        return stages
+
+    @staticmethod
+    def _summarize(histogram, name: str, **labels) -> dict:
+        count = histogram.count(**labels)
+
+        def to_ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 3) if value is not None else None
+
+        return {
+            "stage": name,
+            "count": count,
+            "mean_ms": to_ms(histogram.sum(**labels) / count) if count else None,
+            "p50_ms": to_ms(histogram.quantile(0.5, **labels)),
+            "p90_ms": to_ms(histogram.quantile(0.9, **labels)),
+            "p99_ms": to_ms(histogram.quantile(0.99, **labels)),
+        }
+
+
+tracer = EventTracer()
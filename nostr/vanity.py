@@ -0,0 +1,159 @@
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Optional
+
+import secp256k1
+
+from . import nip19
+from .bech32 import CHARSET
+
+# each worker reports back after this many attempts, it bounds the cancel latency
+BATCH_SIZE = 5000
+
+
+def _validate(pattern: Optional[str], name: str) -> str:
+    if pattern is None:
+        return ""
+    invalid = [c for c in pattern if c not in CHARSET]
+    if invalid:
+        raise ValueError(f"Invalid {name} characters (not bech32): {''.join(invalid)}")
+    return pattern
+
+
+def _mine_batch(
+    prefix_value: int, prefix_bits: int, suffix: str, attempts: int
+) -> tuple[int, Optional[bytes]]:
+    """
+    The npub data part starts with the public key in 5 bit groups, so a prefix
+    can be checked on the leading bits of the raw key without bech32 encoding.
+    The suffix covers the checksum, it needs the full encoding.
+    """
+    prefix_bytes = -(-prefix_bits // 8)
+    shift = prefix_bytes * 8 - prefix_bits
+    for i in range(attempts):
+        secret = secrets.token_bytes(32)
+        sk = secp256k1.PrivateKey(secret)
+        assert sk.pubkey
+        public_key = sk.pubkey.serialize()[1:]
+        if (
+            prefix_bits
+            and int.from_bytes(public_key[:prefix_bytes], "big") >> shift
+            != prefix_value
+        ):
+            continue
+        if suffix:
+            npub = nip19.encode("npub", public_key)
+            if not npub.endswith(suffix):
+                continue
+        return i + 1, secret
+    return attempts, None
+
+
+class VanityMiner:
+    """Searches for a private key whose npub has a given prefix and/or suffix."""
+
+    def __init__(
+        self,
+        prefix: Optional[str] = None,
+        suffix: Optional[str] = None,
+        workers: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        if not prefix and not suffix:
+            raise ValueError("Expected at least one of 'prefix' or 'suffix' arguments")
+        self.prefix = _validate(prefix, "prefix")
+        self.suffix = _validate(suffix, "suffix")
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+
+        self.state = "created"  # running, found, cancelled, expired, failed
+        self.attempts = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[bytes] = None
+        self._cancel = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def expected_attempts(self) -> int:
+        return 32 ** (len(self.prefix) + len(self.suffix))
+
+    @property
+    def elapsed(self) -> float:
+        if not self.started_at:
+            return 0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def attempts_per_second(self) -> float:
+        return self.attempts / self.elapsed if self.elapsed else 0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Estimated seconds left, based on the expected number of attempts"""
+        if self.state != "running" or not self.attempts_per_second:
+            return None
+        remaining = max(self.expected_attempts - self.attempts, 0)
+        return remaining / self.attempts_per_second
+
+    @property
+    def running(self) -> bool:
+        return self.state == "running"
+
+    def start(self):
+        self.state = "running"
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(
+            target=self._run, name="nostr-vanity-miner", daemon=True
+        )
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        if self._thread:
+            self._thread.join(timeout)
+        return self.result
+
+    def _run(self):
+        prefix_value = 0
+        for c in self.prefix:
+            prefix_value = (prefix_value << 5) | CHARSET.index(c)
+        args = (prefix_value, len(self.prefix) * 5, self.suffix, BATCH_SIZE)
+
+        # do not fork the (multi threaded) server process
+        context = multiprocessing.get_context("spawn")
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        try:
+            futures: set[Future] = {
+                executor.submit(_mine_batch, *args) for _ in range(self.workers)
+            }
+            while futures:
+                done, futures = wait(futures, timeout=1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    attempts, secret = future.result()
+                    self.attempts += attempts
+                    if secret and not self.result:
+                        self.result = secret
+                if self.result:
+                    self.state = "found"
+                elif self._cancel.is_set():
+                    self.state = "cancelled"
+                elif self.timeout and self.elapsed > self.timeout:
+                    self.state = "expired"
+                if self.state != "running":
+                    break
+                futures.update(
+                    executor.submit(_mine_batch, *args) for _ in range(len(done))
+                )
+        except Exception:
+            self.state = "failed"
+            raise
+        finally:
+            self.finished_at = time.monotonic()
+            executor.shutdown(wait=False, cancel_futures=True)
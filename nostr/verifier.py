@@ -0,0 +1,134 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Optional
+
+import secp256k1
+
+from .event import Event
+from .message_pool import EventMessage
+from .metrics import metrics
+
+verified_events = metrics.counter(
+    "nostrclient_verified_events_total",
+    "Relay events checked by the verifier, by result",
+    ("relay", "result"),
+)
+verify_batch_seconds = metrics.histogram(
+    "nostrclient_verify_batch_seconds",
+    "Time spent verifying a batch of relay events",
+)
+
+
+def check_id(event: dict) -> bool:
+    event_id = Event.compute_id(
+        event["pubkey"],
+        event["created_at"],
+        event["kind"],
+        event["tags"],
+        event["content"],
+    )
+    return event_id == event["id"]
+
+
+def check_signature(event: dict) -> bool:
+    pub_key = secp256k1.PublicKey(bytes.fromhex("02" + event["pubkey"]), True)
+    return pub_key.schnorr_verify(
+        bytes.fromhex(event["id"]), bytes.fromhex(event["sig"]), None, raw=True
+    )
+
+
+class EventVerifier:
+    """
+    Checks the id and Schnorr signature of relay events in a worker pool.
+    Valid events are cached, so the copies of the same event sent by other relays
+    (or for other subscriptions) skip the signature check.
+    """
+
+    def __init__(
+        self, max_workers: Optional[int] = None, cache_size: int = 100_000
+    ) -> None:
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cache_size = cache_size
+        self.num_verified = 0
+        self.num_cache_hits = 0
+        self.num_rejected: dict[str, int] = {}
+        # event id -> signature of the events that passed verification
+        self._verified_ids: OrderedDict[str, str] = OrderedDict()
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="nostr-verifier"
+        )
+
+    async def verify(self, event_messages: list[EventMessage]) -> list[EventMessage]:
+        """Returns the valid events, in the order they were received."""
+        if not event_messages:
+            return []
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        chunk_size = -(-len(event_messages) // self.max_workers)
+        chunks = [
+            event_messages[i : i + chunk_size]
+            for i in range(0, len(event_messages), chunk_size)
+        ]
+        results = await asyncio.gather(
+            *[
+                loop.run_in_executor(self._executor, self._verify_chunk, c)
+                for c in chunks
+            ]
+        )
+
+        accepted = []
+        for chunk, reasons in zip(chunks, results):
+            for event_message, reason in zip(chunk, reasons):
+                self._count(event_message, reason)
+                if not reason:
+                    accepted.append(event_message)
+
+        verify_batch_seconds.observe(time.perf_counter() - start)
+        return accepted
+
+    def check_event(self, event: dict) -> Optional[str]:
+        """Returns the reason the event is rejected or `None` if it is valid"""
+        try:
+            # the id is always checked, it binds the content to the cached signature
+            if not check_id(event):
+                return "invalid_id"
+            if self._is_cached(event["id"], event["sig"]):
+                return None
+            if not check_signature(event):
+                return "invalid_sig"
+            self._cache(event["id"], event["sig"])
+        except Exception:
+            return "malformed"
+        return None
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _verify_chunk(self, event_messages: list[EventMessage]) -> list[Optional[str]]:
+        return [self.check_event(m.data) for m in event_messages]
+
+    def _count(self, event_message: EventMessage, reason: Optional[str]):
+        self.num_verified += 1
+        verified_events.inc(relay=event_message.url, result=reason or "valid")
+        if reason:
+            url = event_message.url
+            self.num_rejected[url] = self.num_rejected.get(url, 0) + 1
+
+    def _is_cached(self, event_id: str, signature: str) -> bool:
+        with self._lock:
+            if self._verified_ids.get(event_id) != signature:
+                return False
+            self._verified_ids.move_to_end(event_id)
+            self.num_cache_hits += 1
+            return True
+
+    def _cache(self, event_id: str, signature: str):
+        with self._lock:
+            self._verified_ids[event_id] = signature
+            if len(self._verified_ids) > self.cache_size:
+                self._verified_ids.popitem(last=False)
@@ -1,45 +1,209 @@
 import asyncio
 import json
+import time
+from pathlib import Path
 from typing import ClassVar
 
 from fastapi import WebSocket, WebSocketDisconnect
 from lnbits.helpers import urlsafe_short_hash
 from loguru import logger
 
+from .helpers import TokenBucket
+from .models import Config
 from .nostr.client.client import NostrClient
+from .nostr.compression import DeflateOptions
+from .nostr.expiration import DeadEvents, get_address
+from .nostr.ipc import IpcLeader, RelayManagerProxy
 
 # from . import nostr_client
-from .nostr.message_pool import EndOfStoredEventsMessage, EventMessage, NoticeMessage
+from .nostr.message_pool import (
+    ClosedMessage,
+    EndOfStoredEventsMessage,
+    EventMessage,
+    NoticeMessage,
+    dedupe_total,
+    suppressed_events,
+)
+from .nostr.metrics import metrics
+from .nostr.relay_manager import RelayManager
+from .nostr.replaceable import (
+    ReplaceableEvents,
+    is_parameterized_replaceable,
+    is_replaceable,
+)
+from .nostr.tracing import tracer
+from .nostr.vanity import VanityMiner
 
 nostr_client: NostrClient = NostrClient()
 all_routers: list["NostrRouter"] = []
+vanity_miners: dict[str, VanityMiner] = {}
+replaceable_events: ReplaceableEvents = ReplaceableEvents()
+dead_events: DeadEvents = DeadEvents()
+ipc_leader: IpcLeader = IpcLeader()
+
+client_send_seconds = metrics.histogram(
+    "nostrclient_client_send_seconds",
+    "Time spent sending a message to a client websocket",
+)
+pool_queue_depth = metrics.gauge(
+    "nostrclient_message_pool_queue_depth",
+    "Messages waiting in the message pool queues",
+    ("queue",),
+)
+relay_queue_depth = metrics.gauge(
+    "nostrclient_relay_send_queue_depth",
+    "Messages waiting to be sent to a relay",
+    ("relay",),
+)
+relay_connected = metrics.gauge(
+    "nostrclient_relay_connected", "Relay connection state", ("relay",)
+)
+router_buffered_events = metrics.gauge(
+    "nostrclient_router_buffered_events",
+    "Events waiting to be sent to a client",
+    ("router",),
+)
+num_routers = metrics.gauge("nostrclient_routers", "Connected client websockets")
+active_subscriptions = metrics.gauge(
+    "nostrclient_active_subscriptions", "Subscriptions forwarded to the relays"
+)
+dedupe_hit_ratio = metrics.gauge(
+    "nostrclient_dedupe_hit_ratio", "Share of relay events dropped as duplicates"
+)
+
+
+def _rate_limits(config: Config, factor: float = 1) -> dict[str, TokenBucket]:
+    per_minute = {
+        "REQ": config.public_req_per_minute,
+        "EVENT": config.public_event_per_minute,
+        "CLOSE": config.public_close_per_minute,
+    }
+    # bursts of up to 10 seconds worth of messages
+    return {
+        message_type: TokenBucket(factor * n / 60, max(1, factor * n / 6))
+        for message_type, n in per_minute.items()
+        if n
+    }
 
 
 class NostrRouter:
+    # rate limits shared by the public clients with the same IP address
+    ip_rate_limits: ClassVar[dict[str, dict[str, TokenBucket]]] = {}
+    ip_connections: ClassVar[dict[str, int]] = {}
     received_subscription_events: ClassVar[dict[str, list[EventMessage]]] = {}
+    # event id (and address of replaceable events) -> the buffered events,
+    # so deletions and duplicates are found without scanning the buffers
+    buffered_events: ClassVar[dict[str, list[EventMessage]]] = {}
     received_subscription_notices: ClassVar[list[NoticeMessage]] = []
     received_subscription_eosenotices: ClassVar[dict[str, EndOfStoredEventsMessage]] = (
         {}
     )
+    received_subscription_closed: ClassVar[dict[str, ClosedMessage]] = {}
 
-    def __init__(self, websocket: WebSocket):
+    def __init__(
+        self,
+        websocket: WebSocket,
+        limits: Config | None = None,
+        client_ip: str | None = None,
+    ):
+        self.id: str = urlsafe_short_hash()
         self.connected: bool = True
         self.websocket: WebSocket = websocket
         self.tasks: list[asyncio.Task] = []
+        # rewritten (upstream) id -> client id and the reverse index
         self.original_subscription_ids: dict[str, str] = {}
+        self.rewritten_subscription_ids: dict[str, str] = {}
+        # only set for public clients
+        self.limits: Config | None = None
+        self.client_ip: str | None = client_ip
+        self.rate_limits: dict[str, TokenBucket] = {}
+        if limits:
+            self.set_limits(limits)
+        if limits and client_ip:
+            connections = NostrRouter.ip_connections.get(client_ip, 0)
+            NostrRouter.ip_connections[client_ip] = connections + 1
 
     @property
     def subscriptions(self) -> list[str]:
         return list(self.original_subscription_ids.keys())
 
+    @property
+    def num_buffered_events(self) -> int:
+        buffers = NostrRouter.received_subscription_events
+        return sum(len(buffers.get(s, [])) for s in self.subscriptions)
+
+    @staticmethod
+    def _buffer_keys(event_message: EventMessage) -> list[str]:
+        kind = event_message.data.get("kind", 0)
+        if is_replaceable(kind) or is_parameterized_replaceable(kind):
+            return [event_message.event_id, get_address(event_message.data)]
+        return [event_message.event_id]
+
+    @classmethod
+    def buffer_event(cls, event_message: EventMessage) -> bool:
+        """Returns `False` if the subscription has the event buffered already"""
+        sub_id = event_message.subscription_id
+        copies = cls.buffered_events.get(event_message.event_id, [])
+        if any(m.subscription_id == sub_id for m in copies):
+            return False
+        cls.received_subscription_events.setdefault(sub_id, []).append(event_message)
+        keys = cls._buffer_keys(event_message)
+        for key in keys:
+            cls.buffered_events.setdefault(key, []).append(event_message)
+        if len(keys) > 1:
+            # the versions this event replaced, see `ReplaceableEvents`
+            cls.evict_suppressed_events(cls.buffered_events[keys[1]])
+        return True
+
+    @classmethod
+    def _unbuffer_event(cls, event_message: EventMessage):
+        for key in cls._buffer_keys(event_message):
+            event_messages = cls.buffered_events.get(key)
+            if event_messages is None:
+                continue
+            try:
+                event_messages.remove(event_message)
+            except ValueError:
+                pass
+            if not event_messages:
+                cls.buffered_events.pop(key, None)
+
+    @classmethod
+    def suppress_deleted_events(cls, targets: list[str]):
+        """`targets` are the ids and addresses deleted by a NIP-09 event"""
+        event_messages = [m for t in targets for m in cls.buffered_events.get(t, [])]
+        dead_events.suppress_deleted(event_messages)
+        cls.evict_suppressed_events(event_messages)
+
+    @classmethod
+    def evict_suppressed_events(cls, event_messages: list[EventMessage]) -> int:
+        """Drop the buffered events that must not be delivered anymore."""
+        num_evicted = 0
+        for event_message in [m for m in event_messages if m.suppressed]:
+            buffer = cls.received_subscription_events.get(
+                event_message.subscription_id, []
+            )
+            try:
+                buffer.remove(event_message)
+            except ValueError:
+                continue  # already taken by the router
+            cls._unbuffer_event(event_message)
+            suppressed_events.inc(reason=event_message.suppressed)
+            num_evicted += 1
+        return num_evicted
+
     def start(self):
         self.connected = True
         self.tasks.append(asyncio.create_task(self._client_to_nostr()))
         self.tasks.append(asyncio.create_task(self._nostr_to_client()))
 
     async def stop(self):
-        nostr_client.relay_manager.close_subscriptions(self.subscriptions)
+        for s in self.subscriptions:
+            self._close_upstream_subscription(s)
+        self.original_subscription_ids.clear()
+        self.rewritten_subscription_ids.clear()
         self.connected = False
+        self._release_ip()
 
         for t in self.tasks:
             try:
@@ -86,6 +250,8 @@ class NostrRouter:
                 await self._handle_received_subscription_events(s)
             if s in NostrRouter.received_subscription_eosenotices:
                 await self._handle_received_subscription_eosenotices(s)
+            if s in NostrRouter.received_subscription_closed:
+                await self._handle_received_subscription_closed(s)
 
     async def _handle_received_subscription_eosenotices(self, s):
         try:
@@ -95,7 +261,19 @@ class NostrRouter:
             event_to_forward = ["EOSE", s_original]
             del NostrRouter.received_subscription_eosenotices[s]
 
-            await self.websocket.send_text(json.dumps(event_to_forward))
+            await self._send_text(json.dumps(event_to_forward))
+        except Exception as e:
+            logger.debug(e)
+
+    async def _handle_received_subscription_closed(self, s):
+        """All relays closed the subscription, the client will not get more events"""
+        try:
+            closed = NostrRouter.received_subscription_closed.pop(s)
+            s_original = self.original_subscription_ids.get(s)
+            if not s_original:
+                return
+            self._handle_client_close(s_original)
+            await self._send_text(json.dumps(["CLOSED", s_original, closed.message]))
         except Exception as e:
             logger.debug(e)
 
@@ -106,16 +284,26 @@ class NostrRouter:
 
             while len(NostrRouter.received_subscription_events[s]):
                 event_message = NostrRouter.received_subscription_events[s].pop(0)
+                NostrRouter._unbuffer_event(event_message)
+                if event_message.suppressed:
+                    suppressed_events.inc(reason=event_message.suppressed)
+                    continue
                 event_json = event_message.event
 
                 # this reconstructs the original response from the relay
                 # reconstruct original subscription id
                 s_original = self.original_subscription_ids[s]
                 event_to_forward = f"""["EVENT", "{s_original}", {event_json}]"""
-                await self.websocket.send_text(event_to_forward)
+                await self._send_text(event_to_forward)
+                tracer.finish(event_message.trace)
         except Exception as e:
             logger.debug(e)  # there are 2900 errors here
 
+    async def _send_text(self, data: str):
+        start = time.perf_counter()
+        await self.websocket.send_text(data)
+        client_send_seconds.observe(time.perf_counter() - start)
+
     def _handle_notices(self):
         while len(NostrRouter.received_subscription_notices):
             my_event = NostrRouter.received_subscription_notices.pop(0)
@@ -124,10 +312,86 @@ class NostrRouter:
             #  we don't know who should receive it
             nostr_client.relay_manager.handle_notice(my_event)
 
+    def _release_ip(self):
+        client_ip, self.client_ip = self.client_ip, None
+        if client_ip not in NostrRouter.ip_connections:
+            return
+        NostrRouter.ip_connections[client_ip] -= 1
+        if NostrRouter.ip_connections[client_ip] <= 0:
+            NostrRouter.ip_connections.pop(client_ip)
+            NostrRouter.ip_rate_limits.pop(client_ip, None)
+
+    def set_limits(self, limits: Config):
+        """
+        Limits of a public client, the rate limits start with a full burst.
+        The limits shared by the clients of an IP address are created by the
+        first of them, `apply_config` clears them to apply a new config.
+        """
+        self.limits = limits
+        self.rate_limits = _rate_limits(limits)
+        factor = limits.public_ip_rate_factor
+        if (
+            self.client_ip
+            and factor
+            and self.client_ip not in NostrRouter.ip_rate_limits
+        ):
+            NostrRouter.ip_rate_limits[self.client_ip] = _rate_limits(limits, factor)
+
+    def _is_rate_limited(self, message_type: str) -> bool:
+        buckets = [
+            self.rate_limits.get(message_type),
+            NostrRouter.ip_rate_limits.get(self.client_ip or "", {}).get(message_type),
+        ]
+        return not all(b.consume() for b in buckets if b)
+
+    def _check_limits(self, json_data: list) -> str | None:
+        """Returns the reason a public client message is rejected, if any."""
+        if not self.limits:
+            return None
+        if self._is_rate_limited(json_data[0]):
+            return "rate-limited: slow down"
+        if json_data[0] != "REQ":
+            return None
+
+        filters = json_data[2:]
+        max_filters = self.limits.public_max_filters
+        if max_filters and len(filters) > max_filters:
+            return f"invalid: at most {max_filters} filters are allowed"
+        max_subscriptions = self.limits.public_max_subscriptions
+        if (
+            max_subscriptions
+            and json_data[1] not in self.rewritten_subscription_ids
+            and len(self.subscriptions) >= max_subscriptions
+        ):
+            return f"restricted: at most {max_subscriptions} subscriptions are allowed"
+        max_limit = self.limits.public_max_limit
+        for f in filters:
+            if not (max_limit and isinstance(f, dict)):
+                continue
+            # a filter without a limit would get all the stored events
+            limit = f.get("limit")
+            if not isinstance(limit, int) or limit > max_limit:
+                f["limit"] = max_limit
+        return None
+
+    async def _reject(self, json_data: list, reason: str):
+        if json_data[0] == "REQ":
+            message = ["CLOSED", json_data[1], reason]
+        elif json_data[0] == "EVENT" and isinstance(json_data[1], dict):
+            message = ["OK", json_data[1].get("id"), False, reason]
+        else:
+            message = ["NOTICE", reason]
+        await self._send_text(json.dumps(message))
+
     async def _handle_client_to_nostr(self, json_str):
         json_data = json.loads(json_str)
         assert len(json_data), "Bad JSON array"
 
+        reason = self._check_limits(json_data)
+        if reason:
+            await self._reject(json_data, reason)
+            return
+
         if json_data[0] == "REQ":
             self._handle_client_req(json_data)
             return
@@ -143,29 +407,142 @@ class NostrRouter:
     def _handle_client_req(self, json_data):
         subscription_id = json_data[1]
         logger.info(f"New subscription: '{subscription_id}'")
+        # a REQ with the id of an open subscription replaces it (NIP-01)
+        self._handle_client_close(subscription_id)
+
         subscription_id_rewritten = urlsafe_short_hash()
         self.original_subscription_ids[subscription_id_rewritten] = subscription_id
+        self.rewritten_subscription_ids[subscription_id] = subscription_id_rewritten
         filters = json_data[2:]
 
         nostr_client.relay_manager.add_subscription(subscription_id_rewritten, filters)
 
     def _handle_client_close(self, subscription_id):
-        subscription_id_rewritten = next(
-            (
-                k
-                for k, v in self.original_subscription_ids.items()
-                if v == subscription_id
-            ),
-            None,
+        subscription_id_rewritten = self.rewritten_subscription_ids.pop(
+            subscription_id, None
         )
-        if subscription_id_rewritten:
-            self.original_subscription_ids.pop(subscription_id_rewritten)
-            nostr_client.relay_manager.close_subscription(subscription_id_rewritten)
-            logger.info(
-                f"""
-            Unsubscribe from '{subscription_id_rewritten}'.
-            Original id: '{subscription_id}.'
-            """
-            )
-        else:
-            logger.info(f"Failed to unsubscribe from '{subscription_id}.'")
+        if not subscription_id_rewritten:
+            return
+        self.original_subscription_ids.pop(subscription_id_rewritten, None)
+        self._close_upstream_subscription(subscription_id_rewritten)
+        logger.info(
+            f"Unsubscribe from '{subscription_id_rewritten}'."
+            f" Original id: '{subscription_id}'."
+        )
+
+    def _close_upstream_subscription(self, subscription_id_rewritten: str):
+        nostr_client.relay_manager.close_subscription(subscription_id_rewritten)
+        replaceable_events.forget(subscription_id_rewritten)
+        for event_message in NostrRouter.received_subscription_events.pop(
+            subscription_id_rewritten, []
+        ):
+            NostrRouter._unbuffer_event(event_message)
+        NostrRouter.received_subscription_eosenotices.pop(
+            subscription_id_rewritten, None
+        )
+        NostrRouter.received_subscription_closed.pop(subscription_id_rewritten, None)
+
+
+def apply_config(config: Config):
+    """Push the runtime settings from the extension config to the nostr client."""
+    tracer.sample_rate = config.trace_sample_rate
+    # events from the leader process were verified there already
+    is_follower = isinstance(nostr_client.relay_manager, RelayManagerProxy)
+    nostr_client.verify_events(config.verify_events and not is_follower)
+    replaceable_events.enabled = config.collapse_replaceable
+    if not replaceable_events.enabled:
+        replaceable_events.clear()
+    dead_events.enabled = config.drop_deleted_and_expired
+    frame_validator = nostr_client.relay_manager.frame_validator
+    frame_validator.max_frame_size = config.max_frame_size
+    frame_validator.max_junk_ratio = config.max_junk_ratio
+    nostr_client.relay_manager.set_max_send_rate(config.relay_max_send_rate)
+    nostr_client.relay_manager.set_compression(
+        DeflateOptions(
+            enabled=config.relay_compression,
+            context_takeover=config.relay_compression_context_takeover,
+            max_window_bits=config.relay_compression_max_window_bits,
+        )
+    )
+    nostr_client.relay_manager.set_negentropy_sync(config.negentropy_sync)
+    nostr_client.relay_manager.set_heartbeat(
+        config.relay_idle_ping_interval,
+        config.relay_max_pong_timeout,
+        config.relay_stall_timeout,
+    )
+    nostr_client.relay_manager.set_ingestion_workers(
+        config.ingestion_workers, config.ingestion_queue_size
+    )
+    if not dead_events.enabled:
+        dead_events.clear()
+    NostrRouter.ip_rate_limits.clear()
+    for router in all_routers:
+        if router.limits:
+            router.set_limits(config)
+
+
+def share_relay_connections(folder: Path) -> bool:
+    """
+    Elect the worker process that owns the relay connections, the other workers
+    attach to it over a unix socket. Returns `True` in the owner.
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    socket_path = str(Path(folder, "relays.sock"))
+    if ipc_leader.elect(str(Path(folder, "leader.lock"))):
+        ipc_leader.start(socket_path, nostr_client.relay_manager)
+        return True
+
+    if not isinstance(nostr_client.relay_manager, RelayManagerProxy):
+        proxy = RelayManagerProxy(socket_path)
+        proxy.start()
+        nostr_client.relay_manager = proxy
+    return False
+
+
+def take_over_relay_connections(folder: Path) -> bool:
+    """Promote this follower if the leader process exited. Returns `True` if so."""
+    proxy = nostr_client.relay_manager
+    if not isinstance(proxy, RelayManagerProxy) or proxy.connected:
+        return False
+    if not ipc_leader.elect(str(Path(folder, "leader.lock"))):
+        return False
+
+    logger.info("Taking over the relay connections of the leader process.")
+    proxy.close()
+    relay_manager = RelayManager()
+    for subscription_id, filters in proxy.subscriptions.items():
+        relay_manager.add_subscription(subscription_id, filters)
+    nostr_client.relay_manager = relay_manager
+    ipc_leader.start(str(Path(folder, "relays.sock")), relay_manager)
+    return True
+
+
+def collect_metrics():
+    """Refresh the point-in-time gauges (queue depths, buffers, subscriptions)."""
+    relay_manager = nostr_client.relay_manager
+    message_pool = relay_manager.message_pool
+
+    pool_queue_depth.set(message_pool.events.qsize(), queue="events")
+    pool_queue_depth.set(message_pool.notices.qsize(), queue="notices")
+    pool_queue_depth.set(message_pool.eose_notices.qsize(), queue="eose")
+    pool_queue_depth.set(relay_manager.ingestion.qsize(), queue="ingestion")
+
+    relay_queue_depth.clear()
+    relay_connected.clear()
+    for url, relay in list(relay_manager.relays.items()):
+        relay_queue_depth.set(relay.queue.qsize(), relay=url)
+        relay_connected.set(1 if relay.connected else 0, relay=url)
+
+    router_buffered_events.clear()
+    for router in list(all_routers):
+        router_buffered_events.set(router.num_buffered_events, router=router.id)
+
+    num_routers.set(len(all_routers))
+    active_subscriptions.set(relay_manager.num_subscriptions)
+
+    dedupe_hits = dedupe_total.get(result="hit")
+    checked = dedupe_hits + dedupe_total.get(result="miss")
+    dedupe_hit_ratio.set(dedupe_hits / checked if checked else 0)
+
+
+metrics.add_collector(collect_metrics)
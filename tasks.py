@@ -1,14 +1,52 @@
 import asyncio
 import threading
+from pathlib import Path
 
+from lnbits.settings import settings
 from loguru import logger
 
-from .crud import get_relays
-from .nostr.message_pool import EndOfStoredEventsMessage, EventMessage, NoticeMessage
-from .router import NostrRouter, nostr_client
+from .crud import get_config, get_relays
+from .nostr.message_pool import (
+    ClosedMessage,
+    EndOfStoredEventsMessage,
+    EventMessage,
+    NoticeMessage,
+    suppressed_events,
+)
+from .nostr.tracing import tracer
+from .router import (
+    NostrRouter,
+    apply_config,
+    dead_events,
+    ipc_leader,
+    nostr_client,
+    replaceable_events,
+    share_relay_connections,
+    take_over_relay_connections,
+)
+
+
+def ipc_folder() -> Path:
+    return Path(settings.lnbits_data_folder, "nostrclient")
 
 
 async def init_relays():
+    config = await get_config(owner_id="admin")
+    if config:
+        apply_config(config)
+    if (
+        config
+        and config.share_relay_connections
+        and not share_relay_connections(ipc_folder())
+    ):
+        logger.info("Using the relay connections of another worker process.")
+        apply_config(config)
+        return
+
+    await connect_relays()
+
+
+async def connect_relays():
     # get relays from db
     relays = await get_relays()
     # set relays and connect to them
@@ -22,45 +60,76 @@ async def check_relays():
     while True:
         try:
             await asyncio.sleep(20)
+            if take_over_relay_connections(ipc_folder()):
+                await init_relays()
             nostr_client.relay_manager.check_and_restart_relays()
         except Exception as e:
             logger.warning(f"Cannot restart relays: '{e!s}'.")
 
 
+async def expire_events():
+    """Evict expired and deleted events from the router buffers"""
+    while True:
+        try:
+            await asyncio.sleep(1)
+            if dead_events.enabled:
+                NostrRouter.evict_suppressed_events(dead_events.advance())
+        except Exception as e:
+            logger.warning(f"Cannot evict expired events: '{e!s}'.")
+
+
 async def subscribe_events():
-    while not [r.connected for r in nostr_client.relay_manager.relays.values()]:
+    # followers use the relays of the leader process, see `RelayManagerProxy`
+    while not nostr_client.relay_manager.has_relays:
         await asyncio.sleep(2)
 
     def callback_events(event_message: EventMessage):
         sub_id = event_message.subscription_id
-        if sub_id not in NostrRouter.received_subscription_events:
-            NostrRouter.received_subscription_events[sub_id] = [event_message]
+        # subscriptions of the other worker processes
+        if ipc_leader.forward_event(sub_id, event_message.event):
             return
-
-        # do not add duplicate events (by event id)
-        ids = [e.event_id for e in NostrRouter.received_subscription_events[sub_id]]
-        if event_message.event_id in ids:
+        tracer.mark(event_message.trace, "buffered")
+        if dead_events.enabled:
+            reason = dead_events.check(event_message)
+            if reason:
+                suppressed_events.inc(reason=reason)
+                return
+            targets = dead_events.add(event_message)
+            if targets:
+                NostrRouter.suppress_deleted_events(targets)
+        # keep only the newest version of replaceable events
+        if replaceable_events.enabled and not replaceable_events.add(event_message):
             return
-
-        NostrRouter.received_subscription_events[sub_id].append(event_message)
+        # duplicate events (by event id) are dropped
+        NostrRouter.buffer_event(event_message)
 
     def callback_notices(notice_message: NoticeMessage):
         if notice_message not in NostrRouter.received_subscription_notices:
             NostrRouter.received_subscription_notices.append(notice_message)
 
     def callback_eose_notices(event_message: EndOfStoredEventsMessage):
+        if ipc_leader.forward_eose(event_message):
+            return
         sub_id = event_message.subscription_id
         if sub_id in NostrRouter.received_subscription_eosenotices:
             return
 
         NostrRouter.received_subscription_eosenotices[sub_id] = event_message
 
+    def callback_closed(closed_message: ClosedMessage):
+        if ipc_leader.forward_closed(closed_message):
+            return
+        NostrRouter.received_subscription_closed[closed_message.subscription_id] = (
+            closed_message
+        )
+
     def wrap_async_subscribe():
         asyncio.run(
             nostr_client.subscribe(
                 callback_events,
                 callback_notices,
                 callback_eose_notices,
+                callback_closed,
             )
         )
 
@@ -0,0 +1,224 @@
+"""
+Offline NIP-01 relay for tests and benchmarks.
+
+The relay serves a configurable history on REQ, sends EOSE after an optional
+delay, generates live events at a fixed rate, answers EVENT publishes with OK,
+can answer NIP-77 negentropy syncs and can drop connections after a number of
+messages.
+"""
+
+import asyncio
+import json
+import secrets
+import time
+from typing import Any
+
+from websockets.asyncio.server import Server, ServerConnection, serve
+from websockets.exceptions import ConnectionClosed
+
+from ..nostr.event import Event
+from ..nostr.negentropy import Negentropy, NegentropyStorage
+
+
+def make_event(
+    content: str = "",
+    kind: int = 1,
+    tags: list[list[str]] | None = None,
+    public_key: str | None = None,
+    created_at: int | None = None,
+) -> dict:
+    """Build an event with a valid id. The signature is random (not verifiable)."""
+    tags = tags or []
+    public_key = public_key or secrets.token_hex(32)
+    created_at = created_at or int(time.time())
+    return {
+        "id": Event.compute_id(public_key, created_at, kind, tags, content),
+        "pubkey": public_key,
+        "created_at": created_at,
+        "kind": kind,
+        "tags": tags,
+        "content": content,
+        "sig": secrets.token_hex(64),
+    }
+
+
+def stamp_event(content: str = "", kind: int = 1) -> dict:
+    """Event tagged with its creation time, used to measure delivery latency."""
+    return make_event(content, kind, tags=[["bench", f"{time.time():.6f}"]])
+
+
+def event_matches(event: dict, f: dict) -> bool:
+    if "ids" in f and event["id"] not in f["ids"]:
+        return False
+    if "authors" in f and event["pubkey"] not in f["authors"]:
+        return False
+    if "kinds" in f and event["kind"] not in f["kinds"]:
+        return False
+    if "since" in f and event["created_at"] < f["since"]:
+        return False
+    if "until" in f and event["created_at"] > f["until"]:
+        return False
+    for key, values in f.items():
+        if not key.startswith("#"):
+            continue
+        tag_values = {t[1] for t in event["tags"] if len(t) > 1 and t[0] == key[1:]}
+        if not tag_values.intersection(values):
+            return False
+    return True
+
+
+class FakeRelay:
+    def __init__(
+        self,
+        event_rate: float = 0,
+        history_size: int = 0,
+        eose_delay: float = 0,
+        accept_events: bool = True,
+        disconnect_after: int | None = None,
+        history: list[dict] | None = None,
+        host: str = "127.0.0.1",
+        negentropy: bool = False,
+    ) -> None:
+        self.event_rate = event_rate
+        self.eose_delay = eose_delay
+        self.accept_events = accept_events
+        self.disconnect_after = disconnect_after
+        self.host = host
+        self.negentropy = negentropy
+
+        self.events: list[dict] = list(history or [])
+        self.events.extend(make_event(f"history {i}") for i in range(history_size))
+        self.received: list[Any] = []
+        self.num_sent: int = 0
+
+        self._server: Server | None = None
+        self._subscriptions: dict[ServerConnection, dict[str, list[dict]]] = {}
+        self._negentropy: dict[tuple[ServerConnection, str], Negentropy] = {}
+        self._sent_per_connection: dict[ServerConnection, int] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def url(self) -> str:
+        assert self._server, "Relay not started"
+        port = next(iter(self._server.sockets)).getsockname()[1]
+        return f"ws://{self.host}:{port}"
+
+    @property
+    def num_connections(self) -> int:
+        return len(self._subscriptions)
+
+    async def start(self) -> str:
+        self._server = await serve(self._handler, self.host, 0, max_size=None)
+        if self.event_rate:
+            self._tasks.append(asyncio.create_task(self._generate_events()))
+        return self.url
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def disconnect_all(self):
+        for ws in list(self._subscriptions):
+            await ws.close()
+
+    async def broadcast(self, event: dict):
+        """Send an event to every open subscription that matches it."""
+        for ws, subscriptions in list(self._subscriptions.items()):
+            for sub_id, filters in list(subscriptions.items()):
+                if any(event_matches(event, f) for f in filters):
+                    await self._send(ws, ["EVENT", sub_id, event])
+
+    async def _handler(self, ws: ServerConnection):
+        self._subscriptions[ws] = {}
+        self._sent_per_connection[ws] = 0
+        try:
+            async for frame in ws:
+                message = json.loads(frame)
+                self.received.append(message)
+                await self._handle_message(ws, message)
+        except ConnectionClosed:
+            pass
+        finally:
+            self._subscriptions.pop(ws, None)
+            self._sent_per_connection.pop(ws, None)
+            for key in [k for k in self._negentropy if k[0] is ws]:
+                self._negentropy.pop(key)
+
+    async def _handle_message(self, ws: ServerConnection, message: list):
+        if message[0] == "REQ":
+            sub_id, filters = message[1], message[2:]
+            self._subscriptions[ws][sub_id] = filters
+            await self._send_history(ws, sub_id, filters)
+        elif message[0] == "CLOSE":
+            self._subscriptions[ws].pop(message[1], None)
+        elif message[0].startswith("NEG-"):
+            await self._handle_negentropy(ws, message)
+        elif message[0] == "EVENT":
+            event = message[1]
+            reason = "" if self.accept_events else "blocked: fake relay"
+            await self._send(ws, ["OK", event.get("id"), self.accept_events, reason])
+            if self.accept_events:
+                self.events.append(event)
+                await self.broadcast(event)
+
+    async def _handle_negentropy(self, ws: ServerConnection, message: list):
+        """NIP-77 responder, relays without it answer with a NOTICE"""
+        if not self.negentropy:
+            await self._send(ws, ["NOTICE", f"unknown message type {message[0]}"])
+            return
+        key = (ws, message[1])
+        if message[0] == "NEG-OPEN":
+            storage = NegentropyStorage()
+            for e in self.events:
+                if event_matches(e, message[2]):
+                    storage.insert(e["created_at"], e["id"])
+            storage.seal()
+            self._negentropy[key] = Negentropy(storage)
+            query = message[3]
+        elif message[0] == "NEG-MSG" and key in self._negentropy:
+            query = message[2]
+        else:
+            self._negentropy.pop(key, None)
+            return
+        output, _, _ = self._negentropy[key].reconcile(bytes.fromhex(query))
+        assert output is not None
+        await self._send(ws, ["NEG-MSG", message[1], output.hex()])
+
+    async def _send_history(self, ws: ServerConnection, sub_id: str, filters: list):
+        for f in filters:
+            matching = [e for e in self.events if event_matches(e, f)]
+            matching.sort(key=lambda e: e["created_at"], reverse=True)
+            if "limit" in f:
+                matching = matching[: f["limit"]]
+            for event in matching:
+                await self._send(ws, ["EVENT", sub_id, event])
+        if self.eose_delay:
+            await asyncio.sleep(self.eose_delay)
+        await self._send(ws, ["EOSE", sub_id])
+
+    async def _send(self, ws: ServerConnection, message: list):
+        try:
+            await ws.send(json.dumps(message))
+        except ConnectionClosed:
+            return
+        self.num_sent += 1
+        sent = self._sent_per_connection.get(ws, 0) + 1
+        self._sent_per_connection[ws] = sent
+        if self.disconnect_after and sent >= self.disconnect_after:
+            await ws.close()
+
+    async def _generate_events(self):
+        # live events are broadcast only, they are not added to the history
+        pending = 0.0
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(0.01)
+            now = time.monotonic()
+            pending += self.event_rate * (now - last)
+            last = now
+            while pending >= 1:
+                pending -= 1
+                await self.broadcast(stamp_event("live"))
@@ -0,0 +1,35 @@
+from ..nostr.event import Event
+from ..nostr.key import PrivateKey
+
+
+def test_id_is_memoized_until_invalidated():
+    event = Event(content="note", public_key="ab" * 32, created_at=1700000000)
+    event.add_pubkey_ref("cd" * 32)
+    first_id = event.id
+    assert first_id == Event.compute_id(
+        "ab" * 32, 1700000000, event.kind, [["p", "cd" * 32]], "note"
+    )
+
+    event.tags[0][1] = "ef" * 32
+    assert event.id == first_id
+    event.invalidate()
+    assert event.id == Event.compute_id(
+        "ab" * 32, 1700000000, event.kind, [["p", "ef" * 32]], "note"
+    )
+
+    event.tags = [["e", "ef" * 32]]
+    assert event.id == Event.compute_id(
+        "ab" * 32, 1700000000, event.kind, [["e", "ef" * 32]], "note"
+    )
+
+
+def test_signature_covers_tags_edited_in_place():
+    key = PrivateKey()
+    event = Event(content="note", tags=[["t", "old"]])
+    key.sign_event(event)
+    event.tags[0][1] = "new"
+    key.sign_event(event)
+    assert event.verify()
+    assert event.id == Event.compute_id(
+        key.public_key.hex(), event.created_at, event.kind, [["t", "new"]], "note"
+    )
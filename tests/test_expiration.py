@@ -0,0 +1,84 @@
+import json
+
+from ..nostr.expiration import DeadEvents, TimerWheel
+from ..nostr.message_pool import EventMessage
+from .fake_relay import make_event
+
+PUBKEY = "aa" * 32
+
+
+def _message(event: dict) -> EventMessage:
+    return EventMessage(json.dumps(event), event["id"], "sub", "", data=event)
+
+
+def test_timer_wheel():
+    wheel: TimerWheel[str] = TimerWheel(num_slots=10)
+    now = 1_000_000
+    wheel._tick = now
+    wheel.schedule(now + 2.5, "soon")
+    wheel.schedule(now + 25, "next round")
+    wheel.schedule(now - 5, "overdue")
+
+    assert wheel.advance(now) == ["overdue"]
+    assert wheel.advance(now + 2) == []
+    assert wheel.advance(now + 3) == ["soon"]
+    assert wheel.advance(now + 15) == []
+    assert wheel.size == 1
+    # skipping more than a rotation still visits every slot
+    assert wheel.advance(now + 100) == ["next round"]
+    assert wheel.size == 0
+
+
+def test_expiration():
+    dead_events = DeadEvents()
+    expired = _message(make_event(tags=[["expiration", "100"]], public_key=PUBKEY))
+    assert dead_events.check(expired, now=200) == "expired"
+
+    expiring = _message(make_event(tags=[["expiration", "300"]], public_key=PUBKEY))
+    assert dead_events.check(expiring, now=200) is None
+    dead_events._wheel._tick = 200
+    dead_events.add(expiring)
+    assert dead_events.advance(now=250) == []
+    assert dead_events.advance(now=300) == [expiring]
+    assert expiring.suppressed == "expired"
+
+
+def test_deletion():
+    dead_events = DeadEvents()
+    note = _message(make_event("note", public_key=PUBKEY, created_at=100))
+    other_author = _message(make_event("note", public_key="bb" * 32))
+    product = make_event(
+        kind=30018, tags=[["d", "p1"]], public_key=PUBKEY, created_at=100
+    )
+    deletion = make_event(
+        kind=5,
+        tags=[
+            ["e", note.event_id],
+            ["e", other_author.event_id],
+            ["a", f"30018:{PUBKEY}:p1"],
+        ],
+        public_key=PUBKEY,
+        created_at=150,
+    )
+
+    assert dead_events.add(_message(deletion))
+    assert dead_events.check(note) == "deleted"
+    assert dead_events.check(other_author) is None
+    assert dead_events.check(_message(product)) == "deleted"
+    newer_product = make_event(
+        kind=30018, tags=[["d", "p1"]], public_key=PUBKEY, created_at=200
+    )
+    assert dead_events.check(_message(newer_product)) is None
+
+    assert dead_events.suppress_deleted([note, other_author]) == 1
+    assert note.suppressed == "deleted"
+
+
+def test_deletion_by_other_author_keeps_the_deletion_of_the_author():
+    dead_events = DeadEvents()
+    note = _message(make_event("note", public_key=PUBKEY))
+    by_author = make_event(kind=5, tags=[["e", note.event_id]], public_key=PUBKEY)
+    by_other = make_event(kind=5, tags=[["e", note.event_id]], public_key="bb" * 32)
+    assert dead_events.add(_message(by_author)) == [note.event_id]
+    dead_events.add(_message(by_other))
+    assert dead_events.check(note) == "deleted"
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from ..nostr.frame_validator import (
+    FrameValidator,
+    check_event,
+    frame_subscription_id,
+    frame_type,
+)
+from ..nostr.message_pool import MessagePool
+from ..nostr.relay import Relay
+from .fake_relay import make_event
+
+
+def test_frame_type():
+    assert frame_type('["EVENT","sub",{}]') == "EVENT"
+    assert frame_type(' [ "EOSE", "sub"]') == "EOSE"
+    assert frame_type('{"EVENT": 1}') is None
+    assert frame_type("[" + " " * 100 + '"EVENT"]') is None
+
+
+def test_frame_subscription_id():
+    assert frame_subscription_id('["EVENT","sub",{}]') == "sub"
+    assert frame_subscription_id('["EOSE", "sub-1"]') == "sub-1"
+    assert frame_subscription_id('["NOTICE"]') is None
+    assert frame_subscription_id('["COUNT", 1]') is None
+    assert frame_subscription_id('["EVENT", "' + "a" * 100 + '"]') is None
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"id": "xyz"},
+        {"pubkey": "AA" * 32},
+        {"sig": "00"},
+        {"kind": "1"},
+        {"kind": 70000},
+        {"created_at": 1.5},
+        {"content": None},
+        {"tags": [["e", 1]]},
+        {"tags": "e"},
+    ],
+)
+def test_check_event(change):
+    event = make_event("hello", tags=[["t", "nostr"]])
+    assert check_event(event) is None
+    assert check_event({**event, **change}) == "invalid_event"
+
+
+def test_relay_rejects_junk():
+    relay = Relay("wss://junk.example.com", MessagePool())
+    relay.validator = FrameValidator(max_frame_size=1024, max_junk_ratio=0.5, window=4)
+    event = make_event("hello")
+
+    relay._on_message(None, json.dumps(["EVENT", "sub", event]))
+    invalid = {**make_event("hi"), "sig": 1}
+    relay._on_message(None, json.dumps(["EVENT", "sub", invalid]))
+    relay._on_message(None, json.dumps(["EVENT", "sub", make_event("x" * 2000)]))
+    relay._on_message(None, '["PING"]')
+    assert relay.message_pool.events.qsize() == 1
+    assert relay.num_rejected_frames == {
+        "invalid_event": 1,
+        "too_large": 1,
+        "unknown_type": 1,
+    }
+    # 3 of the 4 frames were junk
+    assert relay.shutdown
+    assert relay.error_counter == 1
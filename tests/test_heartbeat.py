@@ -0,0 +1,192 @@
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from ..nostr import relay_manager as relay_manager_module
+from ..nostr.compression import DeflateOptions
+from ..nostr.heartbeat import Heartbeat, RttStats
+from ..nostr.message_pool import MessagePool
+from ..nostr.relay import Relay
+from ..nostr.relay_manager import RelayManager
+from ..nostr.subscription import Subscription
+from .fake_relay import FakeRelay, make_event
+
+
+async def wait_for(condition, timeout: float = 5):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.05)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_rtt_stats():
+    stats = RttStats(window=3)
+    assert stats.last is None and stats.mean is None and stats.stdev == 0
+    for rtt in [0.5, 0.1, 0.2, 0.3]:
+        stats.add(rtt)
+    assert len(stats) == 3
+    assert stats.last == 0.3
+    assert stats.mean == pytest.approx(0.2)
+    assert stats.max == 0.3
+    assert stats.stdev == pytest.approx(0.0816, abs=1e-4)
+
+
+def test_heartbeat_pings_idle_connections():
+    heartbeat = Heartbeat(idle_interval=10)
+    heartbeat.reset(now=100)
+    assert not heartbeat.ping_due(now=105)
+    heartbeat.on_traffic(now=105)
+    assert not heartbeat.ping_due(now=114)
+    assert heartbeat.ping_due(now=115)
+
+    payload = heartbeat.ping(now=115)
+    assert not heartbeat.ping_due(now=130)
+    assert heartbeat.on_pong(b"unsolicited", now=115.1) is None
+    assert heartbeat.on_pong(payload, now=115.25) == pytest.approx(0.25)
+    assert heartbeat.rtt.last == pytest.approx(0.25)
+    # the pong counts as traffic
+    assert not heartbeat.ping_due(now=125)
+    assert heartbeat.ping_due(now=125.25)
+
+
+def test_heartbeat_pong_timeout_follows_rtt():
+    heartbeat = Heartbeat(min_pong_timeout=1, max_pong_timeout=20)
+    heartbeat.reset(now=100)
+    now = 100.0
+    for rtt in [0.05, 0.05, 0.05]:
+        # until enough round trips are measured the timeout is the maximum
+        assert heartbeat.pong_timeout == 20
+        payload = heartbeat.ping(now)
+        heartbeat.on_pong(payload, now + rtt)
+        now += 10
+    assert heartbeat.pong_timeout == 1
+
+    heartbeat.ping(now)
+    assert heartbeat.check(now + 1) is None
+    assert heartbeat.check(now + 1.5) == "pong_timeout"
+
+
+def test_heartbeat_detects_stalled_subscriptions():
+    heartbeat = Heartbeat(stall_timeout=60)
+    heartbeat.reset(now=100)
+    assert heartbeat.check(now=150, quiet_since=100) is None
+    assert heartbeat.check(now=161, quiet_since=100) == "stalled"
+    assert heartbeat.check(now=161, quiet_since=120) is None
+    assert heartbeat.check(now=161) is None
+
+    heartbeat.stall_timeout = 0
+    assert heartbeat.check(now=500, quiet_since=300) is None
+
+
+def _relay(stall_timeout: float) -> tuple[Relay, list[str]]:
+    relay = Relay("wss://stall.example.com", MessagePool())
+    sent: list[str] = []
+    relay.ws = SimpleNamespace(send=sent.append)
+    relay.heartbeat.stall_timeout = stall_timeout
+    relay._on_open(None)
+    return relay, sent
+
+
+def test_stall_is_tracked_per_subscription():
+    relay, _ = _relay(stall_timeout=0.5)
+    relay.publish_subscriptions(
+        [Subscription(sub_id, [{"kinds": [1]}]) for sub_id in ("busy", "idle")]
+    )
+    while relay.queue.qsize():
+        relay._send(relay.queue.get_nowait())
+    requested_at = time.monotonic()
+    time.sleep(0.3)
+    relay._on_message(None, json.dumps(["EVENT", "busy", make_event("hi")]))
+    # the events of one subscription do not hide the other one
+    assert relay.check_heartbeat(now=requested_at + 0.6) == "stalled"
+
+    relay._on_message(None, json.dumps(["EOSE", "idle"]))
+    relay.observe_eose(relay.message_pool.get_eose_notice())
+    assert relay.check_heartbeat(now=requested_at + 0.6) is None
+    assert relay.check_heartbeat(now=requested_at + 1) == "stalled"
+
+    # a subscription closed by the relay is not waiting for an EOSE anymore
+    relay.observe_closed("busy")
+    assert relay.check_heartbeat(now=requested_at + 1) is None
+    assert not relay._subscriptions_requested_at
+
+
+@pytest.mark.asyncio
+async def test_paced_requests_count_from_when_they_are_sent():
+    relay, sent = _relay(stall_timeout=0.5)
+    relay.queue.max_rate = 4
+    for i in range(4):
+        relay.publish(json.dumps(["EVENT", make_event(f"note {i}")]))
+    relay.publish_subscriptions([Subscription("sub", [{"kinds": [1]}])])
+    queued_at = time.monotonic()
+    worker = threading.Thread(
+        target=asyncio.run, args=(relay.queue_worker(),), daemon=True
+    )
+    worker.start()
+    try:
+        # the REQ waits about a second behind the paced EVENTs
+        assert relay.check_heartbeat(now=queued_at + 0.6) is None
+        await wait_for(lambda: len(sent) == 5)
+        sent_at = time.monotonic()
+        assert json.loads(sent[-1])[0] == "REQ"
+        assert relay.check_heartbeat(now=sent_at + 0.3) is None
+        assert relay.check_heartbeat(now=sent_at + 0.6) == "stalled"
+    finally:
+        relay.shutdown = True
+        await asyncio.to_thread(worker.join, 2)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("compression", [False, True])
+async def test_relay_round_trip_times(compression):
+    fake_relay = FakeRelay()
+    url = await fake_relay.start()
+    relay_manager = RelayManager()
+    relay_manager.set_compression(DeflateOptions(enabled=compression))
+    relay_manager.set_heartbeat(
+        idle_ping_interval=0.2, max_pong_timeout=5, stall_timeout=0
+    )
+    try:
+        relay = relay_manager.add_relay(url)
+        await wait_for(lambda: len(relay.heartbeat.rtt) >= 2)
+        assert relay.heartbeat.rtt.max < 1
+        assert relay.connected
+        assert relay.num_heartbeat_failures == 0
+    finally:
+        await asyncio.to_thread(relay_manager.close_connections)
+        await fake_relay.stop()
+
+
+@pytest.mark.asyncio
+async def test_stalled_relay_reconnects(monkeypatch):
+    monkeypatch.setattr(relay_manager_module, "HEARTBEAT_CHECK_INTERVAL", 0.1)
+    # answers the subscription after the stall timeout
+    fake_relay = FakeRelay(eose_delay=2)
+    url = await fake_relay.start()
+    relay_manager = RelayManager()
+    relay_manager.set_heartbeat(
+        idle_ping_interval=10, max_pong_timeout=5, stall_timeout=1
+    )
+    relay_manager.add_subscription("sub1", [{"kinds": [1]}])
+    try:
+        relay = relay_manager.add_relay(url)
+        await wait_for(lambda: relay_manager.relays.get(url) not in (None, relay), 15)
+        relay_manager.set_heartbeat(
+            idle_ping_interval=10, max_pong_timeout=5, stall_timeout=0
+        )
+        new_relay = relay_manager.relays[url]
+        assert new_relay.num_heartbeat_failures == 1
+        assert "Heartbeat failed: stalled" in new_relay.error_list
+        await wait_for(lambda: new_relay.connected)
+        await wait_for(lambda: relay_manager.message_pool.eose_notices.qsize() == 1)
+        # traffic after the reconnect resets the failures
+        await wait_for(lambda: new_relay.check_heartbeat() is None)
+        assert new_relay.num_heartbeat_failures == 0
+    finally:
+        await asyncio.to_thread(relay_manager.close_connections)
+        await fake_relay.stop()
@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+
+from ..nostr.ingestion import IngestionPipeline
+from ..nostr.message_pool import MessagePool
+from ..nostr.relay import Relay
+from .fake_relay import make_event
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_frames_are_parsed_in_order_by_the_workers():
+    pool = MessagePool()
+    pipeline = IngestionPipeline()
+    pipeline.set_workers(2)
+    relays = [Relay(f"wss://{i}.example.com", pool) for i in range(3)]
+    for relay in relays:
+        relay.pipeline = pipeline
+    try:
+        for i in range(50):
+            for relay in relays:
+                event = make_event(f"{relay.url} {i}")
+                relay._on_message(None, json.dumps(["EVENT", relay.url, event]))
+        for relay in relays:
+            relay._on_message(None, json.dumps(["EOSE", relay.url]))
+
+        wait_for(lambda: pool.eose_notices.qsize() == 3)
+        # the EOSE of a relay comes after all its events
+        assert pool.events.qsize() == 150
+        events_by_relay: dict = {}
+        while pool.has_events():
+            event_message = pool.get_event()
+            events_by_relay.setdefault(event_message.url, []).append(
+                event_message.data["content"]
+            )
+        for relay in relays:
+            assert events_by_relay[relay.url] == [f"{relay.url} {i}" for i in range(50)]
+    finally:
+        pipeline.stop()
+
+
+def test_frames_keep_their_order_while_the_workers_change():
+    pipeline = IngestionPipeline()
+    relay = Relay("wss://ordered.example.com", MessagePool())
+    parsed = []
+
+    def ingest(frame, trace=None):
+        time.sleep(0.001)
+        parsed.append(frame)
+
+    relay.ingest = ingest  # type: ignore
+    frames = [json.dumps(["EVENT", "sub", {"n": i}]) for i in range(300)]
+    frames.append(json.dumps(["EOSE", "sub"]))
+
+    def receive():
+        for frame in frames:
+            time.sleep(0.0003)
+            if not pipeline.submit(relay, frame, None):
+                relay.ingest(frame)
+
+    pipeline.set_workers(1)
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+    try:
+        for num_workers in (3, 2, 0, 4):
+            time.sleep(0.02)
+            pipeline.set_workers(num_workers)
+        receiver.join(10)
+        wait_for(lambda: len(parsed) == len(frames))
+        assert parsed == frames
+    finally:
+        pipeline.stop()
+
+
+def test_events_are_dropped_when_the_queue_stays_full():
+    pool = MessagePool()
+    pipeline = IngestionPipeline(max_queued=2, batch_size=1, submit_timeout=0.05)
+    relay = Relay("wss://busy.example.com", pool)
+    relay.pipeline = pipeline
+
+    # hold the worker on the first frame
+    release = threading.Event()
+    ingest = relay.ingest
+    relay.ingest = lambda *args: release.wait(5) and ingest(*args)  # type: ignore
+    pipeline.set_workers(1)
+    try:
+        for i in range(5):
+            relay._on_message(None, json.dumps(["EVENT", "sub", make_event(str(i))]))
+            if i == 0:
+                wait_for(lambda: pipeline.qsize() == 0)
+        assert pipeline.num_dropped == 2
+        # an EOSE waits for room in the queue instead
+        eose = threading.Thread(
+            target=relay._on_message, args=(None, json.dumps(["EOSE", "sub"]))
+        )
+        eose.start()
+        eose.join(0.2)
+        assert eose.is_alive()
+        release.set()
+        eose.join(5)
+        wait_for(lambda: pool.events.qsize() == 3)
+        wait_for(lambda: pool.eose_notices.qsize() == 1)
+    finally:
+        pipeline.stop()
+
+    # without workers the frames are parsed on the calling thread
+    relay.ingest = ingest  # type: ignore
+    relay._on_message(None, json.dumps(["EVENT", "sub", make_event("inline")]))
+    assert pool.events.qsize() == 4
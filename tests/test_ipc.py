@@ -0,0 +1,191 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from .. import tasks, views_api
+from ..nostr.client.client import NostrClient
+from ..nostr.ipc import IpcLeader, RelayManagerProxy
+from ..nostr.message_pool import MessagePool
+from ..nostr.relay import Relay, messages_received
+from ..nostr.relay_manager import RelayManager
+from ..router import NostrRouter, ipc_leader, nostr_client
+from .fake_relay import FakeRelay, make_event
+
+
+async def wait_for(condition, timeout: float = 5):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.05)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+@pytest.mark.asyncio
+async def test_follower_uses_the_relay_connections_of_the_leader(tmp_path):
+    lock_path, socket_path = str(tmp_path / "leader.lock"), str(tmp_path / "s.sock")
+    relay_manager = RelayManager()
+    leader, other = IpcLeader(), IpcLeader()
+    assert leader.elect(lock_path)
+    assert not other.elect(lock_path)
+    leader.start(socket_path, relay_manager)
+
+    published = []
+    relay_manager.publish_message = published.append  # type: ignore
+    proxy = RelayManagerProxy(socket_path)
+    try:
+        # subscriptions made before the connection are sent once connected
+        proxy.add_subscription("sub1", [{"kinds": [1]}])
+        proxy.start()
+        await wait_for(lambda: "sub1" in relay_manager._cached_subscriptions)
+        assert leader.num_followers == 1
+
+        event = make_event("from a relay")
+        assert leader.forward_event("sub1", json.dumps(event))
+        assert not leader.forward_event("sub2", json.dumps(event))
+        pool = proxy.message_pool
+        await wait_for(pool.has_events)
+        event_message = pool.get_event()
+        assert event_message.subscription_id == "sub1"
+        assert event_message.event_id == event["id"]
+
+        proxy.publish_message(json.dumps(["EVENT", make_event("published")]))
+        await wait_for(lambda: len(published) == 1)
+
+        # the subscriptions of a follower are closed when it disconnects
+        await asyncio.to_thread(proxy.close)
+        await wait_for(lambda: leader.num_followers == 0)
+        assert "sub1" not in relay_manager._cached_subscriptions
+    finally:
+        proxy.close()
+        leader.stop()
+
+
+def test_leader_start_is_idempotent(tmp_path):
+    socket_path = str(tmp_path / "s.sock")
+    leader = IpcLeader()
+    try:
+        leader.start(socket_path, RelayManager())
+        server = leader._server
+        relay_manager = RelayManager()
+        leader.start(socket_path, relay_manager)
+        assert leader._server is server
+        assert leader.relay_manager is relay_manager
+    finally:
+        leader.stop()
+
+
+@pytest.mark.asyncio
+async def test_follower_delivers_relay_events(tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "s.sock")
+    event = make_event("through the leader")
+    fake_relay = FakeRelay(history=[event])
+    url = await fake_relay.start()
+
+    leader = IpcLeader()
+    leader_client = NostrClient()
+    leader.start(socket_path, leader_client.relay_manager)
+    leader_client.relay_manager.add_relay(url)
+    leader_task = asyncio.create_task(
+        leader_client.subscribe(
+            lambda m: leader.forward_event(m.subscription_id, m.event),
+            None,
+            leader.forward_eose,
+        )
+    )
+
+    follower_client = NostrClient()
+    proxy = RelayManagerProxy(socket_path)
+    follower_client.relay_manager = proxy
+    monkeypatch.setattr(tasks, "nostr_client", follower_client)
+    try:
+        proxy.start()
+        await asyncio.wait_for(tasks.subscribe_events(), 5)
+        proxy.add_subscription("sub-ipc", [{"kinds": [1]}])
+        await wait_for(
+            lambda: "sub-ipc" in NostrRouter.received_subscription_events
+            and "sub-ipc" in NostrRouter.received_subscription_eosenotices
+        )
+        received = NostrRouter.received_subscription_events["sub-ipc"]
+        assert [e.event_id for e in received] == [event["id"]]
+    finally:
+        follower_client.running = leader_client.running = False
+        await leader_task
+        for event_message in NostrRouter.received_subscription_events.pop(
+            "sub-ipc", []
+        ):
+            NostrRouter._unbuffer_event(event_message)
+        NostrRouter.received_subscription_eosenotices.pop("sub-ipc", None)
+        proxy.close()
+        leader.stop()
+        await asyncio.to_thread(leader_client.relay_manager.close_connections)
+        await fake_relay.stop()
+
+
+@pytest.mark.asyncio
+async def test_admin_requests_are_answered_by_the_leader(tmp_path, monkeypatch):
+    monkeypatch.setattr(views_api.settings, "lnbits_data_folder", str(tmp_path))
+    socket_path = str(tmp_path / "s.sock")
+    url = "wss://leader.example.com"
+    relay_manager = RelayManager()
+    relay_manager.relays[url] = Relay(url, MessagePool())
+    messages_received.inc(relay=url)
+    ipc_leader.start(socket_path, relay_manager)
+    proxy = RelayManagerProxy(socket_path)
+    monkeypatch.setattr(nostr_client, "relay_manager", proxy)
+    try:
+        proxy.start()
+        await wait_for(lambda: proxy.connected)
+
+        relays = await views_api.api_get_relays()
+        assert [r.url for r in relays] == [url]
+        assert f'nostrclient_relay_messages_received_total{{relay="{url}"}}' in (
+            await views_api.api_get_metrics()
+        )
+
+        capture = await views_api.api_start_capture()
+        assert capture.recording and capture.path
+        assert relay_manager.recorder and relay_manager.relays[url].recorder
+        assert (await views_api.api_get_capture()).path == capture.path
+        assert not (await views_api.api_stop_capture()).recording
+        assert not relay_manager.recorder
+
+        # without the leader the requests fail instead of answering wrongly
+        await asyncio.to_thread(proxy.close)
+        with pytest.raises(HTTPException) as exc_info:
+            await views_api.api_get_relays()
+        assert exc_info.value.status_code == 503
+    finally:
+        proxy.close()
+        ipc_leader.stop()
+
+
+@pytest.mark.asyncio
+async def test_relay_commands_are_sent_once_connected(tmp_path):
+    socket_path = str(tmp_path / "s.sock")
+    commands = []
+    relay_manager = RelayManager()
+    relay_manager.set_relays = lambda urls: commands.append(("set", urls))  # type: ignore
+    relay_manager.add_relay = lambda url: commands.append(("add", url))  # type: ignore
+    relay_manager.remove_relay = lambda url: commands.append(("remove", url))  # type: ignore
+    proxy = RelayManagerProxy(socket_path)
+    leader = IpcLeader()
+    try:
+        # the leader is not reachable yet, nothing is lost
+        proxy.start()
+        proxy.set_relays(["wss://a.example.com", "wss://b.example.com"])
+        proxy.remove_relay("wss://a.example.com")
+        proxy.add_relay("wss://c.example.com")
+        leader.start(socket_path, relay_manager)
+        await wait_for(lambda: len(commands) == 3)
+        assert commands == [
+            ("set", ["wss://a.example.com", "wss://b.example.com"]),
+            ("remove", "wss://a.example.com"),
+            ("add", "wss://c.example.com"),
+        ]
+        proxy.add_relay("wss://d.example.com")
+        await wait_for(lambda: len(commands) == 4)
+    finally:
+        proxy.close()
+        leader.stop()
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import secrets
+
+import pytest
+
+from ..nostr.message_pool import MessagePool
+from ..nostr.negentropy import (
+    Negentropy,
+    NegentropyStorage,
+    NegentropySync,
+    decode_varint,
+    encode_varint,
+)
+from ..nostr.relay_manager import RelayManager
+from ..nostr.subscription import Subscription
+from .fake_relay import FakeRelay, make_event
+
+
+async def wait_for(condition, timeout: float = 5):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.05)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+def make_storage(items) -> NegentropyStorage:
+    storage = NegentropyStorage()
+    for created_at, event_id in items:
+        storage.insert(created_at, event_id)
+    storage.seal()
+    return storage
+
+
+@pytest.mark.parametrize("n", [0, 1, 127, 128, 16383, 16384, 2**64 - 1])
+def test_varint(n):
+    data = encode_varint(n) + b"\xff"
+    assert decode_varint(data, 0) == (n, len(data) - 1)
+
+
+@pytest.mark.parametrize("num_shared", [0, 10, 5000])
+def test_reconcile(num_shared):
+    def items(n):
+        # few timestamps, so bounds need id prefixes
+        return [(1700000000 + i % 7, secrets.token_hex(32)) for i in range(n)]
+
+    shared, only_client, only_server = items(num_shared), items(30), items(45)
+    client = Negentropy(make_storage(shared + only_client))
+    server = Negentropy(make_storage(shared + only_server))
+
+    have, need = [], []
+    message = client.initiate()
+    num_rounds = 0
+    while message is not None:
+        num_rounds += 1
+        answer, _, _ = server.reconcile(message)
+        assert answer is not None
+        message, have_ids, need_ids = client.reconcile(answer)
+        have += have_ids
+        need += need_ids
+
+    assert sorted(have) == sorted(i for _, i in only_client)
+    assert sorted(need) == sorted(i for _, i in only_server)
+    assert num_rounds <= 4
+
+
+def test_items_are_capped():
+    pool = MessagePool()
+    pool.record_items = True
+    pool.max_items = 5
+    history = [make_event(str(i), created_at=1700000000 + i) for i in range(8)]
+    for event in history:
+        pool.add_message(json.dumps(["EVENT", "sub1", event]), "wss://relay")
+    items = pool.items("sub1")
+    assert items == [(e["created_at"], e["id"]) for e in history[3:]]
+    assert not pool.items_complete("sub1")
+
+    # only the events since the oldest item kept are reconciled
+    sync = NegentropySync(Subscription("sub1", [{"kinds": [1]}]), items, False)
+    neg_open = json.loads(sync.open_messages()[0])
+    assert neg_open[2] == {"kinds": [1], "since": history[3]["created_at"]}
+
+    pool.forget_items("sub1")
+    assert pool.items_complete("sub1")
+
+
+@pytest.mark.asyncio
+async def test_resubscribe_with_negentropy():
+    history = [make_event(f"note {i}", created_at=1700000000 + i) for i in range(300)]
+    fake_relay = FakeRelay(history=history, negentropy=True)
+    url = await fake_relay.start()
+
+    relay_manager = RelayManager()
+    relay_manager.set_negentropy_sync(True)
+    pool = relay_manager.message_pool
+    relay_manager.add_subscription("sub1", [{"kinds": [1]}])  # type: ignore
+    # received before, e.g. until the connection to the relay dropped
+    for event in history[:290]:
+        pool.add_message(json.dumps(["EVENT", "sub1", event]), url)
+    while pool.has_events():
+        pool.get_event()
+    try:
+        relay = relay_manager.add_relay(url)
+        # of the live REQ and of the REQ after the sync
+        await wait_for(lambda: pool.eose_notices.qsize() == 2)
+        assert relay.negentropy_supported
+        assert {pool.get_event().event_id for _ in range(10)} == {
+            e["id"] for e in history[290:]
+        }
+        assert not pool.has_events()
+        # only the missing events were sent, not the whole history
+        requests = [m for m in fake_relay.received if m[0] == "REQ"]
+        assert len(requests) == 2
+        # the live events were requested before the sync
+        assert requests[0][2]["since"] >= history[-1]["created_at"]
+        assert sorted(requests[1][2]["ids"]) == sorted(e["id"] for e in history[290:])
+        assert fake_relay.num_sent < 20
+    finally:
+        await asyncio.to_thread(relay_manager.close_connections)
+        await fake_relay.stop()
+
+
+@pytest.mark.asyncio
+async def test_resubscribe_without_negentropy():
+    history = [make_event(f"note {i}") for i in range(20)]
+    fake_relay = FakeRelay(history=history)
+    url = await fake_relay.start()
+
+    relay_manager = RelayManager()
+    relay_manager.set_negentropy_sync(True)
+    pool = relay_manager.message_pool
+    relay_manager.add_subscription("sub1", [{"kinds": [1]}])  # type: ignore
+    pool.add_message(json.dumps(["EVENT", "sub1", history[0]]), url)
+    pool.get_event()
+    try:
+        relay = relay_manager.add_relay(url)
+        # the NOTICE answering the NEG-OPEN ends the sync, not its timeout
+        await wait_for(lambda: pool.events.qsize() == 19)
+        assert relay.negentropy_supported is False
+
+        # remembered when the relay is added again
+        await asyncio.to_thread(relay_manager.remove_relay, url)
+        fake_relay.received.clear()
+        await asyncio.to_thread(relay_manager.add_relay, url)
+        await wait_for(lambda: len(fake_relay.received) == 1)
+        assert fake_relay.received[0][0] == "REQ"
+    finally:
+        await asyncio.to_thread(relay_manager.close_connections)
+        await fake_relay.stop()
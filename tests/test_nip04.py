@@ -0,0 +1,19 @@
+from ..nostr.key import PrivateKey
+
+
+def test_nip04_batch_round_trip():
+    sender, receiver = PrivateKey(), PrivateKey()
+    messages = [(f"message {i} ⚡", receiver.public_key.hex()) for i in range(50)]
+    payloads = sender.encrypt_messages(messages, max_workers=4)
+
+    decrypted = receiver.decrypt_messages(
+        [(p, sender.public_key.hex()) for p in [*payloads, "invalid?iv=AAAA"]],
+        max_workers=4,
+    )
+    assert decrypted[:-1] == [m for m, _ in messages]
+    assert decrypted[-1] is None
+    # both sides derive the same secret, each key caches its own copy
+    assert receiver.compute_shared_secret(sender.public_key.hex()) == (
+        sender.compute_shared_secret(receiver.public_key.hex())
+    )
+    assert list(sender._shared_secrets) == [receiver.public_key.hex()]
@@ -0,0 +1,78 @@
+import pytest
+
+from ..helpers import normalize_public_key
+from ..nostr import nip19
+from ..nostr.bech32 import Encoding, bech32_encode, convertbits
+from ..nostr.key import PrivateKey, PublicKey
+
+# test vectors from the NIP-19 specification
+NPUB = "npub10elfcs4fr0l0r8af98jlmgdh9c8tcxjvz9qkw038js35mp4dma8qzvjptg"
+NPUB_HEX = "7e7e9c42a91bfef19fa929e5fda1b72e0ebc1a4c1141673e2794234d86addf4e"
+NSEC = "nsec1vl029mgpspedva04g90vltkh6fvh240zqtv9k0t9af8935ke9laqsnlfe5"
+NSEC_HEX = "67dea2ed018072d675f5415ecfaed7d2597555e202d85b3d65ea4e58d2d92ffa"
+NPROFILE = (
+    "nprofile1qqsrhuxx8l9ex335q7he0f09aej04zpazpl0ne2cgukyawd24mayt8gpp4mhxue6"
+    "9uhhytnc9e3k7mgpz4mhxue69uhkg6nzv9ejuumpv34kytnrdaksjlyr9p"
+)
+
+
+def test_keys():
+    assert nip19.decode_key(NPUB, "npub") == NPUB_HEX
+    assert nip19.encode_key("npub", NPUB_HEX) == NPUB
+    assert nip19.decode_key(NSEC) == NSEC_HEX
+    assert nip19.encode_keys("nsec", [NSEC_HEX]) == [NSEC]
+    assert normalize_public_key(NPUB) == NPUB_HEX
+    assert PublicKey.from_npub(NPUB).hex() == NPUB_HEX
+    assert PrivateKey.from_nsec(NSEC).hex() == NSEC_HEX
+
+
+def test_matches_reference_implementation():
+    keys = [PrivateKey().public_key.raw_bytes for _ in range(20)]
+    for key in keys:
+        expected = bech32_encode("note", convertbits(key, 8, 5), Encoding.BECH32)
+        assert nip19.encode("note", key) == expected
+    assert nip19.decode_keys(nip19.encode_keys("note", [k.hex() for k in keys])) == [
+        k.hex() for k in keys
+    ]
+
+
+def test_nprofile():
+    assert nip19.decode_entity(NPROFILE) == (
+        "nprofile",
+        nip19.ProfilePointer(
+            "3bf0c63fcb93463407af97a5e5ee64fa883d107ef9e558472c4eb9aaaefa459d",
+            ["wss://r.x.com", "wss://djbas.sadkb.com"],
+        ),
+    )
+    pointer = nip19.decode_entity(NPROFILE)[1]
+    assert nip19.encode_nprofile(pointer.pubkey, pointer.relays) == NPROFILE
+
+
+def test_nevent_naddr():
+    nevent = nip19.encode_nevent(NSEC_HEX, ["wss://relay.example.com"], NPUB_HEX, 1)
+    assert nip19.decode_entity(nevent) == (
+        "nevent",
+        nip19.EventPointer(NSEC_HEX, ["wss://relay.example.com"], NPUB_HEX, 1),
+    )
+    naddr = nip19.encode_naddr("my-stall", NPUB_HEX, 30017)
+    assert nip19.decode_entity(naddr) == (
+        "naddr",
+        nip19.AddressPointer("my-stall", NPUB_HEX, 30017),
+    )
+
+
+@pytest.mark.parametrize(
+    "bech",
+    [
+        NPUB[:-1] + "q",  # checksum
+        NPUB.upper()[:10] + NPUB[10:],  # mixed case
+        NPUB.replace("0", "b", 1),  # charset
+        NSEC,  # prefix
+        nip19.encode("npub", bytes(31)),  # length
+    ],
+)
+def test_invalid_npub(bech):
+    with pytest.raises(ValueError):
+        nip19.decode_key(bech, "npub")
+    with pytest.raises(ValueError):
+        normalize_public_key(bech)
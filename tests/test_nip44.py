@@ -0,0 +1,55 @@
+import pytest
+
+from ..nostr import nip44
+from ..nostr.key import PrivateKey
+
+
+@pytest.mark.parametrize(
+    "unpadded_len, padded_len",
+    [
+        (1, 32),
+        (32, 32),
+        (33, 64),
+        (65, 96),
+        (200, 224),
+        (320, 320),
+        (383, 384),
+        (400, 448),
+        (515, 640),
+        (900, 1024),
+        (65535, 65536),
+    ],
+)
+def test_calc_padded_len(unpadded_len, padded_len):
+    assert nip44.calc_padded_len(unpadded_len) == padded_len
+
+
+def test_nip44_vector():
+    # https://github.com/paulmillr/nip44/blob/main/nip44.vectors.json
+    sender = PrivateKey(bytes.fromhex("00" * 31 + "01"))
+    receiver = PrivateKey(bytes.fromhex("00" * 31 + "02"))
+    conversation_key = sender.get_conversation_key(receiver.public_key.hex())
+    assert conversation_key.hex() == (
+        "c41c775356fd92eadc63ff5a0dc1da211b268cbea22316767095b2871ea1412d"
+    )
+
+    payload = nip44.encrypt("a", conversation_key, bytes.fromhex("00" * 31 + "01"))
+    assert payload == (
+        "AgAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAABee0G5VSK0/9YypIObAtDKfYEAjD35uV"
+        "kHyB0F4DwrcNaCXlCWZKaArsGrY6M9wnuTMxWfp1RTN9Xga8no+kF5Vsb"
+    )
+    assert receiver.nip44_decrypt(payload, sender.public_key.hex()) == "a"
+
+
+def test_nip44_batch_and_tampering():
+    sender, receiver = PrivateKey(), PrivateKey()
+    messages = [(f"message {i} ⚡", receiver.public_key.hex()) for i in range(50)]
+    payloads = sender.encrypt_messages(messages, encryption="nip44")
+
+    tampered = payloads[0][:-4] + ("AAAA" if payloads[0][-4:] != "AAAA" else "BBBB")
+    decrypted = receiver.decrypt_messages(
+        [(p, sender.public_key.hex()) for p in [*payloads, tampered]],
+        encryption="nip44",
+    )
+    assert decrypted[:-1] == [m for m, _ in messages]
+    assert decrypted[-1] is None
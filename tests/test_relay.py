@@ -0,0 +1,181 @@
+import asyncio
+import json
+
+import pytest
+
+from ..nostr import relay_manager as relay_manager_module
+from ..nostr.compression import DeflateOptions
+from ..nostr.relay import Relay
+from ..nostr.relay_manager import RelayManager
+from ..nostr.relay_url import normalize_relay_url
+from .fake_relay import FakeRelay, make_event
+
+
+async def wait_for(condition, timeout: float = 5):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.05)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+@pytest.mark.asyncio
+async def test_relay_manager_against_fake_relays():
+    history = [make_event(f"note {i}") for i in range(10)]
+    fake_relays = [FakeRelay(history=history), FakeRelay(history=history)]
+    urls = [await r.start() for r in fake_relays]
+
+    relay_manager = RelayManager()
+    try:
+        for url in urls:
+            relay_manager.add_relay(url)
+        await wait_for(lambda: all(r.connected for r in relay_manager.relays.values()))
+
+        relay_manager.add_subscription("sub1", [{"kinds": [1]}])  # type: ignore
+        pool = relay_manager.message_pool
+        await wait_for(lambda: pool.eose_notices.qsize() == 2)
+
+        # the same history comes from both relays, it is only accepted once
+        event_ids = []
+        while pool.has_events():
+            event_ids.append(pool.get_event().event_id)
+        assert len(event_ids) == len(set(event_ids))
+        assert set(event_ids) == {e["id"] for e in history}
+        assert pool.events.qsize() == 0
+
+        published = make_event("published")
+        relay_manager.publish_message(json.dumps(["EVENT", published]))
+        await wait_for(lambda: all(published in r.events for r in fake_relays))
+    finally:
+        # the fake relays share this event loop, do not block it while closing
+        await asyncio.to_thread(relay_manager.close_connections)
+        for r in fake_relays:
+            await r.stop()
+
+
+@pytest.mark.asyncio
+async def test_relay_manager_handles_closed(monkeypatch):
+    monkeypatch.setattr(relay_manager_module, "RESUBSCRIBE_DELAY", 0.01)
+    relay_manager = RelayManager()
+    pool = relay_manager.message_pool
+    urls = ["wss://one.example.com", "wss://two.example.com"]
+    for url in urls:
+        relay_manager.relays[url] = Relay(url, pool)
+    relay_manager.add_subscription("sub1", [{"kinds": [1]}])  # type: ignore
+    one, two = (relay_manager.relays[url] for url in urls)
+    one.queue.get_nowait()
+
+    # transient: requested again on the same relay
+    pool.add_message(json.dumps(["CLOSED", "sub1", "rate-limited: slow down"]), urls[0])
+    closed = pool.get_closed_message()
+    assert closed.reason == "rate-limited"
+    assert not relay_manager.handle_closed(closed)
+    await wait_for(lambda: one.queue.qsize() == 1)
+    assert json.loads(one.queue.get_nowait())[:2] == ["REQ", "sub1"]
+
+    # permanent: reported once no relay serves the subscription
+    pool.add_message(json.dumps(["CLOSED", "sub1", "auth-required: login"]), urls[0])
+    assert not relay_manager.handle_closed(pool.get_closed_message())
+    pool.add_message(json.dumps(["CLOSED", "sub1", "blocked: no"]), urls[1])
+    assert relay_manager.handle_closed(pool.get_closed_message())
+    assert two.notice_list[0] == "CLOSED 'sub1': blocked: no"
+
+    # unknown subscriptions are ignored
+    pool.add_message(json.dumps(["CLOSED", "sub2", "error: gone"]), urls[1])
+    assert not relay_manager.handle_closed(pool.get_closed_message())
+
+
+@pytest.mark.asyncio
+async def test_relay_manager_with_compression():
+    history = [make_event("x" * 1000) for _ in range(5)]
+    fake_relay = FakeRelay(history=history)
+    url = await fake_relay.start()
+
+    relay_manager = RelayManager()
+    relay_manager.set_compression(DeflateOptions(enabled=True, max_window_bits=12))
+    try:
+        relay = relay_manager.add_relay(url)
+        await wait_for(lambda: relay.connected)
+        assert relay.ws.compressed
+
+        relay_manager.add_subscription("sub1", [{"kinds": [1]}])  # type: ignore
+        pool = relay_manager.message_pool
+        await wait_for(lambda: pool.eose_notices.qsize() == 1)
+        assert pool.events.qsize() == len(history)
+
+        published = make_event("published")
+        relay_manager.publish_message(json.dumps(["EVENT", published]))
+        await wait_for(lambda: published in fake_relay.events)
+    finally:
+        await asyncio.to_thread(relay_manager.close_connections)
+        await fake_relay.stop()
+
+
+@pytest.mark.parametrize(
+    "url, normalized",
+    [
+        ("wss://relay.example.com", "wss://relay.example.com"),
+        ("WSS://Relay.Example.com/", "wss://relay.example.com"),
+        ("  relay.example.com  ", "wss://relay.example.com"),
+        ("wss://relay.example.com:443//nostr/", "wss://relay.example.com/nostr"),
+        ("ws://relay.example.com:80", "ws://relay.example.com"),
+        ("wss://relay.example.com:4848", "wss://relay.example.com:4848"),
+        ("https://relay.example.com/?b=2&a=1#x", "wss://relay.example.com?a=1&b=2"),
+        ("ws://[::1]:7000/", "ws://[::1]:7000"),
+    ],
+)
+def test_normalize_relay_url(url, normalized):
+    assert normalize_relay_url(url) == normalized
+
+
+@pytest.mark.parametrize("url", ["ftp://relay.example.com", "wss://", "wss://x:y"])
+def test_normalize_invalid_relay_url(url):
+    with pytest.raises(ValueError):
+        normalize_relay_url(url)
+
+
+@pytest.mark.asyncio
+async def test_relay_manager_deduplicates_relay_urls():
+    fake_relay = FakeRelay()
+    url = await fake_relay.start()
+
+    relay_manager = RelayManager()
+    try:
+        relay = relay_manager.add_relay(url)
+        assert relay_manager.add_relay(f"{url.upper()}/") is relay
+        await wait_for(lambda: relay.connected)
+        assert list(relay_manager.relays) == [url]
+        assert fake_relay.num_connections == 1
+
+        await asyncio.to_thread(relay_manager.remove_relay, f"{url}/")
+        assert not relay_manager.relays
+    finally:
+        await asyncio.to_thread(relay_manager.close_connections)
+        await fake_relay.stop()
+
+
+@pytest.mark.asyncio
+async def test_relay_manager_set_relays():
+    fake_relays = [FakeRelay() for _ in range(3)]
+    one, two, three = [await r.start() for r in fake_relays]
+
+    relay_manager = RelayManager()
+    try:
+        added, removed = relay_manager.set_relays([one, two, f"{two}/"])
+        assert (added, removed) == ([one, two], [])
+        kept = relay_manager.relays[two]
+        await wait_for(lambda: kept.connected)
+        relay_manager.add_subscription("sub1", [{"kinds": [1]}])  # type: ignore
+        await wait_for(lambda: len(fake_relays[1].received) == 1)
+
+        added, removed = await asyncio.to_thread(relay_manager.set_relays, [two, three])
+        assert (added, removed) == ([three], [one])
+        assert list(relay_manager.relays) == [two, three]
+        # the relay in both sets keeps its connection and subscription
+        assert relay_manager.relays[two] is kept and kept.connected
+        await wait_for(lambda: len(fake_relays[2].received) == 1)
+        assert [m[0] for m in fake_relays[1].received] == ["REQ"]
+    finally:
+        await asyncio.to_thread(relay_manager.close_connections)
+        for r in fake_relays:
+            await r.stop()
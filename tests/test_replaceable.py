@@ -0,0 +1,72 @@
+import gc
+import json
+import weakref
+
+from ..nostr.message_pool import EventMessage
+from ..nostr.replaceable import ReplaceableEvents, replaceable_key
+from .fake_relay import make_event
+
+PUBKEY = "aa" * 32
+
+
+def _message(event: dict, subscription_id: str = "sub") -> EventMessage:
+    return EventMessage(json.dumps(event), event["id"], subscription_id, "", data=event)
+
+
+def test_replaceable_key():
+    assert replaceable_key(make_event(kind=1, public_key=PUBKEY)) is None
+    assert replaceable_key(make_event(kind=0, public_key=PUBKEY)) == (PUBKEY, 0)
+    assert replaceable_key(make_event(kind=10002, public_key=PUBKEY)) == (
+        PUBKEY,
+        10002,
+    )
+    stall = make_event(kind=30017, tags=[["d", "stall"]], public_key=PUBKEY)
+    assert replaceable_key(stall) == (PUBKEY, 30017, "stall")
+    assert replaceable_key(make_event(kind=30017, public_key=PUBKEY)) == (
+        PUBKEY,
+        30017,
+        "",
+    )
+
+
+def test_keeps_newest_version():
+    replaceable_events = ReplaceableEvents()
+    old = _message(make_event("v1", kind=0, public_key=PUBKEY, created_at=100))
+    new = _message(make_event("v2", kind=0, public_key=PUBKEY, created_at=200))
+    older = _message(make_event("v0", kind=0, public_key=PUBKEY, created_at=50))
+
+    assert replaceable_events.add(old)
+    assert replaceable_events.add(new)
+    assert old.suppressed == "replaced"
+    assert not new.suppressed
+    assert not replaceable_events.add(older)
+
+    # other subscriptions and other d tags are independent
+    assert replaceable_events.add(_message(older.data, subscription_id="other"))
+    product = make_event(
+        kind=30018, tags=[["d", "p1"]], public_key=PUBKEY, created_at=100
+    )
+    other_product = make_event(
+        kind=30018, tags=[["d", "p2"]], public_key=PUBKEY, created_at=50
+    )
+    assert replaceable_events.add(_message(product))
+    assert replaceable_events.add(_message(other_product))
+
+    replaceable_events.forget("sub")
+    assert replaceable_events.add(_message(older.data))
+
+
+def test_replaced_events_are_not_kept_alive():
+    replaceable_events = ReplaceableEvents()
+    old = _message(make_event("v1", kind=0, public_key=PUBKEY, created_at=100))
+    old_ref = weakref.ref(old)
+    assert replaceable_events.add(old)
+    del old
+    gc.collect()
+    assert old_ref() is None
+
+    # the newest version is still known after the message is gone
+    stale = make_event("v0", kind=0, public_key=PUBKEY, created_at=50)
+    assert not replaceable_events.add(_message(stale))
+    new = make_event("v2", kind=0, public_key=PUBKEY, created_at=200)
+    assert replaceable_events.add(_message(new))
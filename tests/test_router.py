@@ -0,0 +1,159 @@
+import json
+
+import pytest
+
+from ..helpers import TokenBucket
+from ..models import Config
+from ..nostr.message_pool import EventMessage
+from ..router import (
+    NostrRouter,
+    all_routers,
+    apply_config,
+    dead_events,
+    nostr_client,
+    replaceable_events,
+)
+from .fake_relay import make_event
+
+
+class FakeWebSocket:
+    def __init__(self) -> None:
+        self.sent: list = []
+
+    async def send_text(self, data: str):
+        self.sent.append(json.loads(data))
+
+    async def close(self, reason: str = ""):
+        pass
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=0.001, capacity=2)
+    assert bucket.consume()
+    assert bucket.consume()
+    assert not bucket.consume()
+
+
+@pytest.mark.asyncio
+async def test_public_client_limits():
+    config = Config(
+        public_req_per_minute=18,  # burst of 3
+        public_event_per_minute=6,  # burst of 1
+        public_max_subscriptions=2,
+        public_max_filters=2,
+        public_max_limit=100,
+        public_ip_rate_factor=4,
+    )
+    websocket = FakeWebSocket()
+    router = NostrRouter(websocket, limits=config, client_ip="10.0.0.1")  # type: ignore
+    try:
+        limited_filter = {"kinds": [1], "limit": 5000}
+        await router._handle_client_to_nostr(
+            json.dumps(["REQ", "s1", {"kinds": [1]}, {"kinds": [2]}, {"kinds": [3]}])
+        )
+        await router._handle_client_to_nostr(json.dumps(["REQ", "s1", limited_filter]))
+        await router._handle_client_to_nostr(json.dumps(["REQ", "s2", {"kinds": [1]}]))
+        await router._handle_client_to_nostr(json.dumps(["REQ", "s3", {"kinds": [1]}]))
+        await router._handle_client_to_nostr(json.dumps(["EVENT", {"id": "e1"}]))
+        await router._handle_client_to_nostr(json.dumps(["EVENT", {"id": "e2"}]))
+
+        assert websocket.sent == [
+            ["CLOSED", "s1", "invalid: at most 2 filters are allowed"],
+            ["CLOSED", "s3", "rate-limited: slow down"],
+            ["OK", "e2", False, "rate-limited: slow down"],
+        ]
+        assert sorted(router.original_subscription_ids.values()) == ["s1", "s2"]
+        assert NostrRouter.ip_connections["10.0.0.1"] == 1
+        subscriptions = nostr_client.relay_manager._cached_subscriptions
+        assert [subscriptions[s].filters for s in router.subscriptions] == [
+            [{"kinds": [1], "limit": 100}],
+            [{"kinds": [1], "limit": 100}],
+        ]
+    finally:
+        await router.stop()
+    assert "10.0.0.1" not in NostrRouter.ip_rate_limits
+
+
+@pytest.mark.asyncio
+async def test_config_changes_apply_to_connected_clients():
+    router = NostrRouter(FakeWebSocket(), limits=Config(), client_ip="10.0.0.2")  # type: ignore
+    all_routers.append(router)
+    try:
+        # the limits per IP address are opt-in
+        assert "10.0.0.2" not in NostrRouter.ip_rate_limits
+
+        config = Config(public_req_per_minute=6, public_ip_rate_factor=1)
+        apply_config(config)
+        assert router.limits is config
+        assert not router._is_rate_limited("REQ")
+        assert router._is_rate_limited("REQ")
+        assert NostrRouter.ip_rate_limits["10.0.0.2"]["REQ"].capacity == 1
+
+        apply_config(Config(public_req_per_minute=60, public_ip_rate_factor=2))
+        assert not router._is_rate_limited("REQ")
+        assert NostrRouter.ip_rate_limits["10.0.0.2"]["REQ"].capacity == 20
+    finally:
+        all_routers.remove(router)
+        apply_config(Config())
+        await router.stop()
+    assert "10.0.0.2" not in NostrRouter.ip_rate_limits
+
+
+@pytest.mark.asyncio
+async def test_req_replaces_subscription():
+    router = NostrRouter(FakeWebSocket())  # type: ignore
+    subscriptions = nostr_client.relay_manager._cached_subscriptions
+    try:
+        await router._handle_client_to_nostr(json.dumps(["REQ", "s1", {"kinds": [1]}]))
+        first = router.rewritten_subscription_ids["s1"]
+        await router._handle_client_to_nostr(json.dumps(["REQ", "s1", {"kinds": [2]}]))
+        second = router.rewritten_subscription_ids["s1"]
+
+        assert first != second
+        assert router.subscriptions == [second]
+        assert first not in subscriptions
+        assert subscriptions[second].filters == [{"kinds": [2]}]
+
+        await router._handle_client_to_nostr(json.dumps(["CLOSE", "s1"]))
+        assert router.subscriptions == []
+        assert second not in subscriptions
+    finally:
+        await router.stop()
+
+
+def _message(event: dict, sub_id: str = "buffered") -> EventMessage:
+    return EventMessage(json.dumps(event), event["id"], sub_id, "", data=event)
+
+
+def test_buffered_events_are_indexed(monkeypatch):
+    monkeypatch.setattr(dead_events, "enabled", True)
+    monkeypatch.setattr(replaceable_events, "enabled", True)
+    pubkey = "aa" * 32
+    note = _message(make_event("note", public_key=pubkey))
+    profile = _message(make_event(kind=0, public_key=pubkey, created_at=100))
+    buffer = NostrRouter.received_subscription_events
+    try:
+        assert NostrRouter.buffer_event(note)
+        assert not NostrRouter.buffer_event(_message(note.data))
+        assert NostrRouter.buffer_event(_message(note.data, "other"))
+        assert NostrRouter.buffer_event(profile)
+
+        # a newer version evicts the buffered one
+        newer_profile = _message(make_event(kind=0, public_key=pubkey, created_at=200))
+        replaceable_events.add(profile)
+        replaceable_events.add(newer_profile)
+        assert NostrRouter.buffer_event(newer_profile)
+        assert buffer["buffered"] == [note, newer_profile]
+
+        deletion = make_event(kind=5, tags=[["e", note.event_id]], public_key=pubkey)
+        NostrRouter.suppress_deleted_events(dead_events.add(_message(deletion)))
+        assert buffer["buffered"] == [newer_profile]
+        assert buffer["other"] == []
+        assert note.event_id not in NostrRouter.buffered_events
+    finally:
+        for sub_id in ["buffered", "other"]:
+            for event_message in buffer.pop(sub_id, []):
+                NostrRouter._unbuffer_event(event_message)
+        replaceable_events.clear()
+        dead_events.clear()
+    assert NostrRouter.buffered_events == {}
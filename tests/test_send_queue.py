@@ -0,0 +1,75 @@
+import json
+import time
+from queue import Empty
+
+import pytest
+
+from ..nostr.send_queue import SendQueue
+
+
+def _req(sub_id: str, kind: int = 1) -> str:
+    return json.dumps(["REQ", sub_id, {"kinds": [kind]}])
+
+
+def _close(sub_id: str) -> str:
+    return json.dumps(["CLOSE", sub_id])
+
+
+def _drain(queue: SendQueue) -> list:
+    messages = []
+    while queue.qsize():
+        messages.append(json.loads(queue.get_nowait()))
+    return messages
+
+
+def test_coalesces_subscriptions():
+    queue = SendQueue()
+    queue.put(_req("a"))
+    queue.put(_req("b"))
+    queue.put(_close("a"))  # never sent, both are cancelled
+    queue.put(_req("b", kind=2))  # replaces the pending REQ
+    queue.put(json.dumps(["EVENT", {"id": "e1"}]))
+    queue.put(_close("c"))  # unknown to the relay
+
+    assert _drain(queue) == [
+        ["EVENT", {"id": "e1"}],
+        ["REQ", "b", {"kinds": [2]}],
+    ]
+
+    # "b" is open on the relay now, its CLOSE is sent once
+    queue.put(_close("b"))
+    queue.put(_close("b"))
+    assert _drain(queue) == [["CLOSE", "b"]]
+    queue.put(_close("b"))
+    assert queue.qsize() == 0
+    assert queue.num_cancelled == 6
+
+
+def test_only_events_skip_the_subscriptions():
+    queue = SendQueue()
+    queue.put(_req("a"))
+    queue.put(json.dumps(["NEG-OPEN", "n1", {"kinds": [1]}, "61"]))
+    queue.put(_req("b"))
+    queue.put(json.dumps(["NEG-CLOSE", "n1"]))
+    queue.put(json.dumps(["EVENT", {"id": "e1"}]))
+
+    assert [m[0:2] for m in _drain(queue)] == [
+        ["EVENT", {"id": "e1"}],
+        ["REQ", "a"],
+        ["REQ", "b"],
+        ["NEG-OPEN", "n1"],
+        ["NEG-CLOSE", "n1"],
+    ]
+
+
+def test_paces_sends():
+    queue = SendQueue(max_rate=20)
+    for i in range(3):
+        queue.put(json.dumps(["EVENT", {"id": str(i)}]))
+    start = time.monotonic()
+    for _ in range(3):
+        queue.get(timeout=1)
+    assert time.monotonic() - start >= 0.09
+
+    with pytest.raises(Empty):
+        queue.get(timeout=0.01)
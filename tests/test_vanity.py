@@ -0,0 +1,33 @@
+import pytest
+
+from ..nostr.key import PrivateKey, mine_vanity_key
+from ..nostr.vanity import VanityMiner
+
+
+def test_mine_vanity_key():
+    sk = mine_vanity_key(prefix="q", suffix="p", workers=1)
+    npub = sk.public_key.bech32()
+    assert npub.startswith("npub1q")
+    assert npub.endswith("p")
+
+
+def test_vanity_miner_deadline():
+    miner = VanityMiner(prefix="qqqqqqqqqq", workers=1, timeout=0.1)
+    miner.start()
+    assert miner.wait(timeout=30) is None
+    assert miner.state == "expired"
+
+
+def test_vanity_miner_result():
+    miner = VanityMiner(prefix="ac", workers=2)
+    miner.start()
+    secret = miner.wait(timeout=60)
+    assert secret
+    assert miner.state == "found"
+    assert PrivateKey(secret).public_key.bech32().startswith("npub1ac")
+
+
+@pytest.mark.parametrize("prefix, suffix", [(None, None), ("b", None), (None, "1o")])
+def test_vanity_miner_invalid(prefix, suffix):
+    with pytest.raises(ValueError):
+        VanityMiner(prefix, suffix)
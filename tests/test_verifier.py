@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from ..nostr.client.client import NostrClient
+from ..nostr.event import Event
+from ..nostr.key import PrivateKey
+
+
+def signed_event(content: str) -> dict:
+    key = PrivateKey()
+    event = Event(content=content, public_key=key.public_key.hex())
+    key.sign_event(event)
+    return {
+        "id": event.id,
+        "pubkey": event.public_key,
+        "created_at": event.created_at,
+        "kind": event.kind,
+        "tags": event.tags,
+        "content": event.content,
+        "sig": event.signature,
+    }
+
+
+@pytest.mark.asyncio
+async def test_forged_copy_does_not_hide_the_genuine_event():
+    client = NostrClient()
+    client.verify_events(True)
+    pool = client.relay_manager.message_pool
+    genuine = signed_event("genuine")
+    forged = {**genuine, "sig": "00" * 64}
+    received: list = []
+    try:
+        pool.add_message(json.dumps(["EVENT", "sub1", forged]), "wss://forger")
+        await client._check_events(received.append)
+        assert received == []
+
+        pool.add_message(json.dumps(["EVENT", "sub1", genuine]), "wss://honest")
+        pool.add_message(json.dumps(["EVENT", "sub1", genuine]), "wss://other")
+        await client._check_events(received.append)
+        assert [(m.event_id, m.url) for m in received] == [
+            (genuine["id"], "wss://honest")
+        ]
+        assert client.verifier and client.verifier.num_rejected == {"wss://forger": 1}
+    finally:
+        client.verify_events(False)
@@ -1,9 +1,15 @@
 import asyncio
+import time
+from collections.abc import Callable
 from http import HTTPStatus
+from pathlib import Path
+from typing import Any
 
 from fastapi import APIRouter, Depends, HTTPException, WebSocket
+from fastapi.responses import PlainTextResponse
 from lnbits.decorators import check_admin
 from lnbits.helpers import decrypt_internal_message, urlsafe_short_hash
+from lnbits.settings import settings
 from loguru import logger
 
 from .crud import (
@@ -13,19 +19,47 @@ from .crud import (
     get_config,
     get_relays,
     update_config,
+    update_relays,
 )
 from .helpers import normalize_public_key
-from .models import Config, Relay, RelayStatus, TestMessage, TestMessageResponse
+from .models import (
+    CaptureStatus,
+    Config,
+    Relay,
+    RelaySet,
+    RelayStatus,
+    RelaysUpdate,
+    StageLatency,
+    TestMessage,
+    TestMessageResponse,
+    TracingSummary,
+    VanityRequest,
+    VanityStatus,
+)
+from .nostr.ipc import RelayManagerProxy
 from .nostr.key import EncryptedDirectMessage, PrivateKey
-from .router import NostrRouter, all_routers, nostr_client
+from .nostr.metrics import metrics
+from .nostr.recorder import FrameRecorder
+from .nostr.relay_manager import RelayManager
+from .nostr.relay_url import normalize_relay_url
+from .nostr.tracing import tracer
+from .nostr.vanity import VanityMiner
+from .router import (
+    NostrRouter,
+    all_routers,
+    apply_config,
+    ipc_leader,
+    nostr_client,
+    vanity_miners,
+)
 
 nostrclient_api_router = APIRouter()
 
 
-@nostrclient_api_router.get("/api/v1/relays", dependencies=[Depends(check_admin)])
-async def api_get_relays() -> list[Relay]:
+def _relays(relay_manager: RelayManager) -> list[dict]:
     relays = []
-    for url, r in nostr_client.relay_manager.relays.items():
+    verifier = nostr_client.verifier
+    for url, r in relay_manager.relays.items():
         relay_id = urlsafe_short_hash()
         relays.append(
             Relay(
@@ -36,16 +70,181 @@ async def api_get_relays() -> list[Relay]:
                     num_sent_events=r.num_sent_events,
                     num_received_events=r.num_received_events,
                     error_counter=r.error_counter,
-                    error_list=r.error_list,
-                    notice_list=r.notice_list,
+                    num_rejected_events=(
+                        verifier.num_rejected.get(url, 0) if verifier else 0
+                    ),
+                    num_rejected_frames=sum(r.num_rejected_frames.values()),
+                    rtt_mean_ms=int((r.heartbeat.rtt.mean or 0) * 1000),
+                    rtt_max_ms=int((r.heartbeat.rtt.max or 0) * 1000),
+                    error_list=list(r.error_list),
+                    notice_list=list(r.notice_list),
                 ),
                 ping=r.ping,
                 active=True,
-            )
+            ).dict()
         )
     return relays
 
 
+def _capture_status(recorder: FrameRecorder | None, recording: bool) -> dict:
+    if not recorder:
+        return CaptureStatus(recording=False).dict()
+    return CaptureStatus(
+        recording=recording,
+        path=recorder.path,
+        num_frames=recorder.num_frames,
+        started_at=int(recorder.started_at),
+    ).dict()
+
+
+def _start_capture(relay_manager: RelayManager) -> dict:
+    captures_dir = Path(settings.lnbits_data_folder, "nostrclient", "captures")
+    captures_dir.mkdir(parents=True, exist_ok=True)
+    path = Path(captures_dir, f"relays-{int(time.time())}.jsonl.gz")
+    recorder = relay_manager.start_recording(str(path))
+    return _capture_status(recorder, recording=True)
+
+
+# requests answered by the process that owns the relay connections
+_leader_queries: dict[str, Callable[[RelayManager], Any]] = {
+    "relays": _relays,
+    "metrics": lambda _: metrics.render(),
+    "capture": lambda m: _capture_status(m.recorder, recording=True),
+    "start_capture": _start_capture,
+    "stop_capture": lambda m: _capture_status(m.stop_recording(), recording=False),
+}
+for name, handler in _leader_queries.items():
+    ipc_leader.register_query(name, handler)
+
+
+async def _query_leader(name: str) -> Any:
+    """Runs a request of `_leader_queries` where the relay connections are."""
+    relay_manager = nostr_client.relay_manager
+    try:
+        if isinstance(relay_manager, RelayManagerProxy):
+            return await asyncio.to_thread(relay_manager.query, name)
+        return _leader_queries[name](relay_manager)
+    except ConnectionError as ex:
+        raise HTTPException(
+            status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail=str(ex)
+        ) from ex
+    except ValueError as ex:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(ex)) from ex
+
+
+@nostrclient_api_router.get("/api/v1/relays", dependencies=[Depends(check_admin)])
+async def api_get_relays() -> list[Relay]:
+    return [Relay(**relay) for relay in await _query_leader("relays")]
+
+
+@nostrclient_api_router.get(
+    "/api/v1/metrics",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(check_admin)],
+)
+async def api_get_metrics() -> str:
+    """
+    Relay multiplexer metrics in the Prometheus text exposition format.
+    Worker processes that share the relay connections of another process
+    answer with the metrics of that process.
+    """
+    return await _query_leader("metrics")
+
+
+@nostrclient_api_router.get("/api/v1/tracing", dependencies=[Depends(check_admin)])
+async def api_get_tracing() -> TracingSummary:
+    """Per-stage latency of the sampled events, from relay receive to client send."""
+    return TracingSummary(
+        sample_rate=tracer.sample_rate,
+        stages=[StageLatency(**s) for s in tracer.summary()],
+    )
+
+
+@nostrclient_api_router.delete("/api/v1/tracing", dependencies=[Depends(check_admin)])
+async def api_reset_tracing() -> None:
+    tracer.reset()
+
+
+@nostrclient_api_router.get("/api/v1/capture", dependencies=[Depends(check_admin)])
+async def api_get_capture() -> CaptureStatus:
+    return CaptureStatus(**await _query_leader("capture"))
+
+
+@nostrclient_api_router.put("/api/v1/capture", dependencies=[Depends(check_admin)])
+async def api_start_capture() -> CaptureStatus:
+    """Start capturing relay traffic, it can be replayed with `replay_frames`."""
+    return CaptureStatus(**await _query_leader("start_capture"))
+
+
+@nostrclient_api_router.delete("/api/v1/capture", dependencies=[Depends(check_admin)])
+async def api_stop_capture() -> CaptureStatus:
+    return CaptureStatus(**await _query_leader("stop_capture"))
+
+
+def _vanity_status(job_id: str, miner: VanityMiner) -> VanityStatus:
+    private_key = PrivateKey(miner.result) if miner.result else None
+    return VanityStatus(
+        id=job_id,
+        prefix=miner.prefix,
+        suffix=miner.suffix,
+        state=miner.state,
+        attempts=miner.attempts,
+        attempts_per_second=round(miner.attempts_per_second, 1),
+        expected_attempts=miner.expected_attempts,
+        elapsed_seconds=round(miner.elapsed, 3),
+        eta_seconds=round(miner.eta, 1) if miner.eta is not None else None,
+        private_key=private_key.hex() if private_key else None,
+        public_key=private_key.public_key.bech32() if private_key else None,
+    )
+
+
+def _get_vanity_miner(job_id: str) -> VanityMiner:
+    miner = vanity_miners.get(job_id)
+    if not miner:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND, detail="Vanity job not found."
+        )
+    return miner
+
+
+@nostrclient_api_router.post("/api/v1/vanity", dependencies=[Depends(check_admin)])
+async def api_start_vanity(data: VanityRequest) -> VanityStatus:
+    """Mine a key whose npub starts and/or ends with the given characters."""
+    if any(miner.running for miner in vanity_miners.values()):
+        raise HTTPException(
+            status_code=HTTPStatus.CONFLICT,
+            detail="A vanity job is already running.",
+        )
+    try:
+        miner = VanityMiner(data.prefix, data.suffix, data.workers, data.timeout)
+    except ValueError as ex:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(ex)) from ex
+
+    vanity_miners.clear()
+    job_id = urlsafe_short_hash()
+    vanity_miners[job_id] = miner
+    miner.start()
+    return _vanity_status(job_id, miner)
+
+
+@nostrclient_api_router.get(
+    "/api/v1/vanity/{job_id}", dependencies=[Depends(check_admin)]
+)
+async def api_get_vanity(job_id: str) -> VanityStatus:
+    return _vanity_status(job_id, _get_vanity_miner(job_id))
+
+
+@nostrclient_api_router.delete(
+    "/api/v1/vanity/{job_id}", dependencies=[Depends(check_admin)]
+)
+async def api_cancel_vanity(job_id: str) -> VanityStatus:
+    miner = _get_vanity_miner(job_id)
+    miner.cancel()
+    # the workers stop after their current batch
+    await asyncio.to_thread(miner.wait, 5)
+    return _vanity_status(job_id, miner)
+
+
 @nostrclient_api_router.post(
     "/api/v1/relay", status_code=HTTPStatus.OK, dependencies=[Depends(check_admin)]
 )
@@ -54,7 +253,13 @@ async def api_add_relay(relay: Relay) -> list[Relay]:
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST, detail="Relay url not provided."
         )
-    if relay.url in nostr_client.relay_manager.relays:
+    try:
+        relay.url = normalize_relay_url(relay.url)
+    except ValueError as ex:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(ex)) from ex
+    if relay.url in nostr_client.relay_manager.relays or relay.url in [
+        r.url for r in await get_relays()
+    ]:
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST,
             detail=f"Relay: {relay.url} already exists.",
@@ -67,6 +272,30 @@ async def api_add_relay(relay: Relay) -> list[Relay]:
     return await get_relays()
 
 
+@nostrclient_api_router.put("/api/v1/relays", dependencies=[Depends(check_admin)])
+async def api_set_relays(data: RelaySet) -> RelaysUpdate:
+    """
+    Replaces the relay set, relays in both sets keep their connection.
+    All URLs are validated before the first write.
+    """
+    try:
+        urls = list(dict.fromkeys(normalize_relay_url(url) for url in data.urls))
+    except ValueError as ex:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(ex)) from ex
+
+    # the difference is computed here, a follower worker cannot compute it
+    stored = await get_relays()
+    stored_urls = [r.url for r in stored]
+    added = [url for url in urls if url not in stored_urls]
+    removed = [r for r in stored if r.url not in urls]
+    await update_relays(
+        added=[Relay(id=urlsafe_short_hash(), url=url) for url in added],
+        removed=removed,
+    )
+    await asyncio.to_thread(nostr_client.relay_manager.set_relays, urls)
+    return RelaysUpdate(added=added, removed=[r.url or "" for r in removed])
+
+
 @nostrclient_api_router.delete(
     "/api/v1/relay", status_code=HTTPStatus.OK, dependencies=[Depends(check_admin)]
 )
@@ -75,8 +304,11 @@ async def api_delete_relay(relay: Relay) -> None:
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST, detail="Relay url not provided."
         )
-    # we can remove relays during runtime
-    nostr_client.relay_manager.remove_relay(relay.url)
+    try:
+        # we can remove relays during runtime
+        nostr_client.relay_manager.remove_relay(relay.url)
+    except ValueError:
+        pass  # never connected, only stored
     await delete_relay(relay)
 
 
@@ -91,7 +323,9 @@ async def api_test_endpoint(data: TestMessage) -> TestMessageResponse:
         private_key = PrivateKey(pk) if pk else PrivateKey()
 
         dm = EncryptedDirectMessage(
-            recipient_pubkey=to_public_key, cleartext_content=data.message
+            recipient_pubkey=to_public_key,
+            cleartext_content=data.message,
+            encryption=data.encryption,
         )
         private_key.sign_event(dm)
 
@@ -135,7 +369,11 @@ async def ws_relay(ws_id: str, websocket: WebSocket) -> None:
                 raise ValueError("Invalid websocket endpoint.")
 
         await websocket.accept()
-        router = NostrRouter(websocket)
+        if ws_id == "relay":
+            client_ip = websocket.client.host if websocket.client else None
+            router = NostrRouter(websocket, limits=config, client_ip=client_ip)
+        else:
+            router = NostrRouter(websocket)
         router.start()
         all_routers.append(router)
 
@@ -176,4 +414,5 @@ async def api_get_config() -> Config:
 async def api_update_config(data: Config):
     config = await update_config(owner_id="admin", config=data)
     assert config
+    apply_config(config)
     return config.dict()